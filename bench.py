@@ -0,0 +1,261 @@
+"""
+Micro-benchmarks of turtle.py's scheduled functions at synthetic universe
+sizes.
+
+For each size, a few sessions of replay.universe_bars() are replayed with
+every scheduled function and pipeline stage wrapped in a timer, so each is
+measured on the calls the algorithm really makes. The timed replay is
+repeated and the samples pooled; each replay's first call, which does the
+warm-up, is reported on its own and left out of the percentiles. A final
+replay under
+tracemalloc measures memory allocated per call. Results can be saved as a
+baseline and later runs compared against it; a function that got slower or
+allocates more than `--tolerance` times its baseline is a regression.
+
+    python bench.py --save bench_baseline.json
+    python bench.py --compare bench_baseline.json
+    python bench.py --markets 24 250 --sessions 10 --no-allocations
+"""
+import argparse
+import functools
+import json
+import logging
+import os
+import sys
+import tracemalloc
+from time import perf_counter_ns, time
+
+import numpy as np
+import pandas as pd
+
+from replay import ReplayEngine, universe_bars
+
+ALGORITHM = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'turtle.py')
+
+SIZES = [24, 250, 2500, 25000]
+
+# Scheduled functions and pipeline stages, in the order they first run
+FUNCTIONS = [
+    'get_prices',
+    'validate_prices',
+    'warm_start',
+    'compute_highs',
+    'compute_lows',
+    'update_correlations',
+    'get_contracts',
+    'refresh_orders',
+    'check_rollover',
+    'get_current_prices',
+    'compute_average_true_ranges',
+    'compute_dollar_volatilities',
+    'compute_trade_sizes',
+    'update_risks',
+    'find_triggers',
+    'detect_entry_signals',
+    'scaling_signals',
+    'place_stop_orders',
+    'stop_trigger_cleanup',
+    'detect_exit_signals',
+    'analyzing_trade_for_next_signal',
+    'rearm_triggers',
+    'turn_limit_to_market_orders',
+    'log_risks',
+    'clear_stops',
+    'flush_events',
+]
+
+
+def _timed(func, samples):
+    @functools.wraps(func)
+    def wrapper(context, data):
+        start = perf_counter_ns()
+        func(context, data)
+        samples.append(perf_counter_ns() - start)
+    return wrapper
+
+
+def _traced(func, samples):
+    @functools.wraps(func)
+    def wrapper(context, data):
+        tracemalloc.reset_peak()
+        before = tracemalloc.get_traced_memory()[0]
+        func(context, data)
+        current, peak = tracemalloc.get_traced_memory()
+        samples.append((peak - before, current - before))
+    return wrapper
+
+
+def replay(bars, wrap, algorithm=ALGORITHM):
+    """
+    Replay `bars` with every function in FUNCTIONS wrapped by
+    wrap(func, samples); returns {name: samples}.
+    """
+    engine = ReplayEngine(bars)
+    namespace = engine.load(algorithm)
+    samples = {}
+    for name in FUNCTIONS:
+        samples[name] = []
+        namespace[name] = wrap(namespace[name], samples[name])
+
+    # Swap the algorithm's universe for the synthetic one
+    initialize = namespace['initialize']
+
+    def initialize_universe(context):
+        initialize(context)
+        context.symbols = list(bars.symbols)
+        namespace['setup_markets'](context)
+
+    namespace['initialize'] = initialize_universe
+    # Debug logging formats every market; keep it out of the measurements
+    engine.run(namespace, {'is_debug': False})
+    return samples
+
+
+def benchmark(markets, sessions=5, allocations=True, seed=0, repeat=3,
+              algorithm=ALGORITHM):
+    """
+    One row per function: call count, first-call and steady-state latency
+    percentiles in microseconds, p50 nanoseconds per market and, with
+    `allocations`, mean KiB allocated (peak) and retained per call.
+    """
+    bars = universe_bars(markets, sessions=sessions, seed=seed)
+    runs = [replay(bars, _timed, algorithm) for i in range(repeat)]
+
+    allocated = {}
+    if allocations:
+        tracemalloc.start()
+        try:
+            allocated = replay(bars, _traced, algorithm)
+        finally:
+            tracemalloc.stop()
+
+    rows = []
+    for name in FUNCTIONS:
+        if len(runs[0][name]) < 2:
+            continue
+        first = np.median([run[name][0] for run in runs]) / 1000
+        samples = np.concatenate([run[name][1:] for run in runs]) / 1000
+        p50, p90, p99 = np.percentile(samples, [50, 90, 99])
+        row = {
+            'markets': markets,
+            'function': name,
+            'calls': len(runs[0][name]),
+            'first_us': first,
+            'p50_us': p50,
+            'p90_us': p90,
+            'p99_us': p99,
+            'max_us': samples.max(),
+            'ns_per_market': p50 * 1000 / markets,
+        }
+        if allocations and allocated[name]:
+            peak, retained = np.array(allocated[name], dtype=np.float64).T
+            row['alloc_kib'] = peak.mean() / 1024
+            row['retained_kib'] = retained.mean() / 1024
+        rows.append(row)
+    return pd.DataFrame(rows)
+
+
+def _key(row):
+    return '%s/%i' % (row['function'], row['markets'])
+
+
+def save_baseline(results, path):
+    with open(path, 'w') as f:
+        json.dump({_key(row): row for row in results.to_dict('records')},
+                  f, indent=1, sort_keys=True, default=float)
+
+
+def compare(results, baseline, tolerance=1.5, floor_us=100.0, floor_kib=64.0):
+    """
+    Results joined with their baseline, with the p50 and allocation ratios
+    and a `regression` flag. Differences under the floors are noise and
+    never flagged.
+    """
+    rows = []
+    for row in results.to_dict('records'):
+        base = baseline.get(_key(row))
+        if base is None:
+            continue
+        slower = row['p50_us'] / base['p50_us'] if base['p50_us'] else np.nan
+        regression = slower > tolerance\
+            and row['p50_us'] - base['p50_us'] > floor_us
+        bigger = np.nan
+        if 'alloc_kib' in row and 'alloc_kib' in base:
+            bigger = row['alloc_kib'] / base['alloc_kib']\
+                if base['alloc_kib'] else np.nan
+            regression = regression or (
+                bigger > tolerance
+                and row['alloc_kib'] - base['alloc_kib'] > floor_kib
+            )
+        rows.append({
+            'markets': row['markets'],
+            'function': row['function'],
+            'p50_us': row['p50_us'],
+            'baseline_p50_us': base['p50_us'],
+            'p50_ratio': slower,
+            'alloc_ratio': bigger,
+            'regression': regression,
+        })
+    return pd.DataFrame(rows)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--markets', type=int, nargs='+', default=SIZES)
+    parser.add_argument('--sessions', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='timed replays per size')
+    parser.add_argument('--algorithm', default=ALGORITHM)
+    parser.add_argument('--no-allocations', dest='allocations',
+                        action='store_false',
+                        help='skip the tracemalloc replay')
+    parser.add_argument('--save', metavar='BASELINE',
+                        help='store these results as the baseline')
+    parser.add_argument('--compare', metavar='BASELINE',
+                        help='compare against a stored baseline')
+    parser.add_argument('--tolerance', type=float, default=1.5,
+                        help='slowdown (or allocation growth) ratio that '
+                             'counts as a regression')
+    parser.add_argument('--floor', type=float, default=100.0,
+                        help='slowdowns of fewer microseconds are noise')
+    parser.add_argument('--output', help='write the results table as CSV')
+    args = parser.parse_args(argv)
+
+    logging.getLogger('turtle').setLevel(logging.WARNING)
+    pd.set_option('display.width', 200)
+
+    frames = []
+    for markets in args.markets:
+        start_time = time()
+        frames.append(benchmark(
+            markets,
+            args.sessions,
+            args.allocations,
+            args.seed,
+            args.repeat,
+            args.algorithm
+        ))
+        print(frames[-1].to_string(index=False, float_format='%.1f'))
+        print('%i markets in %.1fs\n' % (markets, time() - start_time))
+    results = pd.concat(frames, ignore_index=True)
+
+    if args.output:
+        results.to_csv(args.output, index=False)
+    if args.save:
+        save_baseline(results, args.save)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        comparison = compare(results, baseline, args.tolerance, args.floor)
+        print(comparison.to_string(index=False, float_format='%.2f'))
+        regressions = comparison[comparison['regression']]
+        if len(regressions):
+            print('%i regressions against %s' % (len(regressions), args.compare))
+            sys.exit(1)
+        print('No regressions against %s' % args.compare)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,308 @@
+"""
+Precomputed indicators for offline runs of turtle.py.
+
+An IndicatorCache computes each channel and average true range once over
+the whole daily history, as a (dates, markets) array, and hands the row for
+a date to the algorithm through context.indicators. Every run over the same
+bars reads the same arrays, whichever session it starts on, so walk-forward
+windows and sweep points do not rebuild rolling state.
+
+Given an IndicatorStore, computed series also persist on disk, one file per
+(symbol, indicator, parameters, data hash), so later runs over the same bars
+load them instead of computing them. A symbol whose bars change gets a new
+hash, and its old files are dropped the next time it is computed.
+
+Channels and N match what turtle.py computes for itself. N depends on the
+bar its smoothing starts from: the algorithm asks for the series seeded
+where its own N would have been. Only the true ranges, which do not depend
+on it, are stored; N is smoothed from them, from the seeding bar on, the
+first time a run asks for that bar.
+"""
+import hashlib
+import os
+
+import numpy as np
+import pandas as pd
+
+
+def rolling_extreme(values, window, highest=True):
+    """
+    Max (or min) of the last `window` rows of a (dates, markets) array,
+    ignoring NaNs; NaN where the whole window is NaN.
+    """
+    rolling = pd.DataFrame(values).rolling(window, min_periods=1)
+    return (rolling.max() if highest else rolling.min()).values
+
+
+def true_range(highs, lows, closes):
+    """
+    True range of (dates, markets) arrays, from each market's previous bar
+    with every price; NaN for bars with a missing price and for a market's
+    first bar.
+    """
+    valid = ~(np.isnan(highs) | np.isnan(lows) | np.isnan(closes))
+    previous_close = pd.DataFrame(np.where(valid, closes, np.nan))\
+        .ffill().shift(1).values
+    ranges = np.maximum(
+        highs - lows,
+        np.maximum(
+            np.abs(highs - previous_close),
+            np.abs(lows - previous_close)
+        )
+    )
+    ranges[~valid] = np.nan
+    return ranges
+
+
+def wilder_average(true_ranges, period):
+    """
+    Wilder average of (dates, markets) true ranges, stepping through dates
+    with every market at once: the mean of the first `period` ranges, then
+    smoothed. NaN ranges are skipped. With true_range() this is
+    turtle.AverageTrueRange.series laid out by date; turtle.py runs on its
+    own, so it cannot share this module.
+    """
+    markets = true_ranges.shape[1]
+    result = np.full(true_ranges.shape, np.nan)
+    value = np.full(markets, np.nan)
+    count = np.zeros(markets, dtype=np.int64)
+    total = np.zeros(markets)
+
+    for t in range(len(true_ranges)):
+        ranges = true_ranges[t]
+        ready = ~np.isnan(ranges)
+
+        seeding = ready & (count < period)
+        count[seeding] += 1
+        total[seeding] += ranges[seeding]
+        seeded = seeding & (count == period)
+        value[seeded] = total[seeded] / period
+
+        smoothing = ready & ~seeding
+        value[smoothing] = (value[smoothing] * (period - 1)
+                            + ranges[smoothing]) / period
+
+        result[t] = value
+    return result
+
+
+class IndicatorStore(object):
+    """
+    Indicator series on disk, a .npy column per file:
+
+        <path>/<ROOT>/<indicator>-<data hash>.npy
+
+    Reading a file marks it used (its mtime); once the files take more than
+    `max_bytes`, the least recently used go first.
+    """
+    def __init__(self, path, max_bytes=1 << 30):
+        self.path = path
+        self.max_bytes = max_bytes
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        self.size = sum(size for name, mtime, size in self.files())
+
+    def files(self):
+        for root, dirs, names in os.walk(self.path):
+            for name in names:
+                if name.endswith('.npy'):
+                    filename = os.path.join(root, name)
+                    info = os.stat(filename)
+                    yield filename, info.st_mtime, info.st_size
+
+    def filename(self, sym, name, digest):
+        return os.path.join(self.path, sym, '%s-%s.npy' % (name, digest))
+
+    def load(self, sym, name, digest):
+        filename = self.filename(sym, name, digest)
+        try:
+            values = np.load(filename)
+        except (IOError, OSError, ValueError):
+            return None
+        os.utime(filename, None)
+        return values
+
+    def save(self, sym, name, digest, values):
+        filename = self.filename(sym, name, digest)
+        directory = os.path.dirname(filename)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        # Series of this indicator over older bars are stale now. Other
+        # workers may be clearing them too, or have just written this one.
+        prefix = name + '-'
+        for other in os.listdir(directory):
+            if other == os.path.basename(filename)\
+                or not other.startswith(prefix) or not other.endswith('.npy')\
+                or len(other) != len(prefix) + len(digest) + 4:
+                continue
+            stale = os.path.join(directory, other)
+            try:
+                size = os.path.getsize(stale)
+            except OSError:
+                continue
+            try:
+                os.remove(stale)
+            except FileNotFoundError:
+                pass
+            except OSError:
+                continue
+            self.size = max(self.size - size, 0)
+
+        # Write then rename, so concurrent readers never see half a file
+        temporary = '%s.%i.tmp' % (filename, os.getpid())
+        with open(temporary, 'wb') as f:
+            np.save(f, values)
+        try:
+            replaced = os.path.getsize(filename)
+        except OSError:
+            replaced = 0
+        os.replace(temporary, filename)
+        self.size += os.path.getsize(filename) - replaced
+        if self.size > self.max_bytes:
+            self.evict()
+
+    def evict(self):
+        """
+        Remove least recently used files until the store is down to 90%
+        of `max_bytes`.
+        """
+        files = sorted(self.files(), key=lambda info: info[1])
+        self.size = sum(size for name, mtime, size in files)
+        for filename, mtime, size in files:
+            if self.size <= 0.9 * self.max_bytes:
+                break
+            try:
+                os.remove(filename)
+            except OSError:
+                continue
+            self.size -= size
+
+
+class IndicatorCache(object):
+    """
+    Indicator arrays over the daily history of a replay.Bars, computed the
+    first time they are asked for, or read from `store` when it has them.
+    """
+    def __init__(self, bars, store=None):
+        self.bars = bars
+        self.store = store
+        self.arrays = {}
+        self._columns = {}
+        self._digests = {}
+
+    def columns(self, symbols):
+        """
+        Column of each root symbol in the bar arrays, -1 for unknown roots.
+        """
+        key = tuple(symbols)
+        columns = self._columns.get(key)
+        if columns is None:
+            columns = self._columns[key] = np.array(
+                [self.bars.column(sym) for sym in symbols]
+            )
+        return columns
+
+    def array(self, key):
+        values = self.arrays.get(key)
+        if values is None:
+            # N is derived from the true ranges, which are stored, for
+            # each seeding bar asked for
+            if self.store is None or key[0] == 'atr':
+                values = self.compute(key)
+            else:
+                values = self.load(key)
+            values = self.arrays[key] = values
+        return values
+
+    def compute(self, key, columns=slice(None)):
+        """
+        Indicator `key` over the daily history, for the bar array
+        `columns` (all of them by default).
+        """
+        daily = self.bars.daily
+        if key[0] == 'channel':
+            name, field, window, highest = key
+            return rolling_extreme(daily[field][:, columns], window, highest)
+        if key[0] == 'true_range':
+            return true_range(
+                daily['high'][:, columns],
+                daily['low'][:, columns],
+                daily['close'][:, columns]
+            )
+        if key[0] == 'atr':
+            name, period, since = key
+            start = self.bars.daily_dates.searchsorted(pd.Timestamp(since))
+            ranges = self.array(('true_range',))[start:][:, columns].copy()
+            # Smoothing from `since` has no close before it, so each
+            # market's first bar with every price there has no range
+            valid = ~np.isnan(daily['close'][start:, columns])
+            for field in ('high', 'low'):
+                valid &= ~np.isnan(daily[field][start:, columns])
+            first = valid.argmax(axis=0)
+            markets = np.flatnonzero(valid.any(axis=0))
+            ranges[first[markets], markets] = np.nan
+
+            values = np.full(daily['close'][:, columns].shape, np.nan)
+            values[start:] = wilder_average(ranges, period)
+            return values
+        raise KeyError(key)
+
+    def digest(self, column):
+        """
+        Hash of one market's dates and daily bars; any change to them
+        changes the files its indicators are stored under.
+        """
+        digest = self._digests.get(column)
+        if digest is None:
+            daily = self.bars.daily
+            h = hashlib.sha1(self.bars.daily_dates.asi8.tobytes())
+            for field in ('high', 'low', 'close'):
+                h.update(np.ascontiguousarray(daily[field][:, column]).tobytes())
+            digest = self._digests[column] = h.hexdigest()[:16]
+        return digest
+
+    def load(self, key):
+        """
+        Indicator `key` for every market, read from the store where it has
+        the series and computed (and stored) for the markets it does not.
+        """
+        name = '-'.join(str(part) for part in key)
+        symbols = self.bars.symbols
+        values = np.full(self.bars.daily['close'].shape, np.nan)
+
+        missing = []
+        for column, sym in enumerate(symbols):
+            stored = self.store.load(sym, name, self.digest(column))
+            if stored is None or len(stored) != len(values):
+                missing.append(column)
+            else:
+                values[:, column] = stored
+
+        if missing:
+            computed = self.compute(key, missing)
+            for i, column in enumerate(missing):
+                values[:, column] = computed[:, i]
+                self.store.save(
+                    symbols[column],
+                    name,
+                    self.digest(column),
+                    computed[:, i]
+                )
+        return values
+
+    def row(self, key, symbols, date):
+        """
+        Values of indicator `key` on `date`, ordered like `symbols`.
+        """
+        values = self.array(key)
+        return values[self.bars.daily_dates.get_loc(date), self.columns(symbols)]
+
+    def channel(self, symbols, field, window, highest, date):
+        return self.row(('channel', field, window, highest), symbols, date)
+
+    def average_true_range(self, symbols, period, date, since):
+        """
+        N on `date`, smoothed from the bar on `since` (ns since epoch) on.
+        """
+        return self.row(('atr', period, int(since)), symbols, date)
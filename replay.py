@@ -0,0 +1,1473 @@
+"""
+Offline replay engine for turtle.py.
+
+Implements the subset of the Quantopian/zipline API that the algorithm uses
+(schedule_function, data.history, data.current, order, order_target,
+get_order, get_open_orders, cancel_order, continuous_future, record, ...)
+and replays on-disk daily and minute bars through it.
+
+Data directory layout:
+
+    daily/<ROOT>.csv    date,open,high,low,close,volume
+    minute/<ROOT>.csv   dt,open,high,low,close,volume
+    contracts.csv       root_symbol,symbol,auto_close_date,expiration_date,multiplier
+
+Minute timestamps label the end of the bar, so the first bar of a session is
+open_time + 1 minute. Contracts are priced off their root's continuous series.
+Bars built in memory may span several minutes each (`bar_minutes`); time
+rules then fire on the bar that ends at or after their minute.
+
+A local tick feed (CSV of dt,root_symbol,price,size, in time order) can take
+the place of the minute directory; it is read in chunks and aggregated into
+minute bars as it streams past (--ticks). With --stream, the algorithm sees
+every minute bar through handle_data instead of its 30-minute grid.
+
+turtle.py can checkpoint its state at every close (--checkpoint) and a later
+run can resume from one (--restore), starting at the session after it.
+
+write_cube() stores loaded bars as a directory of .npy arrays that
+open_cube() memory-maps read-only, so any number of processes can share one
+copy of the history without parsing it again:
+
+    python replay.py path/to/data --ingest path/to/cube
+    python replay.py path/to/cube
+"""
+import argparse
+import json
+import logging
+import os
+from time import time
+
+import numpy as np
+import pandas as pd
+
+FIELDS = ['open', 'high', 'low', 'close', 'volume']
+
+# turtle.py's universe, used for synthetic runs.
+SYMBOLS = [
+    'BP', 'CD', 'CL', 'ED', 'GC', 'HG', 'HO', 'HU', 'JY', 'SB', 'SF', 'SP',
+    'SV', 'TB', 'TY', 'US', 'CN', 'SY', 'WC', 'ES', 'NQ', 'YM', 'QM', 'FV',
+]
+
+# Order status codes, as in zipline.
+OPEN = 0
+FILLED = 1
+CANCELLED = 2
+REJECTED = 3
+
+
+class Asset(object):
+    """
+    Base for anything data can be asked about. `_col` indexes the bar arrays.
+    """
+    def __init__(self, sid, symbol, root_symbol, col):
+        self.sid = sid
+        self.symbol = symbol
+        self.root_symbol = root_symbol
+        self._col = col
+
+    def __repr__(self):
+        return '%s(%s [%s])' % (type(self).__name__, self.sid, self.symbol)
+
+    def __lt__(self, other):
+        return self.sid < other.sid
+
+
+class Future(Asset):
+    def __init__(self, sid, symbol, root_symbol, col,
+                 auto_close_date, expiration_date, multiplier):
+        Asset.__init__(self, sid, symbol, root_symbol, col)
+        self.auto_close_date = auto_close_date
+        self.expiration_date = expiration_date
+        self.multiplier = multiplier
+
+
+class ContinuousFuture(Asset):
+    def __init__(self, sid, root_symbol, col, offset, roll, adjustment):
+        Asset.__init__(self, sid, root_symbol, root_symbol, col)
+        self.offset = offset
+        self.roll = roll
+        self.adjustment = adjustment
+
+
+class MarketOrder(object):
+    def __init__(self, exchange=None):
+        self.limit_price = None
+        self.stop_price = None
+
+
+class LimitOrder(object):
+    def __init__(self, limit_price, asset=None, exchange=None):
+        self.limit_price = limit_price
+        self.stop_price = None
+
+
+class StopOrder(object):
+    def __init__(self, stop_price, asset=None, exchange=None):
+        self.limit_price = None
+        self.stop_price = stop_price
+
+
+class StopLimitOrder(object):
+    def __init__(self, limit_price, stop_price, asset=None, exchange=None):
+        self.limit_price = limit_price
+        self.stop_price = stop_price
+
+
+class Order(object):
+    __slots__ = (
+        'id', 'dt', 'created', 'sid', 'amount', 'filled', 'commission',
+        'limit', 'stop', 'limit_reached', 'stop_reached', 'status', 'reason',
+        '_row',
+    )
+
+    def __init__(self, order_id, dt, asset, amount, limit, stop, row):
+        self.id = order_id
+        self.dt = dt
+        self.created = dt
+        self.sid = asset
+        self.amount = amount
+        self.filled = 0
+        self.commission = 0
+        self.limit = limit
+        self.stop = stop
+        self.limit_reached = False
+        self.stop_reached = False
+        self.status = OPEN
+        self.reason = None
+        self._row = row
+
+    @property
+    def asset(self):
+        return self.sid
+
+    def snapshot(self):
+        """
+        Copy handed to the algorithm; like zipline's, it does not update.
+        """
+        copy = Order.__new__(Order)
+        for name in Order.__slots__:
+            setattr(copy, name, getattr(self, name))
+        return copy
+
+    @property
+    def open(self):
+        return self.status == OPEN
+
+    def __repr__(self):
+        return 'Order(%s %s %i limit=%s stop=%s status=%i)' % (
+            self.id, self.sid.symbol, self.amount,
+            self.limit, self.stop, self.status
+        )
+
+
+class Position(object):
+    __slots__ = ('asset', 'amount', 'cost_basis', 'last_sale_price')
+
+    def __init__(self, asset, amount=0, cost_basis=0.0, last_sale_price=0.0):
+        self.asset = asset
+        self.amount = amount
+        self.cost_basis = cost_basis
+        self.last_sale_price = last_sale_price
+
+    @property
+    def sid(self):
+        return self.asset
+
+
+class Positions(dict):
+    """
+    Missing assets read as an empty position, like zipline.
+    """
+    def __missing__(self, asset):
+        return Position(asset)
+
+
+class Portfolio(object):
+    def __init__(self, engine, starting_cash):
+        self._engine = engine
+        self.starting_cash = starting_cash
+        self.cash = starting_cash
+        self.positions = Positions()
+
+    @property
+    def positions_value(self):
+        # Futures carry no notional value, only their open P&L.
+        return 0.0
+
+    @property
+    def portfolio_value(self):
+        value = self.cash
+        for asset, position in self.positions.items():
+            price = self._engine._last_price(asset)
+            if price == price:
+                position.last_sale_price = price
+            value += (position.last_sale_price - position.cost_basis)\
+                * position.amount\
+                * asset.multiplier
+        return value
+
+    @property
+    def pnl(self):
+        return self.portfolio_value - self.starting_cash
+
+    @property
+    def returns(self):
+        return self.pnl / self.starting_cash
+
+
+class AlgorithmContext(object):
+    pass
+
+
+def set_parameter(context, key, value):
+    """
+    Set a tunable on the context. Dotted keys reach into what initialize
+    set; a list is indexed by its items' names, so 'systems.two.exit' is
+    the exit of the breakout system named 'two'.
+    """
+    *path, name = key.split('.')
+    target = context
+    for part in path:
+        if isinstance(target, list):
+            matches = [item for item in target if getattr(item, 'name', None) == part]
+            if not matches:
+                raise AttributeError('initialize does not set %s' % key)
+            target = matches[0]
+        elif hasattr(target, part):
+            target = getattr(target, part)
+        else:
+            raise AttributeError('initialize does not set %s' % key)
+    if not hasattr(target, name):
+        raise AttributeError('initialize does not set %s' % key)
+    setattr(target, name, value)
+
+
+class Bars(object):
+    """
+    Aligned daily and minute bars for a fixed list of root symbols.
+
+    Arrays carry one extra, all-NaN column at index -1 so that assets the
+    data does not know about read as missing instead of failing.
+    """
+    def __init__(self, symbols, daily_dates, daily, sessions, minute,
+                 contracts, minutes=390, open_time='9:30', bar_minutes=1):
+        self.symbols = list(symbols)
+        self.daily_dates = pd.DatetimeIndex(daily_dates)
+        self.daily = daily
+        self.sessions = pd.DatetimeIndex(sessions)
+        self.minute = minute
+        self.contracts = contracts
+        self.minutes = minutes
+        self.bar_minutes = bar_minutes
+        self.open_clock = open_time
+        self.open_time = pd.Timedelta(open_time + ':00')
+        self._columns = {sym: i for i, sym in enumerate(self.symbols)}
+        self.session_daily_index = self.daily_dates.get_indexer(self.sessions)
+        if (self.session_daily_index < 0).any():
+            raise ValueError('Every minute session needs a daily calendar entry')
+        if 'price' not in self.minute:
+            self.minute['price'] = _forward_fill(self.minute['close'])
+
+    @property
+    def minute_bars(self):
+        return len(self.sessions) * self.minutes * len(self.symbols)
+
+    def window(self, first, last):
+        """
+        Bars for sessions[first:last]. Minute arrays are views of this
+        object's, and the whole daily history stays visible for warm-up.
+        """
+        rows = slice(first * self.minutes, last * self.minutes)
+        return Bars(
+            self.symbols,
+            self.daily_dates,
+            self.daily,
+            self.sessions[first:last],
+            {field: values[rows] for field, values in self.minute.items()},
+            self.contracts,
+            self.minutes,
+            self.open_clock,
+            self.bar_minutes
+        )
+
+    def between(self, start=None, end=None):
+        """
+        Bars for the sessions from `start` to `end`, both included, as
+        window() returns them.
+        """
+        first = 0 if start is None\
+            else self.sessions.searchsorted(pd.Timestamp(start))
+        last = len(self.sessions) if end is None\
+            else self.sessions.searchsorted(pd.Timestamp(end), side='right')
+        return self.window(first, last)
+
+    def column(self, root_symbol):
+        return self._columns.get(root_symbol, -1)
+
+
+def _forward_fill(values):
+    """
+    Forward fill NaNs down the time axis of a (rows, columns) array.
+    """
+    mask = np.isnan(values)
+    index = np.where(~mask, np.arange(len(values))[:, None], 0)
+    np.maximum.accumulate(index, axis=0, out=index)
+    # Leading NaNs point at row 0, which is itself NaN.
+    return values[index, np.arange(values.shape[1])]
+
+
+def _padded(values):
+    """
+    Append the all-NaN column used for unknown assets.
+    """
+    return np.hstack([values, np.full((len(values), 1), np.nan)])
+
+
+def quarterly_contracts(symbols, start, end, multipliers=None):
+    """
+    Quarterly (H, M, U, Z) contract chains, auto-closing ten days before the
+    15th of the delivery month.
+    """
+    multipliers = multipliers or {}
+    months = pd.date_range(
+        pd.Timestamp(start) - pd.DateOffset(months=3),
+        pd.Timestamp(end) + pd.DateOffset(months=6),
+        freq='QS-MAR'
+    )
+    codes = {3: 'H', 6: 'M', 9: 'U', 12: 'Z'}
+    suffixes = ['%s%02d' % (codes[month.month], month.year % 100)
+                for month in months]
+    expirations = months + pd.Timedelta(days=14)
+    return pd.DataFrame({
+        'root_symbol': np.repeat(symbols, len(months)),
+        'symbol': [sym + suffix for sym in symbols for suffix in suffixes],
+        'auto_close_date': np.tile(expirations - pd.Timedelta(days=10), len(symbols)),
+        'expiration_date': np.tile(expirations, len(symbols)),
+        'multiplier': np.repeat(
+            [multipliers.get(sym, 1000.0) for sym in symbols], len(months)
+        ),
+    })
+
+
+def _contract_chains(frame, symbols):
+    columns = {sym: i for i, sym in enumerate(symbols)}
+    chains = {}
+    for i, row in enumerate(
+        frame.sort_values(['root_symbol', 'auto_close_date']).itertuples()
+    ):
+        col = columns.get(row.root_symbol, -1)
+        if col < 0:
+            continue
+        chains.setdefault(row.root_symbol, []).append(Future(
+            1000000 + i,
+            row.symbol,
+            row.root_symbol,
+            col,
+            pd.Timestamp(row.auto_close_date),
+            pd.Timestamp(row.expiration_date),
+            float(row.multiplier),
+        ))
+    return chains
+
+
+def read_ticks(path, chunksize=1000000):
+    """
+    A tick CSV (dt,root_symbol,price,size) as a generator of DataFrame
+    chunks, so a feed never has to fit in memory at once.
+    """
+    for chunk in pd.read_csv(path, parse_dates=['dt'], chunksize=chunksize):
+        yield chunk
+
+
+def minute_bars_from_ticks(ticks):
+    """
+    Minute bars from an iterable of tick chunks in time order, keyed by
+    root symbol, as frames shaped like minute/<ROOT>.csv. A tick goes to
+    the bar ending at the next whole minute.
+    """
+    parts = []
+    for chunk in ticks:
+        chunk = chunk.assign(
+            dt=chunk['dt'].dt.floor('min') + pd.Timedelta(minutes=1)
+        )
+        parts.append(chunk.groupby(['root_symbol', 'dt'], sort=False).agg(
+            open=('price', 'first'),
+            high=('price', 'max'),
+            low=('price', 'min'),
+            close=('price', 'last'),
+            volume=('size', 'sum'),
+        ))
+    if not parts:
+        return {}
+
+    # A minute split across two chunks is aggregated once more
+    bars = pd.concat(parts).groupby(level=[0, 1], sort=True).agg(
+        open=('open', 'first'),
+        high=('high', 'max'),
+        low=('low', 'min'),
+        close=('close', 'last'),
+        volume=('volume', 'sum'),
+    )
+    return {
+        sym: frame.reset_index(level=0, drop=True).reset_index()
+        for sym, frame in bars.groupby(level=0)
+    }
+
+
+def load_bars(path, symbols=None, start=None, end=None,
+              minutes=390, open_time='9:30', ticks=None):
+    """
+    Load a data directory (see module docstring) into a Bars object.
+    Minute bars come from `ticks`, an iterable of tick chunks (see
+    read_ticks), instead of the minute directory when it is given.
+    """
+    daily_dir = os.path.join(path, 'daily')
+    minute_dir = os.path.join(path, 'minute')
+    if symbols is None:
+        symbols = sorted(
+            os.path.splitext(name)[0] for name in os.listdir(daily_dir)
+            if name.endswith('.csv')
+        )
+
+    frames = {}
+    for sym in symbols:
+        frame = pd.read_csv(
+            os.path.join(daily_dir, sym + '.csv'),
+            parse_dates=['date'],
+            index_col='date'
+        )
+        frames[sym] = frame
+    daily_dates = sorted(set().union(*[f.index for f in frames.values()]))
+    daily_dates = pd.DatetimeIndex(daily_dates)
+    if end is not None:
+        daily_dates = daily_dates[daily_dates <= pd.Timestamp(end)]
+    daily = {
+        field: _padded(np.column_stack([
+            frames[sym][field].reindex(daily_dates).values.astype(np.float64)
+            for sym in symbols
+        ]))
+        for field in FIELDS
+    }
+
+    open_offset = pd.Timedelta(open_time + ':00')
+    minute_frames = {}
+    if ticks is not None:
+        minute_frames = {
+            sym: frame for sym, frame in minute_bars_from_ticks(ticks).items()
+            if sym in frames
+        }
+    else:
+        for sym in symbols:
+            filename = os.path.join(minute_dir, sym + '.csv')
+            if os.path.exists(filename):
+                minute_frames[sym] = pd.read_csv(filename, parse_dates=['dt'])
+    session_set = set()
+    for frame in minute_frames.values():
+        session_set.update(frame['dt'].dt.normalize().unique())
+    sessions = pd.DatetimeIndex(sorted(session_set))
+    sessions = sessions[sessions.isin(daily_dates)]
+    if start is not None:
+        sessions = sessions[sessions >= pd.Timestamp(start)]
+
+    rows = len(sessions) * minutes
+    minute = {
+        field: np.full((rows, len(symbols) + 1), np.nan) for field in FIELDS
+    }
+    for sym, frame in minute_frames.items():
+        col = symbols.index(sym)
+        day = frame['dt'].dt.normalize()
+        session = sessions.get_indexer(day)
+        offset = ((frame['dt'] - day - open_offset)
+                  // pd.Timedelta(minutes=1)).values - 1
+        keep = (session >= 0) & (offset >= 0) & (offset < minutes)
+        row = session[keep] * minutes + offset[keep]
+        for field in FIELDS:
+            minute[field][row, col] = frame[field].values[keep]
+
+    contracts_file = os.path.join(path, 'contracts.csv')
+    if os.path.exists(contracts_file):
+        contract_frame = pd.read_csv(
+            contracts_file,
+            parse_dates=['auto_close_date', 'expiration_date']
+        )
+    else:
+        contract_frame = quarterly_contracts(
+            symbols, daily_dates[0], daily_dates[-1]
+        )
+
+    return Bars(
+        symbols,
+        daily_dates,
+        daily,
+        sessions,
+        minute,
+        _contract_chains(contract_frame, list(symbols)),
+        minutes,
+        open_time
+    )
+
+
+def synthetic_bars(symbols, sessions=250, warmup=120, minutes=390,
+                   start='2010-01-04', seed=0):
+    """
+    Random-walk daily and minute bars, for smoke tests and benchmarks.
+    Only the last `sessions` days get minute bars; the rest are warm-up.
+    """
+    rng = np.random.default_rng(seed)
+    n = len(symbols)
+    days = warmup + sessions
+    daily_dates = pd.bdate_range(start, periods=days)
+
+    # Slowly changing drift gives the channels some trends to break out of.
+    drift = np.repeat(
+        rng.normal(0, 0.0015, (days // 40 + 1, n)), 40, axis=0
+    )[:days] / minutes
+    steps = rng.normal(0, 0.015 / np.sqrt(minutes), (days, minutes, n))
+    steps += drift[:, None, :]
+    start_price = rng.uniform(20, 2000, n)
+    close = start_price * np.exp(np.cumsum(steps.reshape(-1, n), axis=0))
+    opens = np.vstack([start_price[None, :], close[:-1]])
+    wiggle = np.abs(rng.normal(0, 0.0005, close.shape))
+    high = np.maximum(opens, close) * (1 + wiggle)
+    low = np.minimum(opens, close) * (1 - wiggle)
+    volume = rng.integers(1, 500, close.shape).astype(np.float64)
+
+    by_day = lambda a: a.reshape(days, minutes, n)
+    daily = {
+        'open': by_day(opens)[:, 0, :],
+        'high': by_day(high).max(axis=1),
+        'low': by_day(low).min(axis=1),
+        'close': by_day(close)[:, -1, :],
+        'volume': by_day(volume).sum(axis=1),
+    }
+    daily = {field: _padded(values) for field, values in daily.items()}
+    first = warmup * minutes
+    minute = {
+        'open': _padded(opens[first:]),
+        'high': _padded(high[first:]),
+        'low': _padded(low[first:]),
+        'close': _padded(close[first:]),
+        'volume': _padded(volume[first:]),
+    }
+    # Multipliers put every contract at roughly $100k notional.
+    contracts = quarterly_contracts(
+        symbols, daily_dates[0], daily_dates[-1],
+        {sym: float(max(round(1e5 / p), 1)) for sym, p in zip(symbols, start_price)}
+    )
+    return Bars(
+        symbols,
+        daily_dates,
+        daily,
+        daily_dates[warmup:],
+        minute,
+        _contract_chains(contracts, list(symbols)),
+        minutes
+    )
+
+
+def universe_bars(markets, sessions=5, warmup=60, minutes=26, bar_minutes=15,
+                  start='2010-01-04', seed=0):
+    """
+    Random-walk bars for `markets` made-up roots (M00000, M00001, ...).
+    Warm-up days are drawn as daily bars only and sessions default to
+    15-minute bars, so memory stays small enough for benchmarks at tens of
+    thousands of markets.
+    """
+    rng = np.random.default_rng(seed)
+    symbols = ['M%05i' % i for i in range(markets)]
+    days = warmup + sessions
+    daily_dates = pd.bdate_range(start, periods=days)
+    start_price = rng.uniform(20, 2000, markets)
+    # A steady drift per market, so channels get broken in both directions
+    drift = rng.normal(0, 0.003, markets)
+
+    close = start_price * np.exp(np.cumsum(
+        rng.normal(drift, 0.015, (warmup, markets)), axis=0
+    ))
+    opens = np.vstack([start_price[None, :], close[:-1]])
+    wiggle = np.abs(rng.normal(0, 0.005, (2, warmup, markets)))
+    warm = {
+        'open': opens,
+        'high': np.maximum(opens, close) * (1 + wiggle[0]),
+        'low': np.minimum(opens, close) * (1 - wiggle[1]),
+        'close': close,
+        'volume': rng.integers(1, 10000, close.shape).astype(np.float64),
+    }
+
+    steps = rng.normal(
+        drift / minutes,
+        0.015 / np.sqrt(minutes),
+        (sessions * minutes, markets)
+    )
+    bar_close = close[-1] * np.exp(np.cumsum(steps, axis=0))
+    bar_open = np.vstack([close[-1][None, :], bar_close[:-1]])
+    wiggle = np.abs(rng.normal(0, 0.0005, (2,) + bar_close.shape))
+    minute = {
+        'open': bar_open,
+        'high': np.maximum(bar_open, bar_close) * (1 + wiggle[0]),
+        'low': np.minimum(bar_open, bar_close) * (1 - wiggle[1]),
+        'close': bar_close,
+        'volume': rng.integers(1, 500, bar_close.shape).astype(np.float64),
+    }
+
+    by_day = lambda a: a.reshape(sessions, minutes, markets)
+    daily = {
+        'open': np.vstack([warm['open'], by_day(minute['open'])[:, 0]]),
+        'high': np.vstack([warm['high'], by_day(minute['high']).max(axis=1)]),
+        'low': np.vstack([warm['low'], by_day(minute['low']).min(axis=1)]),
+        'close': np.vstack([warm['close'], by_day(minute['close'])[:, -1]]),
+        'volume': np.vstack([warm['volume'], by_day(minute['volume']).sum(axis=1)]),
+    }
+
+    contracts = quarterly_contracts(
+        symbols, daily_dates[0], daily_dates[-1],
+        {sym: float(max(round(1e5 / p), 1)) for sym, p in zip(symbols, start_price)}
+    )
+    return Bars(
+        symbols,
+        daily_dates,
+        {field: _padded(values) for field, values in daily.items()},
+        daily_dates[warmup:],
+        {field: _padded(values) for field, values in minute.items()},
+        _contract_chains(contracts, symbols),
+        minutes,
+        bar_minutes=bar_minutes
+    )
+
+
+def write_cube(bars, path):
+    """
+    Store bars as .npy arrays plus metadata, for open_cube().
+    """
+    if not os.path.isdir(path):
+        os.makedirs(path)
+    for field, values in bars.daily.items():
+        np.save(os.path.join(path, 'daily_%s.npy' % field), values)
+    for field, values in bars.minute.items():
+        np.save(os.path.join(path, 'minute_%s.npy' % field), values)
+    np.save(os.path.join(path, 'daily_dates.npy'), bars.daily_dates.values)
+    np.save(os.path.join(path, 'sessions.npy'), bars.sessions.values)
+
+    pd.DataFrame([
+        {
+            'root_symbol': contract.root_symbol,
+            'symbol': contract.symbol,
+            'auto_close_date': contract.auto_close_date,
+            'expiration_date': contract.expiration_date,
+            'multiplier': contract.multiplier,
+        }
+        for chain in bars.contracts.values() for contract in chain
+    ]).to_csv(os.path.join(path, 'contracts.csv'), index=False)
+
+    with open(os.path.join(path, 'meta.json'), 'w') as f:
+        json.dump({
+            'symbols': bars.symbols,
+            'minutes': bars.minutes,
+            'open_time': bars.open_clock,
+            'bar_minutes': bars.bar_minutes,
+            'daily_fields': sorted(bars.daily),
+            'minute_fields': sorted(bars.minute),
+        }, f)
+
+
+def open_cube(path, start=None, end=None):
+    """
+    Memory-map a cube written by write_cube(), keeping the sessions from
+    `start` to `end`. Arrays are read-only views of the files, shared
+    through the page cache by every process that opens the same cube.
+    """
+    with open(os.path.join(path, 'meta.json')) as f:
+        meta = json.load(f)
+    mapped = lambda name: np.load(os.path.join(path, name), mmap_mode='r')
+
+    contracts = pd.read_csv(
+        os.path.join(path, 'contracts.csv'),
+        parse_dates=['auto_close_date', 'expiration_date']
+    )
+    return Bars(
+        meta['symbols'],
+        np.load(os.path.join(path, 'daily_dates.npy')),
+        {field: mapped('daily_%s.npy' % field) for field in meta['daily_fields']},
+        np.load(os.path.join(path, 'sessions.npy')),
+        {field: mapped('minute_%s.npy' % field) for field in meta['minute_fields']},
+        _contract_chains(contracts, meta['symbols']),
+        meta['minutes'],
+        meta['open_time'],
+        meta.get('bar_minutes', 1)
+    ).between(start, end)
+
+
+def is_cube(path):
+    return os.path.exists(os.path.join(path, 'meta.json'))
+
+
+def open_bars(path, start=None, end=None, ticks=None):
+    """
+    Open a cube, or load a CSV data directory, with minute bars from a
+    tick CSV if `ticks` names one. Either way only the sessions from
+    `start` to `end` are replayed.
+    """
+    if is_cube(path):
+        return open_cube(path, start, end)
+    return load_bars(
+        path,
+        start=start,
+        end=end,
+        ticks=read_ticks(ticks) if ticks else None
+    )
+
+
+def checkpoint_date(path):
+    """
+    Session a turtle.py checkpoint was saved at the close of.
+    """
+    with np.load(path) as f:
+        return pd.Timestamp(f['date'][()])
+
+
+class _DateRule(object):
+    def __init__(self, predicate):
+        self.predicate = predicate
+
+
+def _nth_session_of(period, n):
+    """
+    True on the n-th session of each period (week, month).
+    """
+    def predicate(sessions, s):
+        if s - n < 0 or period(sessions[s - n]) != period(sessions[s]):
+            return False
+        return s - n == 0 or period(sessions[s - n - 1]) != period(sessions[s])
+    return predicate
+
+
+class date_rules(object):
+    @staticmethod
+    def every_day():
+        return _DateRule(lambda sessions, s: True)
+
+    @staticmethod
+    def week_start(days_offset=0):
+        return _DateRule(_nth_session_of(
+            lambda day: day.isocalendar()[:2], days_offset
+        ))
+
+    @staticmethod
+    def month_start(days_offset=0):
+        return _DateRule(_nth_session_of(
+            lambda day: (day.year, day.month), days_offset
+        ))
+
+
+class _TimeRule(object):
+    def __init__(self, from_open, offset):
+        self.from_open = from_open
+        self.offset = offset
+
+    def minute(self, minutes, bar_minutes=1):
+        """
+        Session row the rule fires at. Zero offsets mean one minute, as in
+        zipline.
+        """
+        offset = max(-(-self.offset // bar_minutes), 1)
+        if self.from_open:
+            return min(offset - 1, minutes - 1)
+        return max(minutes - 1 - offset, 0)
+
+
+class time_rules(object):
+    @staticmethod
+    def market_open(offset=None, hours=0, minutes=0):
+        return _TimeRule(True, hours * 60 + minutes)
+
+    @staticmethod
+    def market_close(offset=None, hours=0, minutes=0):
+        return _TimeRule(False, hours * 60 + minutes)
+
+
+class _AlgoLog(object):
+    """
+    Quantopian's `log`, stamped with simulation time.
+    """
+    def __init__(self, engine, logger):
+        self._engine = engine
+        self._logger = logger
+
+    def isEnabledFor(self, level):
+        return self._logger.isEnabledFor(level)
+
+    def _emit(self, level, msg):
+        if self._logger.isEnabledFor(level):
+            self._logger.log(level, '%s %s' % (self._engine.get_datetime(), msg))
+
+    def debug(self, msg):
+        self._emit(logging.DEBUG, msg)
+
+    def info(self, msg):
+        self._emit(logging.INFO, msg)
+
+    def warn(self, msg):
+        self._emit(logging.WARNING, msg)
+
+    warning = warn
+
+    def error(self, msg):
+        self._emit(logging.ERROR, msg)
+
+
+class BarData(object):
+    """
+    The `data` object handed to scheduled functions.
+    """
+    def __init__(self, engine):
+        self._engine = engine
+
+    def _value(self, asset, field):
+        e = self._engine
+        if field == 'contract':
+            return e._active_contract(asset)
+        if field in ('price', 'last_traded'):
+            return e._price[e._row, asset._col]
+        return e._bars.minute[field][e._row, asset._col]
+
+    def current(self, assets, fields):
+        if isinstance(assets, Asset):
+            if isinstance(fields, str):
+                return self._value(assets, fields)
+            return pd.Series([self._value(assets, f) for f in fields], index=fields)
+        assets = list(assets)
+        if isinstance(fields, str):
+            if fields == 'contract':
+                values = [self._engine._active_contract(a) for a in assets]
+                return pd.Series(values, index=assets, dtype=object)
+            cols = [a._col for a in assets]
+            return pd.Series(self._value_row(fields)[cols], index=assets)
+        return pd.DataFrame(
+            {f: self.current(assets, f) for f in fields},
+            index=assets
+        )
+
+    def _value_row(self, field):
+        e = self._engine
+        if field in ('price', 'last_traded'):
+            return e._price[e._row]
+        return e._bars.minute[field][e._row]
+
+    def history(self, assets, fields, bar_count, frequency):
+        e = self._engine
+        single_asset = isinstance(assets, Asset)
+        asset_list = [assets] if single_asset else list(assets)
+        field_list = [fields] if isinstance(fields, str) else list(fields)
+        cols = [a._col for a in asset_list]
+
+        if frequency == '1d':
+            index, block = e._daily_window(field_list, bar_count)
+        elif frequency == '1m':
+            index, block = e._minute_window(field_list, bar_count)
+        else:
+            raise ValueError('Unsupported frequency %s' % frequency)
+
+        if isinstance(fields, str):
+            values = block[field_list[0]][:, cols]
+            if single_asset:
+                return pd.Series(values[:, 0], index=index, name=assets)
+            return pd.DataFrame(values, index=index, columns=asset_list)
+        if single_asset:
+            return pd.DataFrame(
+                {f: block[f][:, cols[0]] for f in field_list},
+                index=index
+            )
+        multi = pd.MultiIndex.from_product([index, asset_list])
+        return pd.DataFrame(
+            {f: block[f][:, cols].ravel() for f in field_list},
+            index=multi
+        )
+
+    def can_trade(self, assets):
+        if isinstance(assets, Asset):
+            return self._value(assets, 'price') == self._value(assets, 'price')
+        return pd.Series([self.can_trade(a) for a in assets], index=list(assets))
+
+    def is_stale(self, assets):
+        e = self._engine
+        if isinstance(assets, Asset):
+            return e._bars.minute['close'][e._row, assets._col] != \
+                e._bars.minute['close'][e._row, assets._col]
+        return pd.Series([self.is_stale(a) for a in assets], index=list(assets))
+
+    def current_chain(self, continuous_future):
+        return self._engine._chain(continuous_future)
+
+
+class ReplayResult(object):
+    def __init__(self, context, equity, recorded, transactions,
+                 elapsed, minute_bars):
+        self.context = context
+        self.equity = equity
+        self.recorded = recorded
+        self.transactions = transactions
+        self.elapsed = elapsed
+        self.minute_bars = minute_bars
+
+    @property
+    def bars_per_second(self):
+        return self.minute_bars / self.elapsed if self.elapsed else float('inf')
+
+
+class ReplayEngine(object):
+    """
+    Event-driven replay of a zipline-style algorithm over a Bars object.
+
+    Only the minutes that have scheduled functions are visited in Python;
+    resting orders are matched against the bars in between with array scans.
+    Orders fill in full at the close of the first bar after they are placed
+    that satisfies their limit or stop. Open orders are cancelled at the end
+    of each session when `eod_cancel` is set (Quantopian's futures default).
+    """
+    def __init__(self, bars, capital_base=1e6, eod_cancel=True,
+                 logger=None):
+        self._bars = bars
+        self._price = bars.minute['price']
+        self.capital_base = capital_base
+        self.eod_cancel = eod_cancel
+        self.logger = logger or logging.getLogger('turtle')
+        self._continuous = {}
+        self._seed = None
+        self._chain_dates = {
+            sym: np.array(
+                [c.auto_close_date.value for c in chain], dtype=np.int64
+            )
+            for sym, chain in bars.contracts.items()
+        }
+
+    # -- lifecycle ---------------------------------------------------------
+
+    def api(self):
+        """
+        Globals injected into the algorithm's namespace.
+        """
+        return {
+            'schedule_function': self.schedule_function,
+            'date_rules': date_rules,
+            'time_rules': time_rules,
+            'order': self.order,
+            'order_target': self.order_target,
+            'order_target_percent': self.order_target_percent,
+            'get_order': self.get_order,
+            'get_open_orders': self.get_open_orders,
+            'cancel_order': self.cancel_order,
+            'continuous_future': self.continuous_future,
+            'future_symbol': self.future_symbol,
+            'record': self.record,
+            'get_datetime': self.get_datetime,
+            'log': _AlgoLog(self, self.logger),
+            'MarketOrder': MarketOrder,
+            'LimitOrder': LimitOrder,
+            'StopOrder': StopOrder,
+            'StopLimitOrder': StopLimitOrder,
+        }
+
+    def load(self, path):
+        """
+        Execute an algorithm file with the API injected; return its namespace.
+        """
+        namespace = dict(self.api())
+        namespace['__name__'] = os.path.splitext(os.path.basename(path))[0]
+        namespace['__file__'] = path
+        with open(path) as f:
+            source = f.read()
+        exec(compile(source, path, 'exec'), namespace)
+        return namespace
+
+    def _reset(self):
+        self._schedule = []
+        self._orders = {}
+        self._open_orders = {}
+        self._order_count = 0
+        self._recorded = []
+        self._record_today = {}
+        self._transactions = []
+        self._session = 0
+        self._minute = 0
+        self._row = 0
+        self._partial = None
+        self.portfolio = Portfolio(self, self.capital_base)
+
+    def seed_portfolio(self, checkpoint):
+        """
+        Set cash and positions from a turtle.py checkpoint (see
+        save_checkpoint), so a run can fork from the middle of another.
+        The bars must start after the session the checkpoint was saved on.
+        """
+        date = checkpoint_date(checkpoint)
+        if len(self._bars.sessions) and self._bars.sessions[0] <= date:
+            raise ValueError(
+                '%s was saved at the close of %s; replay from a later session'
+                % (checkpoint, date.date())
+            )
+        with np.load(checkpoint) as f:
+            self._seed = (
+                float(f['cash']),
+                list(zip(
+                    f['position_symbols'].tolist(),
+                    f['position_amounts'].tolist(),
+                    f['position_cost_basis'].tolist()
+                ))
+            )
+
+    def run(self, namespace, params=None):
+        """
+        Run initialize and every scheduled function over all sessions.
+
+        `params` are set on the context after initialize (see
+        set_parameter), which is how the strategy's tunables are
+        overridden. handle_data, if the algorithm has one, runs on every
+        bar unless the context's `streaming` is false; skipping it spares
+        visiting every minute. As in zipline, it runs before the functions
+        scheduled for the same minute.
+        """
+        self._reset()
+        if self._seed is not None:
+            cash, positions = self._seed
+            self.portfolio.cash = cash
+            for symbol, amount, cost_basis in positions:
+                asset = self.future_symbol(symbol)
+                self.portfolio.positions[asset] = Position(
+                    asset, amount, cost_basis, cost_basis
+                )
+        bars = self._bars
+        n = bars.minutes
+        context = AlgorithmContext()
+        context.portfolio = self.portfolio
+        data = BarData(self)
+
+        namespace['initialize'](context)
+        for key, value in (params or {}).items():
+            set_parameter(context, key, value)
+        before_trading_start = namespace.get('before_trading_start')
+        handle_data = namespace.get('handle_data')
+
+        events = {}
+        for date_rule, time_rule, func in self._schedule:
+            events.setdefault(time_rule.minute(n, bars.bar_minutes), []).append((date_rule, func))
+        if handle_data is not None and getattr(context, 'streaming', True):
+            for minute in range(n):
+                events.setdefault(minute, []).insert(0, (None, handle_data))
+        events = sorted(events.items())
+
+        equity = np.empty(len(bars.sessions))
+        start_time = time()
+        for s in range(len(bars.sessions)):
+            self._session = s
+            base = s * n
+            self._minute = 0
+            self._row = base
+            self._partial = None
+            self._auto_close(s)
+            if before_trading_start is not None:
+                before_trading_start(context, data)
+            cursor = base
+            for minute, funcs in events:
+                row = base + minute
+                self._process_orders(cursor, row)
+                cursor = row + 1
+                self._minute = minute
+                self._row = row
+                for date_rule, func in funcs:
+                    if date_rule is None or date_rule.predicate(bars.sessions, s):
+                        func(context, data)
+            self._process_orders(cursor, base + n - 1)
+            self._minute = n - 1
+            self._row = base + n - 1
+            if self.eod_cancel:
+                for asset in list(self._open_orders):
+                    for o in list(self._open_orders[asset]):
+                        self.cancel_order(o)
+            equity[s] = self.portfolio.portfolio_value
+            self._recorded.append(dict(self._record_today))
+        elapsed = time() - start_time
+
+        analyze = namespace.get('analyze')
+        result = ReplayResult(
+            context,
+            pd.Series(equity, index=bars.sessions, name='portfolio_value'),
+            pd.DataFrame(self._recorded, index=bars.sessions),
+            pd.DataFrame(
+                self._transactions,
+                columns=['dt', 'asset', 'amount', 'price', 'order_id']
+            ),
+            elapsed,
+            bars.minute_bars
+        )
+        if analyze is not None:
+            analyze(context, result)
+        return result
+
+    # -- clock and data ----------------------------------------------------
+
+    def get_datetime(self, tz=None):
+        return self._bars.sessions[self._session]\
+            + self._bars.open_time\
+            + pd.Timedelta(minutes=(self._minute + 1) * self._bars.bar_minutes)
+
+    def _last_price(self, asset):
+        return self._price[self._row, asset._col]
+
+    def _daily_window(self, fields, bar_count):
+        """
+        `bar_count` daily bars ending with today's partial bar.
+        """
+        bars = self._bars
+        today = bars.session_daily_index[self._session]
+        first = today - bar_count + 1
+        index = bars.daily_dates[max(first, 0):today + 1]
+        partial = self._partial_bar()
+        block = {}
+        for field in fields:
+            values = bars.daily[field][max(first, 0):today + 1].copy()
+            values[-1] = partial[field]
+            if first < 0:
+                values = np.vstack([
+                    np.full((-first, values.shape[1]), np.nan), values
+                ])
+            block[field] = values
+        if first < 0:
+            index = pd.DatetimeIndex(
+                [pd.NaT] * -first + list(index)
+            )
+        return index, block
+
+    def _partial_bar(self):
+        if self._partial is None or self._partial[0] != self._row:
+            minute = self._bars.minute
+            base = self._session * self._bars.minutes
+            rows = slice(base, self._row + 1)
+            opens = minute['open'][rows]
+            first = np.argmax(~np.isnan(opens), axis=0)
+            self._partial = (self._row, {
+                'open': opens[first, np.arange(opens.shape[1])],
+                'high': np.fmax.reduce(minute['high'][rows], axis=0),
+                'low': np.fmin.reduce(minute['low'][rows], axis=0),
+                'close': self._price[self._row],
+                'volume': np.nansum(minute['volume'][rows], axis=0),
+            })
+        return self._partial[1]
+
+    def _minute_window(self, fields, bar_count):
+        bars = self._bars
+        first = max(self._row - bar_count + 1, 0)
+        rows = np.arange(first, self._row + 1)
+        index = bars.sessions[rows // bars.minutes]\
+            + bars.open_time\
+            + pd.to_timedelta(
+                (rows % bars.minutes + 1) * bars.bar_minutes, unit='m'
+            )
+        block = {}
+        for field in fields:
+            source = self._price if field == 'price' else bars.minute[field]
+            block[field] = source[first:self._row + 1]
+        return index, block
+
+    # -- assets ------------------------------------------------------------
+
+    def continuous_future(self, root_symbol, offset=0, roll='volume',
+                          adjustment='mul'):
+        key = (root_symbol, offset, roll, adjustment)
+        if key not in self._continuous:
+            self._continuous[key] = ContinuousFuture(
+                len(self._continuous),
+                root_symbol,
+                self._bars.column(root_symbol),
+                offset,
+                roll,
+                adjustment
+            )
+        return self._continuous[key]
+
+    def _chain(self, continuous_future):
+        root = continuous_future.root_symbol
+        chain = self._bars.contracts.get(root, [])
+        if not chain:
+            return []
+        today = self._bars.sessions[self._session].value
+        first = np.searchsorted(self._chain_dates[root], today, side='right')
+        return chain[first + continuous_future.offset:]
+
+    def _active_contract(self, asset):
+        if isinstance(asset, Future):
+            return asset
+        chain = self._chain(asset)
+        return chain[0] if chain else None
+
+    def future_symbol(self, symbol):
+        for chain in self._bars.contracts.values():
+            for contract in chain:
+                if contract.symbol == symbol:
+                    return contract
+        raise KeyError(symbol)
+
+    # -- orders ------------------------------------------------------------
+
+    def order(self, asset, amount, limit_price=None, stop_price=None,
+              style=None):
+        amount = int(amount)
+        if amount == 0:
+            return None
+        if not isinstance(asset, Future):
+            raise TypeError('Can only order futures contracts, got %r' % asset)
+        if style is not None:
+            limit_price = style.limit_price
+            stop_price = style.stop_price
+        self._order_count += 1
+        order_id = '%032x' % self._order_count
+        o = Order(
+            order_id,
+            self.get_datetime(),
+            asset,
+            amount,
+            limit_price,
+            stop_price,
+            self._row
+        )
+        self._orders[order_id] = o
+        self._open_orders.setdefault(asset, []).append(o)
+        return order_id
+
+    def order_target(self, asset, target, limit_price=None, stop_price=None,
+                     style=None):
+        amount = target - self.portfolio.positions[asset].amount
+        return self.order(asset, amount, limit_price, stop_price, style)
+
+    def order_target_percent(self, asset, target, limit_price=None,
+                             stop_price=None, style=None):
+        if target == 0:
+            return self.order_target(asset, 0, limit_price, stop_price, style)
+        price = self._last_price(asset)
+        contracts = target * self.portfolio.portfolio_value\
+            / (price * asset.multiplier)
+        return self.order_target(
+            asset, int(contracts), limit_price, stop_price, style
+        )
+
+    def get_order(self, order_id):
+        o = self._orders.get(order_id)
+        return o.snapshot() if o is not None else None
+
+    def get_open_orders(self, asset=None):
+        if asset is None:
+            return {a: [o.snapshot() for o in orders]
+                    for a, orders in self._open_orders.items() if orders}
+        return [o.snapshot() for o in self._open_orders.get(asset, [])]
+
+    def cancel_order(self, order_param):
+        if isinstance(order_param, Order):
+            order_param = order_param.id
+        o = self._orders.get(order_param)
+        if o is None or o.status != OPEN:
+            return
+        o.status = CANCELLED
+        self._open_orders[o.sid].remove(o)
+        if not self._open_orders[o.sid]:
+            del self._open_orders[o.sid]
+
+    def _process_orders(self, first, last):
+        """
+        Match open orders against bars first..last (global rows, inclusive).
+        """
+        if not self._open_orders or last < first:
+            return
+        close = self._bars.minute['close']
+        for asset in list(self._open_orders):
+            for o in list(self._open_orders.get(asset, ())):
+                start = max(first, o._row + 1)
+                if start > last:
+                    continue
+                prices = close[start:last + 1, asset._col]
+                buy = o.amount > 0
+                if o.stop is not None and not o.stop_reached:
+                    hits = prices >= o.stop if buy else prices <= o.stop
+                    if not hits.any():
+                        continue
+                    stop_row = int(np.argmax(hits))
+                    o.stop_reached = True
+                    prices = prices[stop_row:]
+                    start += stop_row
+                if o.limit is not None:
+                    hits = prices <= o.limit if buy else prices >= o.limit
+                else:
+                    hits = ~np.isnan(prices)
+                if not hits.any():
+                    continue
+                hit = int(np.argmax(hits))
+                if o.limit is not None:
+                    o.limit_reached = True
+                self._fill(o, prices[hit], start + hit)
+
+    def _fill(self, o, price, row):
+        session, minute = divmod(row, self._bars.minutes)
+        dt = self._bars.sessions[session]\
+            + self._bars.open_time\
+            + pd.Timedelta(minutes=(minute + 1) * self._bars.bar_minutes)
+        o.filled = o.amount
+        o.status = FILLED
+        o.dt = dt
+        self._open_orders[o.sid].remove(o)
+        if not self._open_orders[o.sid]:
+            del self._open_orders[o.sid]
+        self._transact(o.sid, o.amount, price)
+        self._transactions.append((dt, o.sid, o.amount, price, o.id))
+
+    def _transact(self, asset, amount, price):
+        positions = self.portfolio.positions
+        position = positions.get(asset)
+        if position is None:
+            positions[asset] = Position(asset, amount, price, price)
+            return
+        held = position.amount
+        if held * amount > 0:
+            position.cost_basis = (position.cost_basis * held + price * amount)\
+                / (held + amount)
+        else:
+            closed = min(abs(held), abs(amount))
+            self.portfolio.cash += (price - position.cost_basis)\
+                * closed\
+                * np.sign(held)\
+                * asset.multiplier
+            if abs(amount) > abs(held):
+                position.cost_basis = price
+        position.amount = held + amount
+        position.last_sale_price = price
+        if position.amount == 0:
+            del positions[asset]
+
+    def _auto_close(self, session):
+        """
+        Close positions and cancel orders in contracts past auto-close.
+        """
+        today = self._bars.sessions[session]
+        for asset in list(self._open_orders):
+            if asset.auto_close_date <= today:
+                for o in list(self._open_orders[asset]):
+                    self.cancel_order(o)
+        for asset, position in list(self.portfolio.positions.items()):
+            if asset.auto_close_date <= today:
+                row = max(session * self._bars.minutes - 1, 0)
+                price = self._price[row, asset._col]
+                if price != price:
+                    price = position.last_sale_price
+                self._transact(asset, -position.amount, price)
+
+    # -- recording ---------------------------------------------------------
+
+    def record(self, *args, **kwargs):
+        args = iter(args)
+        for name, value in zip(args, args):
+            self._record_today[name] = value
+        self._record_today.update(kwargs)
+
+    def schedule_function(self, func, date_rule=None, time_rule=None,
+                          half_days=True, calendar=None):
+        self._schedule.append((
+            date_rule or date_rules.every_day(),
+            time_rule or time_rules.market_open(),
+            func
+        ))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('data', nargs='?',
+                        help='data directory; omit to use synthetic bars')
+    parser.add_argument('--algorithm', default=os.path.join(
+        os.path.dirname(os.path.abspath(__file__)), 'turtle.py'))
+    parser.add_argument('--start')
+    parser.add_argument('--end')
+    parser.add_argument('--capital', type=float, default=1e6)
+    parser.add_argument('--sessions', type=int, default=250,
+                        help='synthetic sessions')
+    parser.add_argument('--log-level', default='WARNING')
+    parser.add_argument('--ticks', metavar='CSV',
+                        help='tick feed to build the minute bars from')
+    parser.add_argument('--stream', action='store_true',
+                        help='run the intraday logic on every minute bar')
+    parser.add_argument('--checkpoint', metavar='NPZ',
+                        help="save the algorithm's state at every close; "
+                             "'{date}' in the path becomes the session date")
+    parser.add_argument('--restore', metavar='NPZ',
+                        help='start from a checkpoint, with its portfolio, '
+                             'at the session after it (or at --start)')
+    parser.add_argument('--indicator-cache', metavar='DIR',
+                        help='read channels and N from (and store them in) '
+                             'an on-disk indicator cache')
+    parser.add_argument('--ingest', metavar='CUBE',
+                        help='write the bars to a memory-mappable cube and exit')
+    parser.add_argument('--profile', metavar='CSV',
+                        help="write the algorithm's profiler stats as CSV")
+    parser.add_argument('--profile-allocations', action='store_true',
+                        help='also count bytes allocated per call (slow)')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=args.log_level, format='%(message)s')
+    if args.data:
+        bars = open_bars(
+            args.data,
+            start=args.start,
+            end=args.end,
+            ticks=args.ticks
+        )
+    else:
+        bars = synthetic_bars(SYMBOLS, sessions=args.sessions)\
+            .between(args.start, args.end)
+    if args.restore:
+        saved = checkpoint_date(args.restore)
+        if args.start is None:
+            bars = bars.between(saved + pd.Timedelta(days=1))
+        elif pd.Timestamp(args.start) <= saved:
+            parser.error(
+                '--start must be after %s, the session %s was saved on'
+                % (saved.date(), args.restore)
+            )
+
+    if args.ingest:
+        write_cube(bars, args.ingest)
+        print('Wrote %i sessions of %i markets to %s' % (
+            len(bars.sessions), len(bars.symbols), args.ingest
+        ))
+        return
+
+    engine = ReplayEngine(bars, capital_base=args.capital)
+    namespace = engine.load(args.algorithm)
+    params = {}
+    if args.stream:
+        params['streaming'] = True
+    if args.checkpoint:
+        params['checkpoint_path'] = args.checkpoint
+    if args.restore:
+        params['restore_from'] = args.restore
+        engine.seed_portfolio(args.restore)
+    if args.indicator_cache:
+        from indicators import IndicatorCache, IndicatorStore
+        params['indicators'] = IndicatorCache(
+            bars,
+            IndicatorStore(args.indicator_cache)
+        )
+    if args.profile:
+        params['profiler'] = namespace['Profiler'](
+            allocations=args.profile_allocations
+        )
+    result = engine.run(namespace, params)
+    print('%i sessions, %i minute bars in %.2fs (%.0f bars/s)' % (
+        len(bars.sessions),
+        result.minute_bars,
+        result.elapsed,
+        result.bars_per_second
+    ))
+    print('Final portfolio value: %.2f' % result.equity.iloc[-1])
+    print('Transactions: %i' % len(result.transactions))
+    if args.profile:
+        result.context.profiler.table().to_csv(args.profile, index=False)
+
+
+if __name__ == '__main__':
+    main()
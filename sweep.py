@@ -0,0 +1,183 @@
+"""
+Parameter sweeps of turtle.py over a process pool.
+
+Every combination of a parameter grid is replayed with replay.py. Given a
+cube (see replay.write_cube), each worker memory-maps it when it starts, so
+all workers share one read-only copy of the history. Otherwise the bars are
+loaded once, before the pool starts, and handed to each worker.
+
+    python sweep.py path/to/data --grid systems.one.breakout=20,30,40 \
+        --grid stop_multiplier=1.5,2,2.5 --processes 8 --output sweep.csv
+"""
+import argparse
+import itertools
+import logging
+import multiprocessing
+import os
+from time import time
+
+import numpy as np
+import pandas as pd
+
+from replay import ReplayEngine, SYMBOLS, is_cube, open_bars, open_cube,\
+    synthetic_bars
+
+ALGORITHM = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'turtle.py')
+
+# Tunables set in initialize that a grid may override
+PARAMETERS = [
+    'systems.one.breakout',
+    'systems.one.exit',
+    'systems.two.breakout',
+    'systems.two.exit',
+    'stop_multiplier',
+    'capital_risk_per_trade',
+    'market_risk_limit',
+    'closely_correlated_limit',
+    'loosely_correlated_limit',
+    'correlation_window',
+    'close_correlation',
+    'loose_correlation',
+    'direction_risk_limit',
+]
+
+_worker = {}
+
+
+def grid_points(grid):
+    """
+    Every combination of a {parameter: [values]} grid, as a list of dicts.
+    """
+    names = list(grid)
+    for name in names:
+        if name not in PARAMETERS:
+            raise ValueError(
+                'Unknown parameter %s (expected one of %s)'
+                % (name, ', '.join(PARAMETERS))
+            )
+    return [
+        dict(zip(names, values))
+        for values in itertools.product(*[grid[name] for name in names])
+    ]
+
+
+def performance(equity, capital_base):
+    """
+    Summary statistics of a daily portfolio value series.
+    """
+    returns = equity.pct_change().dropna()
+    volatility = returns.std()
+    return {
+        'final_value': equity.iloc[-1],
+        'total_return': equity.iloc[-1] / capital_base - 1,
+        'max_drawdown': (equity / equity.cummax() - 1).min(),
+        'sharpe': returns.mean() / volatility * np.sqrt(252)
+        if volatility > 0 else np.nan,
+    }
+
+
+def _init_worker(bars, algorithm, capital_base, start=None, end=None):
+    logging.getLogger('turtle').setLevel(logging.WARNING)
+    if isinstance(bars, str):
+        bars = open_cube(bars, start, end)
+    _worker['engine'] = ReplayEngine(bars, capital_base=capital_base)
+    _worker['algorithm'] = algorithm
+
+
+def _run_point(point):
+    i, params = point
+    engine = _worker['engine']
+    # A fresh namespace per run, so no module state leaks between points
+    result = engine.run(engine.load(_worker['algorithm']), params)
+    row = dict(params)
+    row.update(performance(result.equity, engine.capital_base))
+    row['transactions'] = len(result.transactions)
+    row['elapsed'] = result.elapsed
+    return i, row
+
+
+def sweep(bars, grid, processes=None, algorithm=ALGORITHM, capital_base=1e6,
+          start=None, end=None):
+    """
+    Replay every point of `grid` over `bars` (a Bars object, or a cube path
+    whose sessions from `start` to `end` are replayed); one row per point,
+    in grid order.
+    """
+    points = list(enumerate(grid_points(grid)))
+    initargs = (bars, algorithm, capital_base, start, end)
+
+    if processes == 1:
+        _init_worker(*initargs)
+        rows = [_run_point(point) for point in points]
+    else:
+        pool = multiprocessing.Pool(processes, _init_worker, initargs)
+        try:
+            rows = list(pool.imap_unordered(_run_point, points))
+        finally:
+            pool.close()
+            pool.join()
+
+    rows.sort(key=lambda row: row[0])
+    return pd.DataFrame([row for i, row in rows])
+
+
+def parse_grid(specs):
+    grid = {}
+    for spec in specs:
+        name, _, values = spec.partition('=')
+        grid[name] = [_parse_value(value) for value in values.split(',')]
+    return grid
+
+
+def _parse_value(value):
+    try:
+        return int(value)
+    except ValueError:
+        return float(value)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('data', nargs='?',
+                        help='data directory; omit to use synthetic bars')
+    parser.add_argument('--grid', action='append', default=[],
+                        metavar='NAME=V1,V2,...')
+    parser.add_argument('--processes', type=int, default=None)
+    parser.add_argument('--algorithm', default=ALGORITHM)
+    parser.add_argument('--start')
+    parser.add_argument('--end')
+    parser.add_argument('--capital', type=float, default=1e6)
+    parser.add_argument('--sessions', type=int, default=250,
+                        help='synthetic sessions')
+    parser.add_argument('--output', help='write the results table as CSV')
+    args = parser.parse_args(argv)
+
+    if args.data and is_cube(args.data):
+        bars = args.data
+    elif args.data:
+        bars = open_bars(args.data, start=args.start, end=args.end)
+    else:
+        bars = synthetic_bars(SYMBOLS, sessions=args.sessions)\
+            .between(args.start, args.end)
+
+    start_time = time()
+    results = sweep(
+        bars,
+        parse_grid(args.grid),
+        args.processes,
+        args.algorithm,
+        args.capital,
+        args.start,
+        args.end
+    )
+    elapsed = time() - start_time
+
+    pd.set_option('display.width', 200)
+    print(results.to_string(index=False))
+    print('%i runs in %.1fs' % (len(results), elapsed))
+    if args.output:
+        results.to_csv(args.output, index=False)
+
+
+if __name__ == '__main__':
+    main()
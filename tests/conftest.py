@@ -0,0 +1,52 @@
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from replay import AlgorithmContext, ReplayEngine, SYMBOLS, synthetic_bars
+
+ALGORITHM = os.path.join(ROOT, 'turtle.py')
+
+
+@pytest.fixture(scope='session')
+def bars():
+    return synthetic_bars(SYMBOLS, sessions=40)
+
+
+@pytest.fixture
+def engine(bars):
+    return ReplayEngine(bars)
+
+
+@pytest.fixture
+def turtle(engine):
+    """
+    turtle.py's namespace, loaded with the replay API injected.
+    """
+    return engine.load(ALGORITHM)
+
+
+@pytest.fixture
+def context(engine, turtle):
+    """
+    A context as turtle.py's initialize leaves it, outside of a run.
+    """
+    engine._reset()
+    context = AlgorithmContext()
+    context.portfolio = engine.portfolio
+    turtle['initialize'](context)
+    return context
+
+
+def replay(bars, params=None, seed=None):
+    """
+    Run turtle.py over `bars`; `seed` is a checkpoint to start from.
+    """
+    engine = ReplayEngine(bars)
+    namespace = engine.load(ALGORITHM)
+    if seed is not None:
+        engine.seed_portfolio(seed)
+    return engine.run(namespace, params)
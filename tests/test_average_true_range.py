@@ -0,0 +1,66 @@
+import numpy as np
+import pytest
+
+
+def wilder(highs, lows, closes, period):
+    """
+    Plain Wilder N of one market after each bar, skipping missing bars.
+    """
+    result, value, previous_close, true_ranges = [], np.nan, None, []
+    for high, low, close in zip(highs, lows, closes):
+        if not np.isnan(high + low + close):
+            if previous_close is not None:
+                true_range = max(high - low, abs(high - previous_close),
+                                 abs(low - previous_close))
+                if len(true_ranges) < period:
+                    true_ranges.append(true_range)
+                    if len(true_ranges) == period:
+                        value = sum(true_ranges) / period
+                else:
+                    value = (value * (period - 1) + true_range) / period
+            previous_close = close
+        result.append(value)
+    return result
+
+
+@pytest.fixture
+def prices():
+    rng = np.random.default_rng(0)
+    closes = 100 + rng.standard_normal((3, 80)).cumsum(axis=1)
+    highs = closes + rng.random((3, 80))
+    lows = closes - rng.random((3, 80))
+    closes[1, 10] = np.nan
+    return highs, lows, closes
+
+
+def test_series_is_wilder_n(turtle, prices):
+    highs, lows, closes = prices
+    series = turtle['AverageTrueRange'].series(highs, lows, closes, 20)
+    for market in range(3):
+        np.testing.assert_allclose(
+            series[market],
+            wilder(highs[market], lows[market], closes[market], 20)
+        )
+
+
+def test_update_pushes_only_unseen_bars(turtle, prices):
+    # A sliding 30-bar window, as the price store hands it over, with the
+    # third market joining 10 bars late
+    highs, lows, closes = prices
+    dates = np.arange(80).astype('datetime64[D]').astype('datetime64[ns]')
+    state = turtle['AverageTrueRange'](20, 3)
+    for end in range(30, 81):
+        rows = np.array([0, 1, 2] if end >= 40 else [0, 1])
+        window = slice(end - 30, end)
+        state.update(
+            dates[window],
+            highs[rows, window],
+            lows[rows, window],
+            closes[rows, window],
+            rows
+        )
+
+    for market, first in [(0, 0), (1, 0), (2, 10)]:
+        expected = wilder(highs[market, first:], lows[market, first:],
+                          closes[market, first:], 20)[-1]
+        np.testing.assert_allclose(state.value[market], expected)
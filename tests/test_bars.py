@@ -0,0 +1,72 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from replay import FIELDS, open_bars, synthetic_bars, write_cube
+
+
+@pytest.fixture(scope='module')
+def source():
+    return synthetic_bars(['AA', 'BB'], sessions=6, warmup=30, minutes=390)
+
+
+@pytest.fixture(scope='module')
+def csv_dir(source, tmp_path_factory):
+    """
+    `source` written out as a CSV data directory.
+    """
+    path = tmp_path_factory.mktemp('data')
+    os.makedirs(os.path.join(path, 'daily'))
+    os.makedirs(os.path.join(path, 'minute'))
+    minute_times = (
+        source.sessions.repeat(source.minutes)
+        + source.open_time
+        + pd.to_timedelta(
+            np.tile(np.arange(1, source.minutes + 1), len(source.sessions)),
+            unit='m'
+        )
+    )
+    for col, sym in enumerate(source.symbols):
+        daily = pd.DataFrame(
+            {field: source.daily[field][:, col] for field in FIELDS},
+            index=pd.Index(source.daily_dates, name='date')
+        )
+        daily.to_csv(os.path.join(path, 'daily', sym + '.csv'))
+        minute = pd.DataFrame(
+            {field: source.minute[field][:, col] for field in FIELDS},
+            index=pd.Index(minute_times, name='dt')
+        )
+        minute.to_csv(os.path.join(path, 'minute', sym + '.csv'))
+    return str(path)
+
+
+@pytest.fixture(scope='module')
+def cube_dir(source, tmp_path_factory):
+    path = str(tmp_path_factory.mktemp('cube'))
+    write_cube(source, path)
+    return path
+
+
+@pytest.mark.parametrize('kind', ['csv', 'cube'])
+def test_start_and_end_slice_sessions(kind, source, csv_dir, cube_dir):
+    path = csv_dir if kind == 'csv' else cube_dir
+    start, end = source.sessions[1], source.sessions[4]
+
+    bars = open_bars(path, start=start.date(), end=end.date())
+
+    assert list(bars.sessions) == list(source.sessions[1:5])
+    assert len(bars.minute['close']) == 4 * source.minutes
+    np.testing.assert_allclose(
+        bars.minute['close'][:, :2],
+        source.minute['close'][source.minutes:5 * source.minutes, :2]
+    )
+    # Daily history before the first session stays visible for warm-up
+    assert bars.daily_dates[0] == source.daily_dates[0]
+
+
+@pytest.mark.parametrize('kind', ['csv', 'cube'])
+def test_no_bounds_keep_every_session(kind, source, csv_dir, cube_dir):
+    bars = open_bars(csv_dir if kind == 'csv' else cube_dir)
+    assert list(bars.sessions) == list(source.sessions)
@@ -0,0 +1,64 @@
+import json
+
+import pandas as pd
+
+from bench import FUNCTIONS, benchmark, compare, replay, save_baseline
+from replay import universe_bars
+
+
+def results(**p50_us):
+    return pd.DataFrame([
+        {'markets': 250, 'function': name, 'p50_us': p50, 'alloc_kib': 100.0}
+        for name, p50 in p50_us.items()
+    ])
+
+
+def test_replay_swaps_in_the_synthetic_universe():
+    bars = universe_bars(30, sessions=2)
+    universes = []
+
+    def wrap(func, samples):
+        def wrapper(context, data):
+            universes.append(list(context.markets.index))
+            func(context, data)
+            samples.append(0)
+        return wrapper
+
+    samples = replay(bars, wrap)
+    assert set(samples) == set(FUNCTIONS)
+    assert len(samples['get_prices']) == 2
+    assert all(universe == bars.symbols for universe in universes)
+
+    rows = benchmark(30, sessions=2, allocations=False, repeat=1)
+    assert rows['markets'].eq(30).all()
+    assert set(rows['function']) <= set(FUNCTIONS)
+    assert 'alloc_kib' not in rows
+
+
+def test_compare_flags_regressions_over_tolerance_and_floors(tmp_path):
+    path = str(tmp_path / 'baseline.json')
+    save_baseline(results(slow=1000.0, noisy=10.0, steady=1000.0), path)
+    with open(path) as f:
+        baseline = json.load(f)
+    assert sorted(baseline) == ['noisy/250', 'slow/250', 'steady/250']
+
+    now = results(slow=2000.0, noisy=50.0, steady=1400.0, new=5.0)
+    table = compare(now, baseline).set_index('function')
+
+    # New functions have nothing to compare against
+    assert list(table.index) == ['slow', 'noisy', 'steady']
+    assert table['p50_ratio'].tolist() == [2.0, 5.0, 1.4]
+    # noisy is five times slower, but by less than floor_us
+    assert table['regression'].tolist() == [True, False, False]
+    assert compare(now, baseline, tolerance=1.3)['regression'].tolist()\
+        == [True, False, True]
+
+
+def test_compare_flags_allocation_growth():
+    baseline = {'grow/250': {'p50_us': 10.0, 'alloc_kib': 10.0}}
+    now = results(grow=10.0)
+
+    table = compare(now, baseline)
+    assert table['alloc_ratio'].tolist() == [10.0]
+    assert table['regression'].tolist() == [True]
+    assert not compare(now, baseline, floor_kib=128.0)['regression'].any()
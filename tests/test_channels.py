@@ -0,0 +1,47 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+
+@pytest.mark.parametrize('highest', [True, False])
+def test_channels_follow_the_price_window(turtle, highest):
+    # A sliding 20-bar window of completed bars, as the price store hands
+    # it over; market 1 has gaps and market 2 sits out some days
+    rng = np.random.default_rng(1)
+    values = 100 + rng.standard_normal((3, 90)).cumsum(axis=1)
+    values[1, 30:34] = np.nan
+    dates = np.arange(90).astype('datetime64[D]').astype('datetime64[ns]')
+
+    channels = turtle['RollingChannels'](3, [5, 20, 10], highest)
+    for end in range(20, 91):
+        rows = np.array([0, 1] if 50 <= end < 55 else [0, 1, 2])
+        window = slice(end - 20, end)
+        channels.update(dates[window], values[:, window], rows)
+
+        for n in channels.windows:
+            rolling = pd.DataFrame(values[:, :end].T).rolling(n, min_periods=1)
+            expected = (rolling.max() if highest else rolling.min()).values[-1]
+            np.testing.assert_array_equal(channels.values[n][rows], expected[rows])
+
+
+@pytest.mark.parametrize('trend', [-1.0, 1.0])
+def test_channels_through_monotonic_trends(turtle, trend):
+    # Falling highs keep every bar of the window queued, rising ones only
+    # the last; market 1 has a flat stretch of equal bars
+    values = 100 + trend * np.arange(80.0)[None, :].repeat(2, axis=0)
+    values[1, 40:50] = values[1, 40]
+    dates = np.arange(80).astype('datetime64[D]').astype('datetime64[ns]')
+    rows = np.arange(2)
+
+    channels = turtle['RollingChannels'](2, [10, 20], True)
+    for end in range(20, 81):
+        window = slice(end - 20, end)
+        channels.update(dates[window], values[:, window], rows)
+
+        for n in channels.windows:
+            expected = pd.DataFrame(values[:, :end].T).rolling(n).max().values[-1]
+            np.testing.assert_array_equal(channels.values[n], expected)
+
+    queue = channels.queue
+    assert queue.length[20][0] == (20 if trend < 0 else 1)
+    assert queue.length[10][0] == (10 if trend < 0 else 1)
@@ -0,0 +1,73 @@
+import os
+
+import numpy as np
+import pytest
+
+from conftest import replay
+
+
+@pytest.fixture(scope='module')
+def full_run(bars, tmp_path_factory):
+    path = str(tmp_path_factory.mktemp('checkpoints'))
+    result = replay(
+        bars,
+        {'checkpoint_path': os.path.join(path, 'turtle-{date}.npz')}
+    )
+    return path, result
+
+
+def trades(transactions):
+    return [
+        (dt, asset.symbol, amount, round(price, 6))
+        for dt, asset, amount, price in transactions[
+            ['dt', 'asset', 'amount', 'price']
+        ].itertuples(index=False)
+    ]
+
+
+@pytest.mark.parametrize('day', [5, 17, 30])
+def test_fork_matches_full_run(bars, full_run, day):
+    path, full = full_run
+    date = bars.sessions[day]
+    checkpoint = os.path.join(path, 'turtle-%s.npz' % date.strftime('%Y-%m-%d'))
+
+    fork = replay(
+        bars.between(bars.sessions[day + 1]),
+        {'restore_from': checkpoint},
+        seed=checkpoint
+    )
+
+    after = full.transactions[full.transactions['dt'] >= bars.sessions[day + 1]]
+    assert len(after)
+    assert trades(fork.transactions) == trades(after)
+    np.testing.assert_allclose(
+        fork.equity.values,
+        full.equity.values[day + 1:]
+    )
+
+
+
+def test_fork_must_start_after_the_checkpoint(bars, full_run):
+    path, full = full_run
+    checkpoint = os.path.join(
+        path,
+        'turtle-%s.npz' % bars.sessions[10].strftime('%Y-%m-%d')
+    )
+    with pytest.raises(ValueError, match='later session'):
+        replay(bars.between(bars.sessions[10]), seed=checkpoint)
+
+
+def test_unknown_versions_are_rejected(bars, full_run, tmp_path):
+    path, full = full_run
+    checkpoint = os.path.join(
+        path,
+        'turtle-%s.npz' % bars.sessions[10].strftime('%Y-%m-%d')
+    )
+    with np.load(checkpoint) as f:
+        arrays = dict(f.items())
+    arrays['version'] = np.array(1)
+    old = str(tmp_path / 'old.npz')
+    np.savez(old, **arrays)
+
+    with pytest.raises(ValueError, match='version 1 checkpoint'):
+        replay(bars.between(bars.sessions[11]), {'restore_from': old}, seed=old)
@@ -0,0 +1,85 @@
+from types import SimpleNamespace
+
+import numpy as np
+import pandas as pd
+import pytest
+
+
+def contract(name, auto_close):
+    return SimpleNamespace(
+        name=name,
+        auto_close_date=pd.Timestamp(auto_close),
+        multiplier=50.0
+    )
+
+
+def day(date):
+    return pd.Timestamp(date).value
+
+
+class Data(object):
+    """
+    data.current and data.current_chain over fixed chains, counting the
+    contract lookups.
+    """
+    def __init__(self, chains):
+        self.chains = chains
+        self.lookups = 0
+
+    def current_chain(self, asset):
+        return [
+            c for c in self.chains[asset]
+            if day(c.auto_close_date) > self.today
+        ][:2]
+
+    def current(self, assets, field):
+        self.lookups += 1
+        return pd.Series([
+            (self.current_chain(asset) or [np.nan])[0]
+            for asset in assets
+        ], dtype=object)
+
+
+@pytest.fixture
+def calendar(turtle):
+    return turtle['ContractCalendar'](['ES', 'CL'])
+
+
+def refresh(calendar, data, date):
+    data.today = day(date)
+    return calendar.refresh(data, {'ES': 'ES', 'CL': 'CL'}, data.today).tolist()
+
+
+def test_markets_roll_along_their_cached_chain(calendar):
+    chain = [
+        contract('ESH', '2020-03-13'),
+        contract('ESM', '2020-06-12'),
+        contract('ESU', '2020-09-11'),
+    ]
+    data = Data({'ES': chain, 'CL': []})
+
+    assert refresh(calendar, data, '2020-01-02') == [0]
+    assert calendar['ES'] is chain[0]
+    assert 'CL' not in calendar and len(calendar) == 1
+    assert calendar.multipliers[0] == 50.0
+
+    # Nothing due; only the market without a contract is looked up again
+    lookups = data.lookups
+    assert refresh(calendar, data, '2020-03-12') == []
+    assert data.lookups == lookups + 1
+
+    # ES rolls to the next cached contract without asking the data
+    data.chains['CL'] = [contract('CLK', '2020-04-20')]
+    lookups = data.lookups
+    assert refresh(calendar, data, '2020-03-13') == [0, 1]
+    assert calendar['ES'] is chain[1]
+    assert calendar.auto_close[0] == day('2020-06-12')
+    assert data.lookups == lookups + 1
+
+    # Past the end of the cached chain the data is asked again, in one
+    # lookup for every market due; CL has no contract left
+    lookups = data.lookups
+    assert refresh(calendar, data, '2020-06-12') == [0]
+    assert calendar['ES'] is chain[2]
+    assert 'CL' not in calendar and calendar.auto_close[1] == 0
+    assert data.lookups == lookups + 1
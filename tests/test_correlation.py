@@ -0,0 +1,77 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+
+def pandas_correlations(closes, window, min_periods):
+    """
+    Rolling pairwise correlations of log returns by pandas, each close
+    taken against the last close before it; (dates, markets, markets).
+    """
+    frame = pd.DataFrame(closes.T)
+    returns = np.log(frame / frame.ffill().shift(1))
+    rolling = returns.rolling(window, min_periods=min_periods).corr()
+    markets = closes.shape[0]
+    return rolling.values.reshape(len(frame), markets, markets)
+
+
+@pytest.fixture
+def closes():
+    rng = np.random.default_rng(2)
+    common = rng.standard_normal(47)
+    noise = rng.standard_normal((4, 47)) * [[0.3], [0.5], [1.0], [3.0]]
+    moves = 0.01 * (common + noise)
+    closes = 100 * np.exp(moves.cumsum(axis=1))
+    closes[1, [5, 6, 20]] = np.nan
+    closes[3, 30:33] = np.nan
+    return closes
+
+
+def test_matches_pandas_through_wraps_and_rebuilds(turtle, closes):
+    window, min_periods = 10, 4
+    expected = pandas_correlations(closes, window, min_periods)
+    engine = turtle['RollingCorrelation'](4, window)
+
+    # 47 bars wrap the 10-bar buffer, and rebuild the sums, four times
+    for t in range(closes.shape[1]):
+        engine.push(closes[:, t])
+        np.testing.assert_allclose(
+            engine.matrix(min_periods),
+            expected[t],
+            rtol=1e-9,
+            atol=1e-12,
+            err_msg='bar %i' % t
+        )
+
+
+def test_update_pushes_only_new_bars(turtle, closes):
+    dates = np.arange(47).astype('datetime64[D]').astype('datetime64[ns]')
+    engine = turtle['RollingCorrelation'](4, 10)
+    for end in range(12, 48):
+        engine.update(dates[end - 12:end], closes[:, end - 12:end])
+
+    np.testing.assert_allclose(
+        engine.matrix(4),
+        pandas_correlations(closes, 10, 4)[-1],
+        rtol=1e-9
+    )
+
+
+def test_groups_form_around_seeds_at_the_threshold(turtle):
+    correlation = np.array([
+        [1.0, 0.7, 0.6999, 0.9, np.nan],
+        [0.7, 1.0, 0.9, 0.2, 0.1],
+        [0.6999, 0.9, 1.0, 0.2, 0.8],
+        [0.9, 0.2, 0.2, 1.0, np.nan],
+        [np.nan, 0.1, 0.8, np.nan, 1.0],
+    ])
+    members, groups = turtle['correlated_groups'](correlation, 0.7)
+
+    # A takes B (exactly at the threshold) and D, not C just below it; C
+    # then seeds its own group with E rather than joining B's
+    assert members.tolist() == [0, 0, 1, 0, 1]
+    assert groups == 2
+
+    members, groups = turtle['correlated_groups'](correlation, 0.95)
+    assert members.tolist() == [-1] * 5
+    assert groups == 0
@@ -0,0 +1,70 @@
+import numpy as np
+import pytest
+
+
+@pytest.fixture
+def breakouts(context):
+    """
+    Markets breaking out upward (positive) or downward (negative) at once,
+    as {sym: direction} -> rows in symbol order.
+    """
+    m = context.markets.rows
+    context.current_prices = np.full(len(context.symbols), np.nan)
+    m['breakout_high'] = 100.0
+    m['breakout_low'] = 90.0
+
+    def breakouts(directions):
+        rows = np.array(sorted(context.symbol_index[sym] for sym in directions))
+        for i in rows:
+            up = directions[context.symbols[i]] > 0
+            context.current_prices[i] = 110.0 if up else 80.0
+        return rows
+    return breakouts
+
+
+def admitted(turtle, context, rows):
+    longs, shorts, system = turtle['entry_masks'](context, rows)
+    return (
+        [context.symbols[i] for i in rows[longs]],
+        [context.symbols[i] for i in rows[shorts]],
+    )
+
+
+def test_direction_limit_goes_to_the_first_markets(turtle, context, breakouts):
+    # 11 of the 12 long units are taken
+    for sym, units in [('CL', 4), ('GC', 4), ('US', 3)]:
+        context.risk_ledger.set(sym, units)
+    rows = breakouts({'BP': 1, 'CD': 1, 'JY': 1, 'SB': -1, 'SF': -1})
+
+    assert admitted(turtle, context, rows) == (['BP'], ['SB', 'SF'])
+    waiting = context.triggers.waiting
+    assert [context.symbols[i] for i in np.flatnonzero(waiting)] == ['CD', 'JY']
+
+
+def test_group_limits_hold_back_correlated_markets(turtle, context, breakouts):
+    # SP, ES, NQ and YM are closely correlated, with 5 of 6 units taken:
+    # ES comes before YM in symbol order and takes the last one. US sits
+    # in another group.
+    context.risk_ledger.set('SP', 4)
+    context.risk_ledger.set('NQ', 1)
+    rows = breakouts({'ES': 1, 'YM': 1, 'US': 1})
+
+    assert admitted(turtle, context, rows) == (['US', 'ES'], [])
+
+
+def test_loose_groups_count_units_across_close_groups(turtle, context,
+                                                      breakouts):
+    # US/TY/FV and ED/TB are separate close groups in one loose group of
+    # 10 units, 9 of them taken; TB is first in symbol order
+    for sym, units in [('US', 4), ('TY', 1), ('ED', 4)]:
+        context.risk_ledger.set(sym, units)
+    rows = breakouts({'FV': 1, 'TB': 1})
+
+    assert admitted(turtle, context, rows) == (['TB'], [])
+
+
+def test_markets_holding_positions_do_not_enter(turtle, context, breakouts):
+    context.risk_ledger.set('CL', 1)
+    rows = breakouts({'CL': 1, 'GC': -1})
+
+    assert admitted(turtle, context, rows) == ([], ['GC'])
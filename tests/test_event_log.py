@@ -0,0 +1,58 @@
+import logging
+
+import pytest
+
+
+@pytest.fixture
+def events(turtle, context):
+    return turtle['EventLog'](['AA', 'BB'], capacity=4)
+
+
+def record(turtle, events, n, sym='AA'):
+    for i in range(n):
+        events.record(turtle['EventLog'].ENTRY, sym, amount=i + 1, size=i + 1, price=100.0)
+
+
+def test_the_last_events_stay_queryable_across_wraps(turtle, events):
+    record(turtle, events, 3)
+    events.flush(echo=False)
+    record(turtle, events, 3, sym='BB')
+
+    frame = events.frame()
+    assert frame['market'].tolist() == ['AA', 'BB', 'BB', 'BB']
+    assert frame['amount'].tolist() == [3, 1, 2, 3]
+    assert len(events.pending()) == 3
+
+
+def test_frame_selects_kinds_and_markets(turtle, events):
+    record(turtle, events, 2)
+    events.record(turtle['EventLog'].EXIT, 'BB', amount=-2, price=99.0)
+
+    assert events.frame(kind='exit')['market'].tolist() == ['BB']
+    assert events.frame(sym='AA')['event'].tolist() == ['entry', 'entry']
+    assert events.frame(kind='exit', sym='AA').empty
+
+
+def test_a_full_buffer_flushes_before_overwriting(turtle, events, caplog):
+    caplog.set_level(logging.INFO, logger='turtle')
+    record(turtle, events, 5)
+
+    assert len(caplog.records) == 1
+    assert caplog.records[0].getMessage().count('Long(breakout') == 4
+    assert events.flushed == 4 and events.count == 5
+
+
+def test_nothing_is_formatted_when_info_is_filtered(turtle, events, caplog,
+                                                   monkeypatch):
+    caplog.set_level(logging.WARNING, logger='turtle')
+    formatted = []
+    monkeypatch.setattr(
+        turtle['EventLog'],
+        'format',
+        lambda self, event: formatted.append(event) or ''
+    )
+    record(turtle, events, 3)
+    events.flush()
+
+    assert formatted == [] and caplog.records == []
+    assert events.flushed == 3
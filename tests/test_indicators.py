@@ -0,0 +1,147 @@
+import os
+
+import numpy as np
+import pytest
+
+from conftest import replay
+from indicators import (
+    IndicatorCache, IndicatorStore, true_range, wilder_average
+)
+from replay import synthetic_bars
+
+
+def trades(result):
+    return result.transactions[['dt', 'amount', 'price']].values.tolist()
+
+
+@pytest.fixture(scope='module')
+def plain(bars):
+    return replay(bars)
+
+
+@pytest.mark.parametrize('stored', [False, True])
+def test_cache_does_not_change_results(bars, plain, tmp_path, stored):
+    store = IndicatorStore(str(tmp_path)) if stored else None
+    cached = replay(bars, {'indicators': IndicatorCache(bars, store)})
+
+    assert len(plain.transactions)
+    assert trades(cached) == trades(plain)
+    np.testing.assert_array_equal(cached.equity.values, plain.equity.values)
+
+
+def test_one_cache_serves_runs_starting_later(bars):
+    cache = IndicatorCache(bars)
+    replay(bars, {'indicators': cache})
+
+    later = bars.between(bars.sessions[10])
+    cached = replay(later, {'indicators': cache})
+    plain = replay(later)
+
+    assert trades(cached) == trades(plain)
+    np.testing.assert_array_equal(cached.equity.values, plain.equity.values)
+
+
+KEY = ('channel', 'high', 20, True)
+
+
+def stored(path):
+    return sorted(
+        os.path.relpath(os.path.join(root, name), path)
+        for root, dirs, names in os.walk(path) for name in names
+    )
+
+
+def test_changed_bars_replace_only_their_own_series(tmp_path):
+    bars = synthetic_bars(['AA', 'BB'], sessions=5, warmup=30)
+    IndicatorCache(bars, IndicatorStore(str(tmp_path))).load(KEY)
+    before = stored(str(tmp_path))
+
+    changed = synthetic_bars(['AA', 'BB'], sessions=5, warmup=30)
+    changed.daily['high'][-1, 0] += 1.0
+    store = IndicatorStore(str(tmp_path))
+    values = IndicatorCache(changed, store).load(KEY)
+
+    after = stored(str(tmp_path))
+    assert len(after) == 2
+    of = lambda files, sym: [f for f in files if f.startswith(sym)]
+    assert of(after, 'BB') == of(before, 'BB')
+    assert of(after, 'AA') != of(before, 'AA')
+    assert store.size == sum(
+        os.path.getsize(os.path.join(str(tmp_path), f)) for f in after
+    )
+    np.testing.assert_array_equal(values, IndicatorCache(changed).compute(KEY))
+
+
+
+def test_every_seeding_bar_shares_the_stored_true_ranges(bars, tmp_path):
+    path = str(tmp_path)
+    replay(bars, {'indicators': IndicatorCache(bars, IndicatorStore(path))})
+    files = stored(path)
+    assert not [f for f in files if 'atr' in f]
+    assert len([f for f in files if 'true_range' in f]) == len(bars.symbols)
+
+    # A walk-forward window starting later seeds N elsewhere, from the
+    # same stored true ranges
+    later = bars.between(bars.sessions[10])
+    cache = IndicatorCache(bars, IndicatorStore(path))
+    cached = replay(later, {'indicators': cache})
+    assert stored(path) == files
+    np.testing.assert_array_equal(
+        cached.equity.values, replay(later).equity.values
+    )
+
+
+def test_average_true_range_seeded_after_missing_bars():
+    bars = synthetic_bars(['AA', 'BB'], sessions=5, warmup=40)
+    bars.daily['close'][10:13, 0] = np.nan
+    bars.daily['low'][20, 1] = np.nan
+    cache = IndicatorCache(bars)
+
+    for start in [0, 5, 11, 20]:
+        since = bars.daily_dates[start].value
+        values = cache.compute(('atr', 10, since))
+        assert np.isnan(values[:start]).all()
+        np.testing.assert_array_equal(values[start:], wilder_average(
+            true_range(
+                bars.daily['high'][start:],
+                bars.daily['low'][start:],
+                bars.daily['close'][start:]
+            ),
+            10
+        ))
+
+def test_least_recently_used_series_are_evicted(tmp_path):
+    values = np.zeros(100)
+    store = IndicatorStore(str(tmp_path))
+    for i, sym in enumerate(['AA', 'BB', 'CC']):
+        store.save(sym, 'atr-20', 'digest', values)
+        os.utime(store.filename(sym, 'atr-20', 'digest'), (i, i))
+    size = store.size // 3
+
+    # Reading AA makes BB the least recently used; a fourth file goes
+    # over the limit, and eviction stops at 90% of it
+    store.load('AA', 'atr-20', 'digest')
+    store.max_bytes = 3.5 * size
+    store.save('DD', 'atr-20', 'digest', values)
+
+    assert stored(str(tmp_path)) == [
+        os.path.join(sym, 'atr-20-digest.npy') for sym in ['AA', 'CC', 'DD']
+    ]
+    assert store.size == 3 * size <= 0.9 * store.max_bytes
+
+
+def test_stale_series_removed_by_another_worker(tmp_path, monkeypatch):
+    store = IndicatorStore(str(tmp_path))
+    store.save('AA', 'atr-20', 'old', np.zeros(10))
+    other = IndicatorStore(str(tmp_path))
+    remove = os.remove
+
+    def raced(path):
+        # The other worker gets there first
+        remove(path)
+        raise FileNotFoundError(path)
+    monkeypatch.setattr(os, 'remove', raced)
+    other.save('AA', 'atr-20', 'new', np.zeros(10))
+
+    assert stored(str(tmp_path)) == [os.path.join('AA', 'atr-20-new.npy')]
+    assert other.size == os.path.getsize(other.filename('AA', 'atr-20', 'new'))
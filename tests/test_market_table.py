@@ -0,0 +1,85 @@
+import numpy as np
+import pytest
+
+COLUMNS = [
+    ('risk', np.float64, 0.0),
+    ('size', np.int64, -1),
+    ('won', (np.bool_, (2,)), False),
+    ('analytics_entry', np.float64, np.nan),
+    ('analytics_stop', np.float64, np.nan),
+]
+
+
+@pytest.fixture
+def table(turtle):
+    return turtle['MarketTable'](['AA', 'BB', 'CC'], COLUMNS)
+
+
+def test_rows_start_at_their_defaults(table):
+    assert table.index == {'AA': 0, 'BB': 1, 'CC': 2}
+    assert table.rows['size'].tolist() == [-1, -1, -1]
+    assert not table.rows['won'].any()
+    assert np.isnan(table.rows['analytics_entry']).all()
+
+
+def test_columns_read_and_write_through_by_symbol(table):
+    risk = table.column('risk')
+    risk['BB'] = 2.5
+    table.rows['risk'][2] = -1.0
+
+    assert table.rows['risk'].tolist() == [0.0, 2.5, -1.0]
+    assert risk['CC'] == -1.0
+    assert risk.get('ZZ', 7) == 7 and 'ZZ' not in risk
+    assert dict(risk.items()) == {'AA': 0.0, 'BB': 2.5, 'CC': -1.0}
+    with pytest.raises(KeyError):
+        risk['ZZ']
+
+    won = table.column('won')
+    won['AA'][1] = True
+    assert table.rows['won'][0].tolist() == [False, True]
+
+
+def test_records_group_prefixed_columns(table):
+    analytics = table.records('analytics_', ['entry', 'stop'])
+    analytics['CC'] = {'entry': 101.0, 'stop': 97.0}
+    analytics['AA']['stop'] = 50.0
+
+    assert analytics['CC']['entry'] == 101.0
+    assert table.rows['analytics_stop'][[0, 2]].tolist() == [50.0, 97.0]
+    assert len(analytics) == 3 and list(analytics) == ['AA', 'BB', 'CC']
+
+
+def test_snapshots_restore_in_place(table):
+    risk = table.column('risk')
+    saved = table.snapshot()
+    risk['AA'] = 4.0
+    table.restore(saved)
+
+    # Views made before the restore still see the table
+    assert risk['AA'] == 0.0
+
+
+def test_markets_that_stay_keep_their_rows(turtle, table):
+    table.column('risk')['BB'] = 3.0
+    table.column('size')['CC'] = 12
+
+    # AA dropped, DD added; a column of another type is not carried over
+    columns = [column for column in COLUMNS if column[0] != 'size']
+    columns.append(('size', np.float64, np.nan))
+    changed = turtle['MarketTable'](['BB', 'CC', 'DD'], columns)
+    changed.carry_over(table)
+
+    assert changed.rows['risk'].tolist() == [3.0, 0.0, 0.0]
+    assert np.isnan(changed.rows['size']).all()
+
+
+def test_setup_markets_keeps_state_across_universe_changes(turtle, context):
+    context.risk_ledger.set('CL', 2)
+    context.trade_size['GC'] = 7
+    context.symbols = ['GC', 'CL', 'KC']
+    turtle['setup_markets'](context)
+
+    assert context.market_risk['CL'] == 2
+    assert context.trade_size['GC'] == 7
+    assert context.trade_size['KC'] == 0
+    assert context.risk_ledger.long == 2
@@ -0,0 +1,74 @@
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+OPEN, FILLED, CANCELED = 0, 1, 2
+
+
+@pytest.fixture
+def broker(turtle):
+    """
+    Orders by id, served to turtle.py's get_order as snapshots.
+    """
+    orders = {}
+    turtle['get_order'] = lambda order_id: SimpleNamespace(**vars(orders[order_id]))
+    turtle['cancel_order'] = lambda order_id: setattr(orders[order_id], 'status', CANCELED)
+    return orders
+
+
+def place(broker, order_id, limit=None, stop=None):
+    broker[order_id] = SimpleNamespace(
+        id=order_id, status=OPEN, filled=0, amount=2, limit=limit, stop=stop
+    )
+    return order_id
+
+
+def test_latest_orders_keep_their_kind_and_stop(turtle, broker):
+    index = turtle['OrderIndex'](['A', 'B', 'C'], archive_size=2)
+    index.add('A', place(broker, 1, stop=95.0))
+    index.add('B', place(broker, 2, limit=101.0))
+
+    assert [index.kind(sym) for sym in 'ABC'] == ['stop', 'limit', None]
+    np.testing.assert_array_equal(index.stops, [95.0, np.nan, np.nan])
+    assert index.touched.tolist() == [True, True, False]
+
+    for order_id in (3, 4, 5):
+        index.add('A', place(broker, order_id))
+    assert index.kind('A') == 'market'
+    assert np.isnan(index.stops[0])
+    assert list(index.archive['A']) == [3, 4]
+    assert index.archived['A'] == 3
+
+
+def test_refresh_reads_open_orders_only(turtle, broker):
+    index = turtle['OrderIndex'](['A', 'B'])
+    index.add('A', place(broker, 1))
+    index.add('B', place(broker, 2))
+    index.touched[:] = False
+
+    broker[1].status, broker[1].filled = FILLED, 2
+    index.refresh()
+    assert index.status('A') == FILLED
+    assert index.open == {'B'}
+    assert index.touched.tolist() == [True, False]
+    assert index.fills == 1
+
+    # Filled orders are not read again
+    broker[1].filled = 5
+    index.refresh()
+    assert index.last('A').filled == 2
+
+    index.cancel('B')
+    assert index.status('B') == CANCELED
+    assert index.open == set()
+    assert index.fills == 1
+
+
+def test_restored_orders_are_never_reloaded(turtle, broker):
+    index = turtle['OrderIndex'](['A'])
+    index.store('A', turtle['RestoredOrder'](
+        'A', 2, 0, None, 95.0, False, False, OPEN
+    ))
+    index.reload('A')
+    assert index.status('A') == CANCELED
@@ -0,0 +1,30 @@
+import math
+from types import SimpleNamespace
+
+
+def test_stages_skip_unchanged_inputs_and_take_times_from_the_profiler(turtle):
+    calls = []
+
+    def first(context, data):
+        calls.append('first')
+
+    def second(context, data):
+        calls.append('second')
+
+    pipeline = turtle['Pipeline']()
+    pipeline.add(first, inputs=lambda context: context.day)
+    pipeline.add(second, after=[first])
+
+    context = SimpleNamespace(day=1, profiler=None)
+    pipeline.run(context, None)
+    pipeline.run(context, None)
+    context.day = 2
+    context.profiler = turtle['Profiler']()
+    pipeline.run(context, None)
+
+    assert calls == ['first', 'second', 'second', 'first', 'second']
+    name, ran, skipped, total, mean = pipeline.timings(context.profiler)[0]
+    assert (name, ran, skipped) == ('first', 2, 1)
+    # Only the profiled run is timed
+    assert total >= 0 and mean == total
+    assert all(math.isnan(value) for value in pipeline.timings()[0][3:])
@@ -0,0 +1,31 @@
+import textwrap
+
+from replay import ReplayEngine, synthetic_bars
+
+
+def test_handle_data_runs_before_scheduled_functions(tmp_path):
+    path = tmp_path / 'algorithm.py'
+    path.write_text(textwrap.dedent('''
+        calls = []
+
+        def initialize(context):
+            schedule_function(
+                scheduled,
+                date_rules.every_day(),
+                time_rules.market_open()
+            )
+
+        def scheduled(context, data):
+            calls.append('scheduled')
+
+        def handle_data(context, data):
+            calls.append('handle_data')
+    '''))
+
+    engine = ReplayEngine(synthetic_bars(['AA'], sessions=1, warmup=5))
+    namespace = engine.load(str(path))
+    engine.run(namespace)
+
+    calls = namespace['calls']
+    first = calls.index('scheduled')
+    assert calls[first - 1:first + 2] == ['handle_data', 'scheduled', 'handle_data']
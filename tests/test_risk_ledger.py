@@ -0,0 +1,66 @@
+import numpy as np
+
+
+def ledger(turtle, units=None):
+    symbols = ['A', 'B', 'C', 'D']
+    units = np.zeros(len(symbols)) if units is None else units
+    return turtle['RiskLedger'](
+        symbols,
+        units,
+        [[['A', 'B']], [['A', 'B', 'C']]]
+    )
+
+
+def test_set_keeps_totals(turtle):
+    risk = ledger(turtle)
+    risk.set('A', 2)
+    risk.set('C', -1)
+    risk.add('A', 1)
+
+    assert risk.long == 3
+    assert risk.short == 1
+    assert list(risk.group_long[0]) == [3]
+    assert list(risk.group_long[1]) == [3]
+    assert list(risk.group_short[0]) == [0]
+    assert list(risk.group_short[1]) == [1]
+
+    risk.set('A', 0)
+    assert risk.long == 0
+    assert list(risk.group_long[1]) == [0]
+
+
+def test_only_unit_changes_touch(turtle):
+    risk = ledger(turtle)
+    risk.set('B', 0)
+    assert not risk.touched.any()
+
+    risk.set('B', 1)
+    assert list(np.flatnonzero(risk.touched)) == [1]
+
+    risk.touched[:] = False
+    risk.set('B', 1)
+    assert not risk.touched.any()
+
+
+def test_admit_caps_direction_and_groups(turtle):
+    risk = ledger(turtle)
+    risk.set('A', 1)
+    rows = np.arange(4)
+    candidates = np.array([False, True, True, True])
+
+    # Closely correlated limit of 2: A holds one unit, B takes the other;
+    # C and D are in no close group
+    admitted = risk.admit(rows, candidates, True, [10, 2, 10])
+    assert list(admitted) == [False, True, True, True]
+
+    # Loosely correlated limit of 2 also stops C
+    admitted = risk.admit(rows, candidates, True, [10, 5, 2])
+    assert list(admitted) == [False, True, False, True]
+
+    # Direction limit of 2 leaves room for one more unit
+    admitted = risk.admit(rows, candidates, True, [2, 5, 5])
+    assert list(admitted) == [False, True, False, False]
+
+    # Shorts are counted apart from longs
+    admitted = risk.admit(rows, candidates, False, [10, 1, 1])
+    assert list(admitted) == [False, True, False, True]
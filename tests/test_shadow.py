@@ -0,0 +1,30 @@
+import numpy as np
+
+
+def test_profit_counts_the_earlier_units(turtle):
+    # Long 3 units added 0.5 N apart up to 110 with N = 2: 108, 109, 110
+    # out at 109.5 makes 1.5 + 0.5 - 0.5. Short 2 units down to 100: 101,
+    # 100, out at 100.4 makes 0.6 - 0.4.
+    profit = turtle['shadow_profit'](
+        np.array([[3], [-2]]),
+        np.array([[110.0], [100.0]]),
+        np.array([[109.5], [100.4]]),
+        np.array([[2.0], [2.0]])
+    )
+    np.testing.assert_allclose(profit, [[1.5], [0.2]])
+
+
+def test_exits_note_winning_trades(turtle):
+    nan = np.full((2, 1), np.nan)
+    state, entry, stop, exit_level, won = turtle['shadow_step'](
+        np.array([[3], [-2]]),
+        np.array([[110.0], [100.0]]),
+        np.array([[106.0], [104.0]]),
+        np.array([[109.5], [100.4]]),
+        np.zeros((2, 1), dtype=bool),
+        np.array([[109.0], [100.5]]),
+        np.array([[2.0], [2.0]]),
+        nan, nan, nan, nan
+    )
+    assert won.tolist() == [[True], [True]]
+    assert state.tolist() == [[0], [0]]
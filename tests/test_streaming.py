@@ -0,0 +1,28 @@
+import functools
+
+from conftest import ALGORITHM
+from replay import ReplayEngine, SYMBOLS, synthetic_bars
+
+
+def test_no_trigger_before_start_of_day():
+    bars = synthetic_bars(SYMBOLS, sessions=4)
+    engine = ReplayEngine(bars)
+    namespace = engine.load(ALGORITHM)
+    events = []
+
+    def recorded(func):
+        @functools.wraps(func)
+        def wrapper(context, data):
+            events.append((engine.get_datetime().normalize(), func.__name__))
+            return func(context, data)
+        namespace[func.__name__] = wrapper
+
+    recorded(namespace['run_start_of_day'])
+    recorded(namespace['find_triggers'])
+    engine.run(namespace, {'streaming': True})
+
+    # Every session's bars wait for its start-of-day
+    for session in bars.sessions:
+        names = [name for date, name in events if date == session]
+        assert names[0] == 'run_start_of_day'
+        assert 'find_triggers' in names
@@ -0,0 +1,46 @@
+import pytest
+
+from conftest import replay
+from replay import AlgorithmContext, set_parameter
+from sweep import grid_points, parse_grid, sweep
+
+
+def test_grid_points_cover_every_combination_in_order():
+    grid = parse_grid(['stop_multiplier=1.5,2', 'systems.one.breakout=20,30'])
+    assert grid == {
+        'stop_multiplier': [1.5, 2],
+        'systems.one.breakout': [20, 30],
+    }
+    assert grid_points(grid) == [
+        {'stop_multiplier': 1.5, 'systems.one.breakout': 20},
+        {'stop_multiplier': 1.5, 'systems.one.breakout': 30},
+        {'stop_multiplier': 2, 'systems.one.breakout': 20},
+        {'stop_multiplier': 2, 'systems.one.breakout': 30},
+    ]
+
+    with pytest.raises(ValueError):
+        grid_points({'stop_multipler': [2]})
+
+
+def test_misspelled_parameters_are_rejected(context):
+    set_parameter(context, 'systems.two.exit', 15)
+    assert context.systems[1].exit == 15
+
+    for key in ['stop_multipler', 'systems.three.exit', 'systems.two.exits']:
+        with pytest.raises(AttributeError):
+            set_parameter(context, key, 15)
+
+    with pytest.raises(AttributeError):
+        set_parameter(AlgorithmContext(), 'stop_multiplier', 2)
+
+
+def test_rows_match_direct_replays(bars):
+    grid = {'stop_multiplier': [1.5, 2.5]}
+    rows = sweep(bars, grid, processes=1)
+
+    assert rows['stop_multiplier'].tolist() == [1.5, 2.5]
+    for row in rows.to_dict('records'):
+        result = replay(bars, {'stop_multiplier': row['stop_multiplier']})
+        assert row['final_value'] == result.equity.iloc[-1]
+        assert row['transactions'] == len(result.transactions)
+    assert rows['final_value'].nunique() == 2
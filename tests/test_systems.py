@@ -0,0 +1,126 @@
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+
+@pytest.fixture
+def market(context):
+    """
+    Set one market's price and channels: breakouts at 100/105 (high) and
+    90/85 (low) for systems one and two, as (sym, price) -> row.
+    """
+    m = context.markets.rows
+    context.current_prices = np.full(len(context.symbols), np.nan)
+
+    def market(sym, price):
+        i = context.symbol_index[sym]
+        context.current_prices[i] = price
+        m['breakout_high'][i] = [100.0, 105.0]
+        m['breakout_low'][i] = [90.0, 85.0]
+        m['exit_high'][i] = [95.0, 97.0]
+        m['exit_low'][i] = [93.0, 91.0]
+        return i
+    return market
+
+
+def entries(turtle, context, rows):
+    longs, shorts, system = turtle['entry_masks'](context, np.array(rows))
+    return longs.tolist(), shorts.tolist(), system.tolist()
+
+
+def test_first_system_to_break_out_enters(turtle, context, market):
+    rows = [market('CL', 110.0), market('GC', 102.0), market('HG', 80.0)]
+    # CL breaks out of both channels and goes to system one; GC only
+    # clears system one's; HG breaks down through both
+    assert entries(turtle, context, rows) == (
+        [True, True, False],
+        [False, False, True],
+        [0, 0, 0]
+    )
+
+
+def test_skip_after_win_only_holds_back_system_one(turtle, context, market):
+    rows = [market('CL', 110.0), market('GC', 102.0), market('HG', 110.0)]
+    won = context.markets.rows['previous_trade_won']
+    won[rows[0]] = [True, False]
+    won[rows[1]] = [True, False]
+    won[rows[2]] = [False, True]
+
+    # System two takes CL's breakout; GC's only broke system one's
+    # channel; system two's win does not stop system one on HG
+    assert entries(turtle, context, rows) == (
+        [True, False, True],
+        [False, False, False],
+        [1, -1, 0]
+    )
+
+
+def test_trend_filter_blocks_counter_trend_entries(turtle, context, market):
+    context.systems = [
+        turtle['ChannelSystem']('one', breakout=20, exit=10),
+        turtle['ChannelSystem']('trend', breakout=55, exit=20, trend=200),
+    ]
+    turtle['setup_markets'](context)
+    context.current_prices = np.full(len(context.symbols), np.nan)
+    m = context.markets.rows
+
+    rows = [market('CL', 110.0), market('GC', 80.0)]
+    m['breakout_high'][rows] = [[np.nan, 105.0]]
+    m['breakout_low'][rows] = [[np.nan, 85.0]]
+    # Both markets sit below the middle of their 200-day channel
+    m['trend_high'][rows] = [[np.nan, 200.0]]
+    m['trend_low'][rows] = [[np.nan, 100.0]]
+
+    assert entries(turtle, context, rows) == (
+        [False, False],
+        [False, True],
+        [-1, 1]
+    )
+
+
+def test_units_are_sized_by_the_entering_systems_risk(turtle, context, market):
+    context.systems[1].risk = 0.5
+    orders = []
+    turtle['order'] = lambda asset, amount, style=None: orders.append(amount)
+    context.portfolio = SimpleNamespace(cash=1e6)
+
+    won = context.markets.rows['previous_trade_won']
+    rows = [market('CL', 110.0), market('GC', 110.0)]
+    won[rows[1]] = [True, False]
+    for i in rows:
+        context.trade_size.values[i] = 10
+        context.contracts.set(i, SimpleNamespace(
+            auto_close_date='2030-01-01', multiplier=1.0
+        ))
+    context.signal_rows = np.array(rows)
+
+    turtle['detect_entry_signals'](context, None)
+    assert orders == [10, 5]
+    assert context.system.values[rows].tolist() == [0, 1]
+
+
+@pytest.mark.parametrize('price, exits', [(92.0, False), (90.0, True)])
+def test_longs_exit_on_the_holding_systems_channel(turtle, context, market,
+                                                  price, exits):
+    # Held by system two, whose exit low is 91; system one's is 93
+    i = market('CL', price)
+    context.system.values[i] = 1
+    amounts = np.zeros(len(context.symbols))
+    amounts[i] = 3
+
+    longs, shorts = turtle['exit_masks'](context, amounts)
+    assert longs[i] == exits and not shorts.any()
+
+
+@pytest.mark.parametrize('price, exits', [(96.0, False), (98.0, True)])
+def test_shorts_exit_on_the_holding_systems_channel(turtle, context, market,
+                                                   price, exits):
+    # Held by system two, whose exit high is 97; system one's is 95
+    i = market('CL', price)
+    context.system.values[i] = 1
+    amounts = np.zeros(len(context.symbols))
+    amounts[i] = -3
+
+    longs, shorts = turtle['exit_masks'](context, amounts)
+    assert shorts[i] == exits and not longs.any()
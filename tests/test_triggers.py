@@ -0,0 +1,23 @@
+import numpy as np
+
+
+def test_bands_and_waiting_markets(turtle):
+    triggers = turtle['TriggerIndex'](3)
+    prices = np.array([10.0, 20.0, 30.0])
+    assert list(triggers.crossed(prices)) == [0, 1, 2]
+
+    levels = np.array([
+        [9.0, 11.0],
+        [19.0, 21.0],
+        [29.0, np.nan],
+    ])
+    triggers.rearm(np.arange(3), prices, levels)
+    assert list(triggers.crossed(prices)) == []
+    assert list(triggers.crossed(np.array([10.5, 21.0, 40.0]))) == [1]
+
+    # Held back by the unit limits: not looked at again until units change
+    triggers.wait([0])
+    assert list(triggers.crossed(prices)) == []
+    triggers.release()
+    assert list(triggers.crossed(prices)) == [0]
+    assert list(triggers.crossed(prices)) == []
@@ -1,10 +1,41 @@
 import math
 import numpy as np
 import pandas as pd
-from time import time
-from talib import ATR
+from collections import deque
+from functools import wraps
+from time import perf_counter_ns
 #from zipline.api import sid, order
 
+# Format of the files save_checkpoint writes
+CHECKPOINT_VERSION = 5
+
+# Field axis of the daily price store
+HIGH = 0
+LOW = 1
+CLOSE = 2
+
+# logging.INFO, for logs that can say whether they emit a level
+INFO = 20
+
+# Correlated market groups for the Turtle unit limits. A market belongs to
+# at most one group of each list; roots outside the universe are ignored.
+CLOSELY_CORRELATED = [
+    ['SP', 'ES', 'NQ', 'YM'],
+    ['US', 'TY', 'FV'],
+    ['ED', 'TB'],
+    ['CL', 'HO', 'HU', 'QM'],
+    ['GC', 'SV'],
+    ['CN', 'SY', 'WC'],
+]
+LOOSELY_CORRELATED = [
+    ['SP', 'ES', 'NQ', 'YM'],
+    ['US', 'TY', 'FV', 'ED', 'TB'],
+    ['CL', 'HO', 'HU', 'QM'],
+    ['GC', 'SV', 'HG'],
+    ['BP', 'CD', 'JY', 'SF'],
+    ['CN', 'SY', 'WC', 'SB'],
+]
+
 def initialize(context):
     """
     Initialize parameters.
@@ -14,8 +45,14 @@ def initialize(context):
     context.is_timed = False
     context.is_info = True
 
-    if context.is_timed:
-        start_time = time()
+    # Profiling of scheduled functions and pipeline stages (see Profiler).
+    # Budgets are in ms; an over-budget call is logged, or fails the
+    # algorithm with on_budget='fail'.
+    context.profiler = Profiler(
+        budgets={'get_prices': 8192},
+        default_budget=1024,
+        on_budget='warn'
+    ) if context.is_timed else None
 
     # Data
     context.symbols = [
@@ -45,105 +82,89 @@ def initialize(context):
         'FV',
     ]
 
-    # Use market symbols as key
-    # The rest of this algorithm follows this convention as well (should @TODO)
-    context.cfutures = {symbol: continuous_future(symbol , offset = 0, roll = 'calendar' , adjustment = 'mul') for symbol in context.symbols}
+    # Breakout systems, evaluated together over the same channels and N.
+    # When several break out at once, the first in this list enters.
+    # Strategy one is skipped while its last breakout won, which leaves
+    # that breakout to strategy two. More systems cost little more, e.g.
+    #     ChannelSystem('three', breakout=100, exit=50, risk=0.5),
+    #     ChannelSystem('four', breakout=20, exit=10, trend=200),
+    context.systems = [
+        ChannelSystem('one', breakout=20, exit=10, skip_after_win=True),
+        ChannelSystem('two', breakout=55, exit=20),
+    ]
+
+    setup_markets(context)
 
-    context.prices = None
-    context.contracts = None
-    context.average_true_range = {}
-    context.dollar_volatility = {}
-    context.trade_size = {}
-    context.position_analytics = {}
+    context.price_store = None
+    context.price_fields = ['high', 'low', 'close']
+    # Snapshot of every market's price, refreshed once per intraday slot
+    context.current_prices = None
+    context.atr_period = 20
+    # Wilder ATR state of every market, and the last bar it has seen
+    context.atr_state = None
+    context.atr_date = None
     context.future_to_symbol = {}
-    context.yesterday_auto_close_date = {}
-
-    # Breakout signals
-    context.strat_one_breakout = 20
-    context.strat_one_breakout_high = {}
-    context.strat_one_breakout_low = {}
-    context.strat_one_exit = 10
-    context.strat_one_exit_high = {}
-    context.strat_one_exit_low = {}
-    # Keyed by root symbol
-    context.is_strat_one = {}
-
-    context.strat_two_breakout = 55
-    context.strat_two_breakout_high = {}
-    context.strat_two_breakout_low = {}
-    context.strat_two_exit = 20
-    context.strat_two_exit_high = {}
-    context.strat_two_exit_low = {}
-    # Keyed by root symbol
-    context.is_strat_two = {}
+
+    # Daily bars the shadow trades are replayed over before the first day
+    context.warm_start_bars = 756
+    context.warm_started = False
+
+    # Rolling channels of every market's highs and lows
+    context.rolling_highs = None
+    context.rolling_lows = None
+
+    # Optional source of precomputed channels and N, read instead of the
+    # rolling state above when set (offline runs set an IndicatorCache)
+    context.indicators = None
 
     # Risk
     context.capital = context.portfolio.starting_cash
     context.profit = 0
     context.capital_risk_per_trade = 0.01
     context.capital_multiplier = 2
-    context.stop = {}
-    context.has_stop = {}
     context.stop_multiplier = 2
     context.market_risk_limit = 4
-    context.market_risk = {}
+    context.closely_correlated_limit = 6
+    context.loosely_correlated_limit = 10
     context.direction_risk_limit = 12
+    # Correlated groups come from a rolling correlation of daily returns
+    # once it has `correlation_min_periods` bars; the lists at the top of
+    # this file are used until then, and for universes too large for a
+    # (markets, markets) matrix
+    context.correlation_window = 100
+    context.correlation_min_periods = 40
+    context.close_correlation = 0.7
+    context.loose_correlation = 0.4
+    context.max_correlated_markets = 1000
     context.long_risk = 0
     context.short_risk = 0
 
     # Order
-    context.orders = {}
     context.filled = 1
     context.canceled = 2
     context.rejected = 3
     context.long_direction = 'long'
     context.short_direction = 'short'
 
-    # Was last entry signal winning trade initial status. the last trade before this algo runs:
-    context.previous_trade_won = {}
-
-    for symbol in context.symbols:
-        context.orders[symbol] = []
-        context.stop[symbol] = 0
-        context.has_stop[symbol] = False
-        context.market_risk[symbol] = 0
-        context.position_analytics[symbol] = {'state' : 0, 'entry' : 0, 'stop' : 0, 'exit' : 0}
-        # Move this out of loop after implementing check for initialization of prev-trade-won
-        context.previous_trade_won[symbol] = False
-
-    # Start of day functions
-    schedule_function(
-        get_prices,
-        date_rules.every_day(),
-        time_rules.market_open(),
-        False
-    )
-    schedule_function(
-        validate_prices,
-        date_rules.every_day(),
-        time_rules.market_open(),
-        False
-    )
-    schedule_function(
-        compute_highs,
-        date_rules.every_day(),
-        time_rules.market_open(),
-        False
-    )
-    schedule_function(
-        compute_lows,
-        date_rules.every_day(),
-        time_rules.market_open(),
-        False
-    )
-    schedule_function(
-        get_contracts,
-        date_rules.every_day(),
-        time_rules.market_open(),
-        False
+    context.contracts_version = 0
+
+    # Start of day pipeline
+    context.start_of_day = Pipeline()
+    context.start_of_day.add(get_prices)
+    context.start_of_day.add(validate_prices, after=[get_prices])
+    context.start_of_day.add(warm_start, after=[get_prices])
+    context.start_of_day.add(compute_highs, after=[validate_prices])
+    context.start_of_day.add(compute_lows, after=[validate_prices])
+    context.start_of_day.add(update_correlations, after=[validate_prices])
+    context.start_of_day.add(get_contracts)
+    context.start_of_day.add(refresh_orders)
+    context.start_of_day.add(
+        check_rollover,
+        after=[get_contracts, validate_prices, refresh_orders]
     )
+
     schedule_function(
-        check_rollover,
+        run_start_of_day,
         date_rules.every_day(),
         time_rules.market_open(),
         False
@@ -167,64 +188,81 @@ def initialize(context):
         time_rules.market_close(minutes=25)
     )
 
+    # Intraday pipeline. Stages with `inputs` are skipped while those inputs
+    # and the stages they depend on are unchanged, and the signal stages
+    # while no market crossed a level. The signal stages keep their
+    # original order through their dependencies.
+    context.intraday = Pipeline()
+    context.intraday.add(get_current_prices)
+    context.intraday.add(refresh_orders)
+    context.intraday.add(
+        compute_average_true_ranges,
+        inputs=lambda context: context.price_store.last_date
+    )
+    context.intraday.add(
+        compute_dollar_volatilities,
+        after=[compute_average_true_ranges],
+        inputs=lambda context: context.contracts_version
+    )
+    # Sizes follow the portfolio value as of the open and of each fill,
+    # rather than its every tick
+    context.intraday.add(
+        compute_trade_sizes,
+        after=[compute_dollar_volatilities],
+        inputs=lambda context: (
+            context.price_store.last_date,
+            context.order_index.fills
+        )
+    )
+    context.intraday.add(update_risks)
+    context.intraday.add(find_triggers, after=[get_current_prices, refresh_orders])
+    context.intraday.add(
+        detect_entry_signals,
+        after=[find_triggers, compute_trade_sizes, update_risks],
+        when=has_signals
+    )
+    context.intraday.add(
+        scaling_signals,
+        after=[detect_entry_signals],
+        when=has_signals
+    )
+    context.intraday.add(
+        place_stop_orders,
+        after=[scaling_signals],
+        when=has_signals
+    )
+    context.intraday.add(
+        stop_trigger_cleanup,
+        after=[place_stop_orders],
+        when=has_signals
+    )
+    context.intraday.add(
+        detect_exit_signals,
+        after=[stop_trigger_cleanup],
+        when=has_signals
+    )
+    context.intraday.add(
+        analyzing_trade_for_next_signal,
+        after=[detect_exit_signals, compute_average_true_ranges],
+        when=has_signals
+    )
+    context.intraday.add(
+        rearm_triggers,
+        after=[analyzing_trade_for_next_signal],
+        when=has_signals
+    )
+
+    # Streaming mode runs the intraday pipeline on every minute bar through
+    # handle_data instead of on the 30 minute grid below
+    context.streaming = False
+    # Session start-of-day last ran for; handle_data waits for it, since
+    # zipline runs handle_data before the functions scheduled at the open
+    context.day_ready = None
+
     total_minutes = 6*60 + 30
     for i in range(30, total_minutes, 30):
         schedule_function(
-            compute_average_true_ranges,
-            date_rules.every_day(),
-            time_rules.market_open(minutes=i),
-            False
-        )
-        schedule_function(
-            compute_dollar_volatilities,
-            date_rules.every_day(),
-            time_rules.market_open(minutes=i),
-            False
-        )
-        schedule_function(
-            compute_trade_sizes,
-            date_rules.every_day(),
-            time_rules.market_open(minutes=i),
-            False
-        )
-        schedule_function(
-            update_risks,
-            date_rules.every_day(),
-            time_rules.market_open(minutes=i),
-            False
-        )
-        schedule_function(
-            detect_entry_signals,
-            date_rules.every_day(),
-            time_rules.market_open(minutes=i),
-            False
-        )
-        schedule_function(
-            scaling_signals,
-            date_rules.every_day(),
-            time_rules.market_open(minutes=i),
-            False
-        )
-        schedule_function(
-            place_stop_orders,
-            date_rules.every_day(),
-            time_rules.market_open(minutes=i),
-            False
-        )
-        schedule_function(
-            stop_trigger_cleanup,
-            date_rules.every_day(),
-            time_rules.market_open(minutes=i),
-            False
-        )
-        schedule_function(
-            detect_exit_signals,
-            date_rules.every_day(),
-            time_rules.market_open(minutes=i),
-            False
-        )
-        schedule_function(
-            analyzing_trade_for_next_signal,
+            run_intraday,
             date_rules.every_day(),
             time_rules.market_open(minutes=i),
             False
@@ -236,73 +274,1252 @@ def initialize(context):
             date_rules.every_day(),
             time_rules.market_close()
         )
+    schedule_function(
+        flush_events,
+        date_rules.every_day(),
+        time_rules.market_close()
+    )
+
+    # Checkpoints. With checkpoint_path set, the state is written there at
+    # every close ('{date}' in the path is replaced by the session date);
+    # with restore_from set, it is read back before the first day.
+    context.checkpoint_path = None
+    context.restore_from = None
+    schedule_function(
+        write_checkpoint,
+        date_rules.every_day(),
+        time_rules.market_close()
+    )
+
+class ChannelSystem(object):
+    """
+    A channel breakout system: enter when the price breaks the
+    `breakout`-day channel, exit when it crosses the opposite `exit`-day
+    channel.
+
+    With `trend`, longs are only taken above the midpoint of the
+    `trend`-day channel and shorts below it. With `skip_after_win`, a
+    breakout is not taken while the system's previous breakout, traded or
+    not, won. Its units are `risk` times the base trade size.
+    """
+    def __init__(self, name, breakout, exit, trend=0, skip_after_win=False,
+                 risk=1.0):
+        self.name = name
+        self.breakout = breakout
+        self.exit = exit
+        self.trend = trend
+        self.skip_after_win = skip_after_win
+        self.risk = risk
+
+    def __repr__(self):
+        return 'ChannelSystem(%r, %i/%i%s)' % (
+            self.name,
+            self.breakout,
+            self.exit,
+            ', trend %i' % self.trend if self.trend else ''
+        )
+
+def setup_markets(context):
+    """
+    Build the per-market state for context.symbols: continuous futures,
+    the market table and its dict-like views, the order index and the
+    contract calendar.
+    Called by initialize, and again by anything that changes the universe.
+    """
+    # Use market symbols as key
+    # The rest of this algorithm follows this convention as well (should @TODO)
+    context.cfutures = {symbol: continuous_future(symbol , offset = 0, roll = 'calendar' , adjustment = 'mul') for symbol in context.symbols}
+
+    # Per-market state, a row per symbol; the context.<column> attributes
+    # below are dict-like views onto it. Per-system state has a column per
+    # system, in context.systems order. Markets that stay in a changed
+    # universe keep their rows.
+    previous = getattr(context, 'markets', None)
+    per_system = lambda dtype: (dtype, (len(context.systems),))
+    context.markets = MarketTable(context.symbols, [
+        ('average_true_range', np.float64, np.nan),
+        # First bar (ns since epoch) N was computed from, 0 until it has been
+        ('atr_since', np.int64, 0),
+        ('dollar_volatility', np.float64, np.nan),
+        ('trade_size', np.int64, 0),
+        ('breakout_high', per_system(np.float64), np.nan),
+        ('breakout_low', per_system(np.float64), np.nan),
+        ('exit_high', per_system(np.float64), np.nan),
+        ('exit_low', per_system(np.float64), np.nan),
+        ('trend_high', per_system(np.float64), np.nan),
+        ('trend_low', per_system(np.float64), np.nan),
+        ('system', np.int64, -1),
+        ('stop', np.float64, 0.0),
+        ('has_stop', np.bool_, False),
+        ('market_risk', np.float64, 0.0),
+        ('previous_trade_won', per_system(np.bool_), False),
+        ('yesterday_auto_close_date', np.int64, 0),
+        ('analytics_state', per_system(np.int64), 0),
+        ('analytics_entry', per_system(np.float64), 0.0),
+        ('analytics_stop', per_system(np.float64), 0.0),
+        ('analytics_exit', per_system(np.float64), 0.0),
+    ])
+    if previous is not None:
+        context.markets.carry_over(previous)
+    column = context.markets.column
+
+    context.average_true_range = column('average_true_range')
+    context.dollar_volatility = column('dollar_volatility')
+    context.trade_size = column('trade_size')
+    context.position_analytics = context.markets.records(
+        'analytics_',
+        ['state', 'entry', 'stop', 'exit']
+    )
+
+    # Breakout, exit and trend channels of every system, keyed by root
+    # symbol (NaN trend channels for systems without a trend filter)
+    context.breakout_high = column('breakout_high')
+    context.breakout_low = column('breakout_low')
+    context.exit_high = column('exit_high')
+    context.exit_low = column('exit_low')
+    context.trend_high = column('trend_high')
+    context.trend_low = column('trend_low')
+    # Index in context.systems of the system holding each market, -1 if none
+    context.system = column('system')
+
+    # Risk
+    context.stop = column('stop')
+    context.has_stop = column('has_stop')
+    context.market_risk = column('market_risk')
+    # Unit totals by direction and correlated group; market_risk changes go
+    # through it
+    context.risk_ledger = RiskLedger(
+        context.symbols,
+        context.markets.rows['market_risk'],
+        [CLOSELY_CORRELATED, LOOSELY_CORRELATED]
+    )
+    # RollingCorrelation, built by update_correlations
+    context.correlations = None
+
+    # Did each system's last breakout win; seeded from history by warm_start
+    context.previous_trade_won = column('previous_trade_won')
+
+    context.order_index = OrderIndex(context.symbols)
+    # Markets whose price crossed a signal level since they were last
+    # evaluated; the signal stages only look at those
+    context.triggers = TriggerIndex(len(context.symbols))
+    # Active contracts, keyed by root symbol, refreshed by get_contracts
+    context.contracts = ContractCalendar(context.symbols)
+    # Auto close date (ns) of the contract each market held yesterday, 0
+    # before the first day
+    context.yesterday_auto_close_date = column('yesterday_auto_close_date')
+    # Trade and signal events, formatted and logged in batches by flush_events
+    context.event_log = EventLog(context.symbols)
+    # Position of each root symbol in context.symbols and the price arrays
+    context.symbol_index = context.markets.index
+
+class MarketTable(object):
+    """
+    Per-market state as one NumPy structured array, a row per market in
+    symbol order, with `index` mapping root symbol to row.
+
+    column() and records() return dict-like views keyed by root symbol, so
+    code written against context.<name>[sym] reads and writes the same
+    memory that array code reaches through `rows[name]`.
+    """
+    def __init__(self, symbols, columns):
+        self.symbols = list(symbols)
+        self.index = {sym: i for i, sym in enumerate(self.symbols)}
+        self.rows = np.zeros(
+            len(self.symbols),
+            dtype=[(name, dtype) for name, dtype, default in columns]
+        )
+        for name, dtype, default in columns:
+            self.rows[name] = default
+
+    def column(self, name):
+        return MarketColumn(self, name)
+
+    def records(self, prefix, keys):
+        return MarketRecords(self, prefix, keys)
+
+    def carry_over(self, other):
+        """
+        Copy the rows of the markets table `other` also has, in the columns
+        both have with the same type, so markets that stay in a changed
+        universe keep their state.
+        """
+        kept = [sym for sym in self.symbols if sym in other.index]
+        mine = [self.index[sym] for sym in kept]
+        theirs = [other.index[sym] for sym in kept]
+        for name in self.rows.dtype.names:
+            if name in other.rows.dtype.names\
+                and other.rows.dtype[name] == self.rows.dtype[name]:
+                self.rows[name][mine] = other.rows[name][theirs]
+
+    def snapshot(self):
+        return self.rows.copy()
+
+    def restore(self, rows):
+        self.rows[...] = rows
+
+class MarketColumn(object):
+    """
+    One column of a MarketTable, behaving like a dict keyed by root symbol.
+    """
+    def __init__(self, table, name):
+        self.index = table.index
+        self.values = table.rows[name]
+
+    def __getitem__(self, sym):
+        return self.values[self.index[sym]]
+
+    def __setitem__(self, sym, value):
+        self.values[self.index[sym]] = value
+
+    def __contains__(self, sym):
+        return sym in self.index
+
+    def __iter__(self):
+        return iter(self.index)
+
+    def __len__(self):
+        return len(self.index)
+
+    def get(self, sym, default=None):
+        i = self.index.get(sym)
+        return default if i is None else self.values[i]
+
+    def keys(self):
+        return self.index.keys()
+
+    def items(self):
+        return zip(self.index, self.values.tolist())
+
+    def update(self, pairs):
+        for sym, value in pairs:
+            self[sym] = value
+
+class MarketRecord(object):
+    """
+    The `prefix`ed columns of one market, accessed like a dict.
+    """
+    def __init__(self, rows, i, prefix):
+        self.rows = rows
+        self.i = i
+        self.prefix = prefix
+
+    def __getitem__(self, key):
+        return self.rows[self.prefix + key][self.i]
+
+    def __setitem__(self, key, value):
+        self.rows[self.prefix + key][self.i] = value
+
+class MarketRecords(object):
+    """
+    Dict-of-dicts view: records[sym][key] is column prefix + key of sym's row.
+    """
+    def __init__(self, table, prefix, keys):
+        self.table = table
+        self.prefix = prefix
+        self.keys = list(keys)
+
+    def __getitem__(self, sym):
+        return MarketRecord(self.table.rows, self.table.index[sym], self.prefix)
+
+    def __setitem__(self, sym, record):
+        i = self.table.index[sym]
+        for key, value in record.items():
+            self.table.rows[self.prefix + key][i] = value
+
+    def __contains__(self, sym):
+        return sym in self.table.index
+
+    def __iter__(self):
+        return iter(self.table.index)
+
+    def __len__(self):
+        return len(self.table.index)
+
+class OrderIndex(object):
+    """
+    The latest order of every market, keyed by root symbol.
+
+    The order object and its type ('limit', 'stop' or 'market') are cached,
+    so lookups never go back to get_order. refresh() re-reads only orders
+    that were still open, since filled, canceled and rejected orders cannot
+    change. Ids of older orders move to a bounded per-market archive.
+
+    Types and stop prices are also kept as arrays in symbol order
+    (`kind_codes`, `stops`) for the batched signal code. `fills` counts the
+    reads that found an order filled further, so a change in it means
+    positions changed.
+    """
+    OPEN = 0
+    CANCELED = 2
+    KINDS = [None, 'market', 'limit', 'stop']
+    MARKET = 1
+    LIMIT = 2
+    STOP = 3
+
+    def __init__(self, symbols, archive_size=32):
+        self.index = {sym: i for i, sym in enumerate(symbols)}
+        self.latest = dict.fromkeys(symbols)
+        self.kind_codes = np.zeros(len(self.index), dtype=np.int8)
+        self.stops = np.full(len(self.index), np.nan)
+        self.archive = {sym: deque(maxlen=archive_size) for sym in symbols}
+        self.archived = dict.fromkeys(symbols, 0)
+        # Symbols whose latest order was open when last read
+        self.open = set()
+        # Markets whose latest order, or its status, changed since the
+        # trigger index last looked
+        self.touched = np.zeros(len(self.index), dtype=bool)
+        self.fills = 0
+
+    def add(self, sym, order_id):
+        previous = self.latest[sym]
+        if previous is not None:
+            self.archive[sym].append(previous.id)
+            self.archived[sym] += 1
+
+        order_info = get_order(order_id)
+        self.store(sym, order_info)
+
+        i = self.index[sym]
+        if order_info.limit is not None:
+            self.kind_codes[i] = self.LIMIT
+        elif order_info.stop is not None:
+            self.kind_codes[i] = self.STOP
+        else:
+            self.kind_codes[i] = self.MARKET
+        self.stops[i] = order_info.stop if order_info.stop is not None else np.nan
+
+    def store(self, sym, order_info):
+        previous = self.latest[sym]
+        if previous is None or previous.id != order_info.id\
+            or previous.status != order_info.status:
+            self.touched[self.index[sym]] = True
+        filled = previous.filled if previous is not None\
+            and previous.id == order_info.id else 0
+        if order_info.filled != filled:
+            self.fills += 1
+        self.latest[sym] = order_info
+        if order_info.status == self.OPEN:
+            self.open.add(sym)
+        else:
+            self.open.discard(sym)
+
+    def last(self, sym):
+        """
+        Latest order object, or None if the market has never traded.
+        """
+        return self.latest[sym]
+
+    def kind(self, sym):
+        return self.KINDS[self.kind_codes[self.index[sym]]]
+
+    def status(self, sym):
+        order_info = self.latest[sym]
+        return order_info.status if order_info is not None else None
+
+    def reload(self, sym):
+        order_info = self.latest[sym]
+        # Restored orders are not known to the broker, and cannot change
+        if order_info is not None and order_info.id is not None:
+            self.store(sym, get_order(order_info.id))
+
+    def refresh(self):
+        """
+        Pick up fills and cancels of orders that were open.
+        """
+        for sym in list(self.open):
+            self.reload(sym)
+
+    def cancel(self, sym):
+        cancel_order(self.latest[sym].id)
+        self.reload(sym)
+
+class RestoredOrder(object):
+    """
+    A market's latest order as a checkpoint saved it, standing in for the
+    order in a run restored from it, where the broker never saw the
+    original. It has the attributes the algorithm reads. An order still
+    open at the checkpoint reads as canceled, as the broker cancels open
+    orders at the close.
+    """
+    def __init__(self, sid, amount, filled, limit, stop, limit_reached,
+                 stop_reached, status):
+        self.id = None
+        self.sid = sid
+        self.amount = amount
+        self.filled = filled
+        self.limit = limit
+        self.stop = stop
+        self.limit_reached = limit_reached
+        self.stop_reached = stop_reached
+        self.status = OrderIndex.CANCELED if status == OrderIndex.OPEN else status
+
+    @property
+    def asset(self):
+        return self.sid
+
+class RiskLedger(object):
+    """
+    Long and short unit totals, overall and per correlated group, updated
+    as each market's units change instead of rebuilt by rescanning.
+
+    `units` is the market_risk column as an array in symbol order; every
+    write to it goes through set() or add(). `levels` are lists of groups
+    of root symbols, one list per correlation level (closely, loosely).
+    """
+    def __init__(self, symbols, units, levels):
+        self.index = {sym: i for i, sym in enumerate(symbols)}
+        self.units = units
+        # Group of each market at each level, -1 for none
+        self.members = np.full((len(levels), len(self.index)), -1, dtype=np.int64)
+        for level, groups in enumerate(levels):
+            for g, group in enumerate(groups):
+                for sym in group:
+                    i = self.index.get(sym)
+                    if i is not None:
+                        self.members[level, i] = g
+        self.group_long = [np.zeros(len(groups)) for groups in levels]
+        self.group_short = [np.zeros(len(groups)) for groups in levels]
+        # Markets whose units changed since the trigger index last looked
+        self.touched = np.zeros(len(self.index), dtype=bool)
+        self.rebuild()
+
+    def regroup(self, levels):
+        """
+        Replace the groups with `levels`, a (members, groups) pair per
+        level as returned by correlated_groups, and recount the totals.
+        """
+        self.members = np.array([members for members, groups in levels])
+        self.group_long = [np.zeros(groups) for members, groups in levels]
+        self.group_short = [np.zeros(groups) for members, groups in levels]
+        self.rebuild()
+
+    def rebuild(self):
+        """
+        Recount every total from `units`, after they were written directly.
+        """
+        longs = np.maximum(self.units, 0)
+        shorts = np.maximum(-self.units, 0)
+        self.long = longs.sum()
+        self.short = shorts.sum()
+        for level, members in enumerate(self.members):
+            grouped = members >= 0
+            size = len(self.group_long[level])
+            self.group_long[level][:] = np.bincount(
+                members[grouped], weights=longs[grouped], minlength=size
+            )
+            self.group_short[level][:] = np.bincount(
+                members[grouped], weights=shorts[grouped], minlength=size
+            )
+
+    def count(self, i, units, sign):
+        if units > 0:
+            self.long += sign * units
+            totals = self.group_long
+        elif units < 0:
+            self.short -= sign * units
+            totals = self.group_short
+        else:
+            return
+        for level, g in enumerate(self.members[:, i]):
+            if g >= 0:
+                totals[level][g] += sign * abs(units)
+
+    def set(self, sym, units):
+        i = self.index[sym]
+        if self.units[i] == units:
+            return
+        self.touched[i] = True
+        self.count(i, self.units[i], -1)
+        self.units[i] = units
+        self.count(i, units, 1)
+
+    def add(self, sym, units):
+        self.set(sym, self.units[self.index[sym]] + units)
+
+    def admit(self, rows, candidates, long, limits):
+        """
+        The `candidates` (a mask over the markets at `rows`) that can each
+        add a long (or short) unit, taken in order, without going over the
+        direction limit, limits[0], or a group limit, limits[1:] (one per
+        level).
+        """
+        totals = self.group_long if long else self.group_short
+        used = math.ceil(self.long if long else self.short)
+        taken = [{} for level in totals]
+        admitted = np.zeros(len(candidates), dtype=bool)
+
+        for k in np.flatnonzero(candidates):
+            if used >= limits[0]:
+                break
+            groups = self.members[:, rows[k]]
+            if any(
+                g >= 0 and totals[level][g] + taken[level].get(g, 0) >= limit
+                for level, (g, limit) in enumerate(zip(groups, limits[1:]))
+            ):
+                continue
+            admitted[k] = True
+            used += 1
+            for level, g in enumerate(groups):
+                if g >= 0:
+                    taken[level][g] = taken[level].get(g, 0) + 1
+        return admitted
+
+class RollingCorrelation(object):
+    """
+    Correlation matrix of daily log returns over the last `window` bars,
+    updated one bar at a time.
+
+    For every pair of markets, the count, sums, sums of squares and cross
+    products over the bars both have are kept as (markets, markets) arrays.
+    A new bar adds its outer products and the bar leaving the window takes
+    its own away, so an update costs O(markets**2) whatever the window.
+    The sums are recomputed from the buffered returns once per `window`
+    bars, so rounding errors do not pile up.
+    """
+    def __init__(self, markets, window):
+        self.window = window
+        self.returns = np.zeros((window, markets))
+        self.valid = np.zeros((window, markets), dtype=bool)
+        self.head = 0
+        self.bars = 0
+        self.previous_close = np.full(markets, np.nan)
+        self.count = np.zeros((markets, markets))
+        # sums[i, j] sums market i's returns over the bars j also has
+        self.sums = np.zeros((markets, markets))
+        self.squares = np.zeros((markets, markets))
+        self.products = np.zeros((markets, markets))
+        self.last_date = None
+
+    def accumulate(self, returns, valid, sign):
+        present = valid.astype(np.float64)
+        self.count += sign * np.outer(present, present)
+        self.sums += sign * np.outer(returns, present)
+        self.squares += sign * np.outer(returns * returns, present)
+        self.products += sign * np.outer(returns, returns)
+
+    def rebuild(self):
+        returns = self.returns[:self.bars]
+        present = self.valid[:self.bars].astype(np.float64)
+        self.count = present.T.dot(present)
+        self.sums = returns.T.dot(present)
+        self.squares = (returns * returns).T.dot(present)
+        self.products = returns.T.dot(returns)
+
+    def push(self, closes):
+        with np.errstate(divide='ignore', invalid='ignore'):
+            returns = np.log(closes / self.previous_close)
+        valid = np.isfinite(returns)
+        returns = np.where(valid, returns, 0.0)
+        self.previous_close = np.where(np.isnan(closes), self.previous_close, closes)
+
+        head = self.head
+        if self.bars == self.window:
+            self.accumulate(self.returns[head], self.valid[head], -1)
+        self.returns[head] = returns
+        self.valid[head] = valid
+        self.accumulate(returns, valid, 1)
+
+        self.head = (head + 1) % self.window
+        self.bars = min(self.bars + 1, self.window)
+        if self.head == 0:
+            self.rebuild()
+
+    def update(self, dates, closes):
+        """
+        Push the bars dated after the previous update; `closes` is a
+        (markets, dates) array.
+        """
+        for t in range(unseen_bars(dates, self.last_date), len(dates)):
+            self.push(closes[:, t])
+
+        if len(dates):
+            self.last_date = dates[-1]
+
+    def matrix(self, min_periods):
+        """
+        Pairwise correlations, NaN for pairs with fewer than `min_periods`
+        shared returns.
+        """
+        count = self.count
+        covariance = count * self.products - self.sums * self.sums.T
+        variance = count * self.squares - self.sums * self.sums
+        with np.errstate(divide='ignore', invalid='ignore'):
+            correlation = covariance / np.sqrt(variance * variance.T)
+        correlation[(count < min_periods) | ~np.isfinite(correlation)] = np.nan
+        return correlation
+
+def correlated_groups(correlation, threshold):
+    """
+    Group markets by correlation: in symbol order, each market not yet in
+    a group starts one with the ungrouped markets correlated with it at
+    `threshold` or more. Grouping around a seed, rather than chaining
+    pairs, keeps loosely related markets from merging into one group.
+
+    Returns each market's group (-1 for markets left alone) and the
+    number of groups.
+    """
+    with np.errstate(invalid='ignore'):
+        linked = correlation >= threshold
+    members = np.full(len(correlation), -1, dtype=np.int64)
+    groups = 0
+
+    for i in range(len(correlation)):
+        if members[i] >= 0:
+            continue
+        group = linked[i] & (members < 0)
+        group[i] = True
+        if group.sum() > 1:
+            members[group] = groups
+            groups += 1
+
+    return members, groups
+
+def info_logged():
+    """
+    Whether log.info lines are emitted. Logs that cannot tell, like
+    Quantopian's, are taken to emit them.
+    """
+    enabled = getattr(log, 'isEnabledFor', None)
+    return enabled is None or enabled(INFO)
+
+class EventLog(object):
+    """
+    Trade and signal events as typed rows of a preallocated ring buffer.
+
+    record() stores numbers only; log lines are formatted when flush() is
+    called, in one batch, and only if they are echoed and the log emits
+    info lines. The last `capacity`
+    events stay queryable through frame(). A buffer about to overwrite
+    events that were never flushed flushes them first.
+    """
+    KINDS = [
+        'entry',
+        'scale',
+        'stop',
+        'exit',
+        'rollover',
+        'limit_to_market',
+        'stop_cancel',
+        'position',
+    ]
+    ENTRY = 0
+    SCALE = 1
+    STOP = 2
+    EXIT = 3
+    ROLLOVER = 4
+    LIMIT_TO_MARKET = 5
+    STOP_CANCEL = 6
+    POSITION = 7
+
+    # Values of `detail` for STOP events
+    NEW_LIMIT = 0
+    CANCELED_STOP = 1
+
+    DTYPE = [
+        ('time', np.int64),
+        ('kind', np.int8),
+        ('market', np.int32),
+        ('amount', np.int64),
+        ('size', np.int64),
+        ('price', np.float64),
+        ('risk', np.float64),
+        ('detail', np.int8),
+    ]
+
+    def __init__(self, symbols, capacity=65536):
+        self.symbols = list(symbols)
+        self.index = {sym: i for i, sym in enumerate(self.symbols)}
+        self.capacity = capacity
+        self.events = np.zeros(capacity, dtype=self.DTYPE)
+        # Events ever recorded, and how many of them were flushed
+        self.count = 0
+        self.flushed = 0
+        self.echo = True
+
+    def record(self, kind, sym, amount=0, size=0, price=np.nan, risk=np.nan,
+               detail=0):
+        if self.count - self.flushed == self.capacity:
+            self.flush(self.echo)
+        self.events[self.count % self.capacity] = (
+            get_datetime().value,
+            kind,
+            self.index[sym],
+            amount,
+            size,
+            price,
+            risk,
+            detail
+        )
+        self.count += 1
+
+    def pending(self):
+        """
+        Events recorded since the last flush, oldest first.
+        """
+        return self.slice(self.flushed)
+
+    def slice(self, first):
+        first = max(first, self.count - self.capacity)
+        start = first % self.capacity
+        end = start + self.count - first
+        if end <= self.capacity:
+            return self.events[start:end]
+        return np.concatenate([
+            self.events[start:],
+            self.events[:end - self.capacity]
+        ])
+
+    def flush(self, echo=True):
+        """
+        Log the pending events as one batch when `echo` is set, and mark
+        them flushed either way.
+        """
+        self.echo = echo
+        if echo and self.count > self.flushed and info_logged():
+            log.info('\n'.join(self.format(event) for event in self.pending()))
+        self.flushed = self.count
+
+    def format(self, event):
+        sym = self.symbols[event['market']]
+        kind = event['kind']
+        when = pd.Timestamp(event['time'])
+        if kind == self.ENTRY:
+            line = '%s(breakout strat %i)  %s  %i@%.2f' % (
+                'Long' if event['amount'] > 0 else 'Short',
+                event['detail'],
+                sym,
+                event['size'],
+                event['price']
+            )
+        elif kind == self.SCALE:
+            line = '%s(scaling)  %s  %i@%.2f' % (
+                'long' if event['amount'] > 0 else 'short',
+                sym,
+                event['size'],
+                event['price']
+            )
+        elif kind == self.STOP:
+            line = 'Stop  %s  %.2f (due to %s)' % (
+                sym,
+                event['price'],
+                'new limit order' if event['detail'] == self.NEW_LIMIT
+                else 'previous stop order canceled'
+            )
+        elif kind == self.EXIT:
+            line = 'Exit  %s  @%.2f' % (sym, event['price'])
+        elif kind == self.ROLLOVER:
+            line = 'Long(rollover) %s %i@%.2f' % (
+                sym,
+                event['amount'],
+                event['price']
+            )
+        elif kind == self.LIMIT_TO_MARKET:
+            line = '%s limit order is turned to market order so to fill better'\
+                ' before market close (%i)' % (sym, event['amount'])
+        elif kind == self.STOP_CANCEL:
+            line = '%s  stop order canceled due to end of day' % sym
+        else:
+            line = '%s  Position:%i  Trade Size:%.2f  Market Risk:%.2f' % (
+                sym,
+                event['amount'],
+                event['size'],
+                event['risk']
+            )
+        return '%s %s' % (when, line)
+
+    def frame(self, kind=None, sym=None):
+        """
+        The retained events as a DataFrame, oldest first, optionally only
+        those of one kind (a name from KINDS) or one market.
+        """
+        events = self.slice(0)
+        if kind is not None:
+            events = events[events['kind'] == self.KINDS.index(kind)]
+        if sym is not None:
+            events = events[events['market'] == self.index[sym]]
+        return pd.DataFrame({
+            'time': pd.to_datetime(events['time']),
+            'event': np.array(self.KINDS, dtype=object)[events['kind']],
+            'market': np.array(self.symbols, dtype=object)[events['market']],
+            'amount': events['amount'],
+            'size': events['size'],
+            'price': events['price'],
+            'risk': events['risk'],
+            'detail': events['detail'],
+        }, columns=[
+            'time', 'event', 'market', 'amount', 'size', 'price', 'risk',
+            'detail',
+        ])
+
+class TriggerIndex(object):
+    """
+    Which markets need their signals evaluated this slot.
+
+    Each market's signal levels (channels, stops, scale-in and shadow trade
+    levels) split the price axis into bands. After a market is evaluated,
+    the band its price sits in, between the nearest level below and the
+    nearest level above, is stored. A market is evaluated again once its
+    price reaches either edge, or when it is touched: something other than
+    the price changed, such as its orders, units or levels. Markets whose
+    signal the unit limits held back wait until some market's units change.
+    """
+    def __init__(self, markets):
+        self.lower = np.full(markets, np.inf)
+        self.upper = np.full(markets, -np.inf)
+        self.dirty = np.ones(markets, dtype=bool)
+        self.waiting = np.zeros(markets, dtype=bool)
+        self.date = None
+
+    def touch(self, rows):
+        self.dirty[rows] = True
+
+    def wait(self, rows):
+        self.waiting[rows] = True
+
+    def release(self):
+        """
+        Touch the waiting markets, now that units changed.
+        """
+        self.dirty |= self.waiting
+        self.waiting[:] = False
+
+    def touch_all(self):
+        self.dirty[:] = True
+
+    def crossed(self, prices):
+        """
+        Rows that left their band or were touched, in symbol order.
+        """
+        with np.errstate(invalid='ignore'):
+            moved = (prices <= self.lower) | (prices >= self.upper)
+        rows = np.flatnonzero(moved | self.dirty)
+        self.dirty[:] = False
+        return rows
+
+    def rearm(self, rows, prices, levels):
+        """
+        Store the band of each market at `rows` around its price, given its
+        levels as a (rows, levels) array; NaN levels are ignored.
+        """
+        price = prices[rows][:, None]
+        with np.errstate(invalid='ignore'):
+            self.lower[rows] = np.where(levels <= price, levels, -np.inf).max(axis=1)
+            self.upper[rows] = np.where(levels >= price, levels, np.inf).min(axis=1)
+        # Without a price there is no band; look again next slot
+        self.dirty[rows[np.isnan(price[:, 0])]] = True
+
+class ContractCalendar(object):
+    """
+    Active contract, multiplier and auto close date of every market, with
+    each root's contract chain cached.
+
+    A market only needs attention on the day its contract auto-closes;
+    refresh() then steps along the cached chain, and goes back to the data
+    only when the chain runs out. Multipliers and auto close dates (ns) are
+    arrays in symbol order for the batched code.
+
+    Reads like the Series get_contracts used to build: contracts[sym] is
+    the active contract, and iteration yields the active contracts.
+    """
+    def __init__(self, symbols):
+        self.symbols = list(symbols)
+        self.index = {sym: i for i, sym in enumerate(self.symbols)}
+        self.active = [None] * len(self.symbols)
+        self.chains = [[] for sym in self.symbols]
+        self.position = np.zeros(len(self.symbols), dtype=np.int64)
+        # 0 for markets without a contract, so they are retried every day
+        self.auto_close = np.zeros(len(self.symbols), dtype=np.int64)
+        self.multipliers = np.full(len(self.symbols), np.nan)
+        self.count = 0
+
+    def __getitem__(self, sym):
+        contract = self.active[self.index[sym]]
+        if contract is None:
+            raise KeyError(sym)
+        return contract
+
+    def __contains__(self, sym):
+        i = self.index.get(sym)
+        return i is not None and self.active[i] is not None
+
+    def __iter__(self):
+        return (contract for contract in self.active if contract is not None)
+
+    def __len__(self):
+        return self.count
+
+    def set(self, i, contract):
+        if (self.active[i] is None) != (contract is None):
+            self.count += 1 if contract is not None else -1
+        self.active[i] = contract
+        if contract is None:
+            self.auto_close[i] = 0
+            self.multipliers[i] = np.nan
+        else:
+            self.auto_close[i] = pd.Timestamp(contract.auto_close_date).value
+            self.multipliers[i] = contract.multiplier
+
+    def step(self, i, today):
+        """
+        Move market i to the first cached contract that is still trading
+        `today`; False if the chain has none left.
+        """
+        chain = self.chains[i]
+        position = self.position[i]
+        while position < len(chain)\
+            and pd.Timestamp(chain[position].auto_close_date).value <= today:
+            position += 1
+        if position == len(chain):
+            return False
+        self.position[i] = position
+        self.set(i, chain[position])
+        return True
+
+    def refresh(self, data, cfutures, today):
+        """
+        Roll the markets whose contract auto-closed by `today` (ns, at
+        midnight). Returns the rows that got a new contract.
+        """
+        due = np.flatnonzero(self.auto_close <= today)
+        stale = [i for i in due if not self.step(i, today)]
+
+        if stale:
+            assets = [cfutures[self.symbols[i]] for i in stale]
+            contracts = data.current(assets, 'contract')
+            for i, asset, contract in zip(stale, assets, contracts.values):
+                if contract is None or contract != contract:
+                    self.set(i, None)
+                    continue
+                chain = list(data.current_chain(asset))
+                self.chains[i] = chain if contract in chain else [contract]
+                self.position[i] = self.chains[i].index(contract)
+                self.set(i, contract)
+
+        return due[self.auto_close[due] > today]
+
+class BudgetExceeded(Exception):
+    pass
+
+class ProfileStats(object):
+    """
+    Aggregated calls of one profiled function. Latencies go into base-2
+    buckets of nanoseconds: bucket b counts calls taking [2**(b-1), 2**b).
+    """
+    def __init__(self, name, budget):
+        self.name = name
+        self.budget = budget
+        self.calls = 0
+        self.total_ns = 0
+        self.max_ns = 0
+        self.histogram = [0] * 64
+        self.markets = 0
+        self.allocated = 0
+        self.over_budget = 0
+
+    def add(self, elapsed_ns, markets):
+        self.calls += 1
+        self.total_ns += elapsed_ns
+        if elapsed_ns > self.max_ns:
+            self.max_ns = elapsed_ns
+        self.histogram[min(elapsed_ns.bit_length(), 63)] += 1
+        self.markets += markets
+
+    def percentile(self, q):
+        """
+        Upper edge, in ns, of the bucket holding the q-th percentile call.
+        """
+        rank = q / 100.0 * self.calls
+        seen = 0
+        for bucket, count in enumerate(self.histogram):
+            seen += count
+            if count and seen >= rank:
+                return min(2 ** bucket, self.max_ns)
+        return self.max_ns
+
+class Profiler(object):
+    """
+    Per-function latency histograms, call counts, markets iterated and,
+    with `allocations`, bytes allocated (via tracemalloc, offline only).
+
+    `budgets` maps function names to milliseconds, `default_budget` covers
+    the rest; an over-budget call is logged, or raises BudgetExceeded when
+    `on_budget` is 'fail'.
+    """
+    def __init__(self, budgets=None, default_budget=None, on_budget='warn',
+                 allocations=False):
+        if on_budget not in ('warn', 'fail'):
+            raise ValueError("on_budget must be 'warn' or 'fail'")
+        self.budgets = budgets or {}
+        self.default_budget = default_budget
+        self.on_budget = on_budget
+        self.stats = {}
+        self.tracemalloc = None
+        if allocations:
+            import tracemalloc
+            tracemalloc.start()
+            self.tracemalloc = tracemalloc
+
+    def stats_for(self, name):
+        stats = self.stats.get(name)
+        if stats is None:
+            budget = self.budgets.get(name, self.default_budget)
+            stats = self.stats[name] = ProfileStats(name, budget)
+        return stats
+
+    def call(self, func, context, data):
+        stats = self.stats_for(func.__name__)
+        if self.tracemalloc is not None:
+            before = self.tracemalloc.get_traced_memory()[0]
+            self.tracemalloc.reset_peak()
+
+        start = perf_counter_ns()
+        result = func(context, data)
+        elapsed = perf_counter_ns() - start
+
+        if self.tracemalloc is not None:
+            stats.allocated += self.tracemalloc.get_traced_memory()[1] - before
+        iterated = getattr(func, 'iterates', None)
+        stats.add(elapsed, len(getattr(context, iterated)) if iterated else 0)
+
+        if stats.budget is not None and elapsed > stats.budget * 1e6:
+            stats.over_budget += 1
+            message = '%s took %.1f ms, over its %i ms budget'\
+                % (stats.name, elapsed / 1e6, stats.budget)
+            if self.on_budget == 'fail':
+                raise BudgetExceeded(message)
+            log.warn(message)
+        return result
+
+    def table(self):
+        """
+        One row of aggregated stats per function, slowest total first.
+        """
+        rows = []
+        for stats in self.stats.values():
+            calls = stats.calls or 1
+            rows.append({
+                'function': stats.name,
+                'calls': stats.calls,
+                'total_ms': stats.total_ns / 1e6,
+                'mean_us': stats.total_ns / 1e3 / calls,
+                'p50_us': stats.percentile(50) / 1e3,
+                'p90_us': stats.percentile(90) / 1e3,
+                'p99_us': stats.percentile(99) / 1e3,
+                'max_us': stats.max_ns / 1e3,
+                'markets_per_call': stats.markets / float(calls),
+                'alloc_kib_per_call': stats.allocated / 1024.0 / calls,
+                'over_budget': stats.over_budget,
+            })
+        return pd.DataFrame(rows, columns=[
+            'function', 'calls', 'total_ms', 'mean_us', 'p50_us', 'p90_us',
+            'p99_us', 'max_us', 'markets_per_call', 'alloc_kib_per_call',
+            'over_budget',
+        ]).sort_values('total_ms', ascending=False)
+
+def profiled(func):
+    """
+    Decorate a scheduled function so context.profiler, when set, records
+    its calls. With profiling off it costs one attribute check per call.
+    """
+    @wraps(func)
+    def wrapper(context, data):
+        profiler = context.profiler
+        if profiler is None:
+            return func(context, data)
+        return profiler.call(func, context, data)
+    return wrapper
+
+def iterates(attribute):
+    """
+    Tell the profiler which context attribute a function loops over, so
+    it can count markets per call.
+    """
+    def decorate(func):
+        func.iterates = attribute
+        return func
+    return decorate
+
+def refresh_orders(context, data):
+    """
+    Update cached order state with fills and cancels since the last slot.
+    """
+    context.order_index.refresh()
+
+class PipelineStage(object):
+    def __init__(self, func, after, inputs, when):
+        self.func = func
+        self.name = func.__name__
+        self.after = list(after)
+        self.inputs = inputs
+        self.when = when
+        self.last_inputs = None
+        self.calls = 0
+        self.skips = 0
+
+class Pipeline(object):
+    """
+    Scheduled functions run as one unit, in dependency order.
+
+    A stage declared with `inputs` (a function of the context) is skipped
+    when those inputs equal the ones it last ran with and none of the
+    stages it depends on ran this time. A stage declared with `when` (a
+    predicate of the context) is skipped while it is false. Per-stage call
+    counts and skips are kept for timings(); run times are the profiler's.
+    """
+    def __init__(self):
+        self.stages = []
+        self.by_func = {}
+
+    def add(self, func, after=(), inputs=None, when=None):
+        for dependency in after:
+            if dependency not in self.by_func:
+                raise ValueError(
+                    '%s depends on %s, which is not in the pipeline'
+                    % (func.__name__, dependency.__name__)
+                )
+        stage = PipelineStage(func, after, inputs, when)
+        self.by_func[func] = stage
+        # Dependencies must already be present, so insertion order is a
+        # valid topological order
+        self.stages.append(stage)
+
+    def run(self, context, data):
+        ran = set()
+        for stage in self.stages:
+            if stage.when is not None and not stage.when(context):
+                stage.skips += 1
+                continue
+            if stage.inputs is not None:
+                inputs = stage.inputs(context)
+                if stage.calls and inputs == stage.last_inputs and\
+                    not any(dependency in ran for dependency in stage.after):
+                    stage.skips += 1
+                    continue
+                stage.last_inputs = inputs
+
+            if context.profiler is None:
+                stage.func(context, data)
+            else:
+                context.profiler.call(stage.func, context, data)
+            stage.calls += 1
+            ran.add(stage.func)
+
+    def timings(self, profiler=None):
+        """
+        (stage, calls, skips, total ms, mean ms per call) for every stage.
+        Times are read from `profiler`, and are NaN without one.
+        """
+        rows = []
+        for stage in self.stages:
+            total = mean = np.nan
+            stats = None
+            if profiler is not None:
+                stats = profiler.stats.get(stage.name)
+            if stats is not None and stats.calls:
+                total = stats.total_ns / 1e6
+                mean = total / stats.calls
+            rows.append((stage.name, stage.calls, stage.skips, total, mean))
+        return rows
+
+@profiled
+def run_start_of_day(context, data):
+    if context.restore_from is not None:
+        restore_checkpoint(context, context.restore_from)
+        context.restore_from = None
+    context.start_of_day.run(context, data)
+    context.day_ready = pd.Timestamp(get_datetime()).normalize()
+
+@profiled
+def run_intraday(context, data):
+    if not context.streaming:
+        context.intraday.run(context, data)
+
+def handle_data(context, data):
+    """
+    In streaming mode, push every minute bar through the intraday
+    pipeline. Bars that cross no signal level stop after find_triggers.
+    Bars before today's start-of-day are skipped, as the prices, channels
+    and contracts are still yesterday's.
+    """
+    if context.streaming\
+        and context.day_ready == pd.Timestamp(get_datetime()).normalize():
+        context.intraday.run(context, data)
+
+def has_signals(context):
+    """
+    True when find_triggers picked any market for this bar or slot.
+    """
+    return len(context.signal_rows) > 0
+
+def analyze(context, perf):
+    """
+    Log per-stage pipeline call counts at the end of a backtest, and their
+    times and the profiler's stats when profiling is on.
+    """
+    for pipeline in (context.start_of_day, context.intraday):
+        for name, calls, skips, total, mean in pipeline.timings(context.profiler):
+            log.info(
+                '%-32s calls:%6i  skipped:%6i  total:%9.1f ms  mean:%7.3f ms'
+                % (name, calls, skips, total, mean)
+            )
+
+    if context.profiler is not None:
+        log.info('\n%s' % context.profiler.table().to_string(index=False))
 
-    if context.is_timed:
-        time_taken = (time() - start_time) * 1000
-        log.debug('Executed in %f ms.' % time_taken)
-        assert(time_taken < 1024)
+    context.event_log.flush(context.is_info)
 
+@iterates('tradable_symbols')
 def check_rollover(context, data):
     """
     see if the contract have rollovered
     """
-    for sym in context.tradable_symbols:
-        current_auto_close_date = context.contracts[sym].auto_close_date
-               
-        try:
-            if current_auto_close_date != context.yesterday_auto_close_date[sym]:
-                previous_order = get_order(context.orders[sym][-1])
-                if previous_order.stop is not None and previous_order.status == context.canceled:
-                    price = data.current(context.cfutures[sym], 'price')
-                    order_identifier = order(
-                        context.contracts[sym],
-                        -previous_order.amount,
-                        style = LimitOrder(price)
-                    )
+    rows = context.tradable_rows
+    current = context.contracts.auto_close[rows]
+    yesterday = context.yesterday_auto_close_date.values
+    rolled = rows[(current != yesterday[rows]) & (yesterday[rows] != 0) & (current != 0)]
+    yesterday[rows] = current
+
+    for i in rolled:
+        sym = context.symbols[i]
+        previous_order = context.order_index.last(sym)
+        if previous_order is not None and previous_order.stop is not None\
+            and previous_order.status == context.canceled:
+            price = data.current(context.cfutures[sym], 'price')
+            order_identifier = order(
+                context.contracts[sym],
+                -previous_order.amount,
+                style = LimitOrder(price)
+            )
 
-                    if order_identifier is not None:
-                        context.orders[sym].append(order_identifier)
+            if order_identifier is not None:
+                context.order_index.add(sym, order_identifier)
 
-                    log.info(
-                        'Long(rollover) %s %i@%.2f'
-                        %(
-                            sym,
-                            -previous_order.amount,
-                            price
-                        )
-                    )
-        except (KeyError, IndexError):
-            pass
-    
-        context.yesterday_auto_close_date[sym] = current_auto_close_date
-                  
-
-        
-        
+            context.event_log.record(
+                EventLog.ROLLOVER,
+                sym,
+                amount=-previous_order.amount,
+                price=price
+            )
+
+@profiled
+@iterates('tradable_symbols')
 def clear_stops(context, data):
     """
     Clear stops 1 minute before market close.
     """
-    if context.is_timed:
-        start_time = time()
+    context.order_index.refresh()
 
     for sym in context.tradable_symbols:
-        try:
-            order_info = get_order(context.orders[sym][-1])
-            unfilled_stop_price = order_info.stop
-        except IndexError:
+        order_info = context.order_index.last(sym)
+        if order_info is None:
             continue
 
-        if unfilled_stop_price is not None and order_info.status == 0:
-            cancel_order(context.orders[sym][-1])
-            log.info( '%s  stop order canceled due to end of day' %(sym))
-
-
-    if context.is_timed:
-        time_taken = (time() - start_time) * 1000
-        log.debug('Executed in %f ms.' % time_taken)
-        assert(time_taken < 1024)
+        if order_info.stop is not None and order_info.status == 0:
+            context.order_index.cancel(sym)
+            context.event_log.record(EventLog.STOP_CANCEL, sym)
 
+@profiled
 def log_context(context, data):
     log.info('Porfolio cash: %.2f \n' % context.portfolio.cash)
     log.info('Capital:          %.2f \n' % context.capital)
@@ -310,16 +1527,249 @@ def log_context(context, data):
         sym = contract.root_symbol
         if sym in context.tradable_symbols:
             position = context.portfolio.positions[contract]
-            log.info(
-                '%s  Position:%i  Trade Size:%.2f  Market Risk:%.2f'
-                %(
-                    sym,
-                    position.amount,
-                    context.trade_size[sym],
-                    context.market_risk[sym],
-                )
+            context.event_log.record(
+                EventLog.POSITION,
+                sym,
+                amount=position.amount,
+                size=context.trade_size[sym],
+                risk=context.market_risk[sym]
             )
 
+@profiled
+def flush_events(context, data):
+    """
+    Log the day's trade and signal events at market close.
+    """
+    context.event_log.flush(context.is_info)
+
+@profiled
+def write_checkpoint(context, data):
+    """
+    Save the strategy state at market close, when a checkpoint path is set.
+    """
+    if context.checkpoint_path is None:
+        return
+    save_checkpoint(
+        context,
+        context.checkpoint_path.replace(
+            '{date}',
+            pd.Timestamp(get_datetime()).strftime('%Y-%m-%d')
+        )
+    )
+
+def to_datetime64(date):
+    return np.datetime64('NaT', 'ns') if date is None else np.datetime64(date, 'ns')
+
+def from_datetime64(value):
+    return None if np.isnat(value) else value
+
+def save_checkpoint(context, path):
+    """
+    Write the strategy state to `path` as an uncompressed .npz: the market
+    table, price store, N, correlation and trigger state, unit groups,
+    latest orders and the portfolio the state goes with. Rolling
+    channels are not saved; they are rebuilt from the price store, which
+    holds their whole window. Offline only, as it writes files.
+    """
+    import os
+
+    symbols = context.symbols
+    arrays = {
+        'version': np.array(CHECKPOINT_VERSION),
+        # Session the state is as of, at its close
+        'date': np.array(
+            pd.Timestamp(get_datetime()).normalize().value
+        ).astype('datetime64[ns]'),
+        'symbols': np.array(symbols),
+        'markets': context.markets.rows,
+        'capital': np.array(context.capital),
+        'profit': np.array(context.profit),
+        'long_risk': np.array(context.long_risk),
+        'short_risk': np.array(context.short_risk),
+        'contracts_version': np.array(context.contracts_version),
+        'warm_started': np.array(context.warm_started),
+        'atr_date': np.array(to_datetime64(context.atr_date)),
+    }
+
+    state = context.atr_state or AverageTrueRange(context.atr_period, len(symbols))
+    arrays['atr_value'] = state.value
+    arrays['atr_previous_close'] = state.previous_close
+    arrays['atr_count'] = state.count
+    arrays['atr_total'] = state.total
+    arrays['atr_last_date'] = state.last_date
+
+    store = context.price_store
+    if store is not None:
+        arrays['price_window'] = np.array(store.window)
+        arrays['price_bars'] = store.bars
+        arrays['price_dates'] = store.dates
+        arrays['price_head'] = np.array(store.head)
+        arrays['price_count'] = np.array(store.count)
+        arrays['price_last_date'] = np.array(to_datetime64(store.last_date))
+
+    engine = context.correlations
+    if engine is not None:
+        arrays['correlation_window'] = np.array(engine.window)
+        arrays['correlation_returns'] = engine.returns
+        arrays['correlation_valid'] = engine.valid
+        arrays['correlation_head'] = np.array(engine.head)
+        arrays['correlation_bars'] = np.array(engine.bars)
+        arrays['correlation_previous_close'] = engine.previous_close
+        arrays['correlation_last_date'] = np.array(to_datetime64(engine.last_date))
+
+    ledger = context.risk_ledger
+    arrays['ledger_members'] = ledger.members
+    arrays['ledger_groups'] = np.array([len(totals) for totals in ledger.group_long])
+
+    triggers = context.triggers
+    arrays['trigger_lower'] = triggers.lower
+    arrays['trigger_upper'] = triggers.upper
+    arrays['trigger_dirty'] = triggers.dirty
+    arrays['trigger_waiting'] = triggers.waiting
+    arrays['trigger_date'] = np.array(to_datetime64(triggers.date))
+
+    # Latest orders by content: order ids mean nothing to another run
+    orders = context.order_index
+    latest = [orders.last(sym) for sym in symbols]
+    present = [order_info is not None for order_info in latest]
+    field = lambda name, missing: [
+        missing if order_info is None or getattr(order_info, name) is None
+        else getattr(order_info, name)
+        for order_info in latest
+    ]
+    arrays['order_present'] = np.array(present)
+    arrays['order_assets'] = np.array([
+        order_info.sid.symbol if order_info is not None else ''
+        for order_info in latest
+    ])
+    arrays['order_amounts'] = np.array(field('amount', 0), dtype=np.int64)
+    arrays['order_filled'] = np.array(field('filled', 0), dtype=np.int64)
+    arrays['order_limits'] = np.array(field('limit', np.nan), dtype=np.float64)
+    arrays['order_stop_prices'] = np.array(field('stop', np.nan), dtype=np.float64)
+    arrays['order_limit_reached'] = np.array(field('limit_reached', False), dtype=bool)
+    arrays['order_stop_reached'] = np.array(field('stop_reached', False), dtype=bool)
+    arrays['order_statuses'] = np.array(field('status', 0), dtype=np.int64)
+    arrays['order_kinds'] = orders.kind_codes
+    arrays['order_stops'] = orders.stops
+
+    positions = list(context.portfolio.positions.values())
+    arrays['cash'] = np.array(context.portfolio.cash)
+    arrays['position_symbols'] = np.array(
+        [position.asset.symbol for position in positions], dtype=str
+    )
+    arrays['position_amounts'] = np.array(
+        [position.amount for position in positions], dtype=np.int64
+    )
+    arrays['position_cost_basis'] = np.array(
+        [position.cost_basis for position in positions], dtype=np.float64
+    )
+
+    # Write then rename, so a crash never leaves half a checkpoint
+    directory = os.path.dirname(path)
+    if directory and not os.path.isdir(directory):
+        os.makedirs(directory)
+    with open(path + '.tmp', 'wb') as f:
+        np.savez(f, **arrays)
+    os.replace(path + '.tmp', path)
+
+def restore_checkpoint(context, path):
+    """
+    Load a checkpoint written by save_checkpoint into a context that
+    initialize set up for the same symbols and systems. Each market's
+    latest order comes back as a RestoredOrder, so stops are placed again
+    from it as after any close. The portfolio is not touched: it belongs
+    to the broker (replay.py can seed it).
+    """
+    with np.load(path) as f:
+        arrays = dict(f.items())
+
+    version = int(arrays['version']) if 'version' in arrays else 0
+    if version != CHECKPOINT_VERSION:
+        raise ValueError(
+            '%s is a version %i checkpoint; version %i is expected'
+            % (path, version, CHECKPOINT_VERSION)
+        )
+    if list(arrays['symbols']) != list(context.symbols):
+        raise ValueError('%s was saved for different symbols' % path)
+    if arrays['markets'].dtype != context.markets.rows.dtype:
+        raise ValueError('%s was saved for different systems' % path)
+
+    context.markets.restore(arrays['markets'])
+    context.capital = float(arrays['capital'])
+    context.profit = float(arrays['profit'])
+    context.long_risk = float(arrays['long_risk'])
+    context.short_risk = float(arrays['short_risk'])
+    context.contracts_version = int(arrays['contracts_version'])
+    context.warm_started = bool(arrays['warm_started'])
+    context.atr_date = from_datetime64(arrays['atr_date'][()])
+
+    state = context.atr_state = AverageTrueRange(
+        context.atr_period,
+        len(context.symbols)
+    )
+    state.value[:] = arrays['atr_value']
+    state.previous_close[:] = arrays['atr_previous_close']
+    state.count[:] = arrays['atr_count']
+    state.total[:] = arrays['atr_total']
+    state.last_date[:] = arrays['atr_last_date']
+
+    context.price_store = None
+    if 'price_bars' in arrays:
+        store = context.price_store = PriceStore(
+            context.symbols,
+            context.price_fields,
+            int(arrays['price_window'])
+        )
+        store.bars = arrays['price_bars']
+        store.dates = arrays['price_dates']
+        store.head = int(arrays['price_head'])
+        store.count = int(arrays['price_count'])
+        store.last_date = from_datetime64(arrays['price_last_date'][()])
+    context.rolling_highs = None
+    context.rolling_lows = None
+
+    context.correlations = None
+    if 'correlation_returns' in arrays:
+        engine = context.correlations = RollingCorrelation(
+            len(context.symbols),
+            int(arrays['correlation_window'])
+        )
+        engine.returns = arrays['correlation_returns']
+        engine.valid = arrays['correlation_valid']
+        engine.head = int(arrays['correlation_head'])
+        engine.bars = int(arrays['correlation_bars'])
+        engine.previous_close = arrays['correlation_previous_close']
+        engine.last_date = from_datetime64(arrays['correlation_last_date'][()])
+        engine.rebuild()
+
+    context.risk_ledger.regroup(
+        list(zip(arrays['ledger_members'], arrays['ledger_groups']))
+    )
+
+    triggers = context.triggers
+    triggers.lower[:] = arrays['trigger_lower']
+    triggers.upper[:] = arrays['trigger_upper']
+    triggers.dirty[:] = arrays['trigger_dirty']
+    triggers.waiting[:] = arrays['trigger_waiting']
+    triggers.date = from_datetime64(arrays['trigger_date'][()])
+
+    orders = context.order_index
+    orders.kind_codes[:] = arrays['order_kinds']
+    orders.stops[:] = arrays['order_stops']
+    optional = lambda value: None if value != value else float(value)
+    for i in np.flatnonzero(arrays['order_present']):
+        orders.store(context.symbols[i], RestoredOrder(
+            future_symbol(str(arrays['order_assets'][i])),
+            int(arrays['order_amounts'][i]),
+            int(arrays['order_filled'][i]),
+            optional(arrays['order_limits'][i]),
+            optional(arrays['order_stop_prices'][i]),
+            bool(arrays['order_limit_reached'][i]),
+            bool(arrays['order_stop_reached'][i]),
+            int(arrays['order_statuses'][i])
+        ))
+
+@profiled
 def log_risks(context, data):
     """
     Log long and short risk 1 minute before market close.
@@ -329,53 +1779,268 @@ def log_risks(context, data):
         short_risk = context.short_risk
     )
 
+class PriceStore(object):
+    """
+    Ring buffer of completed daily bars, shape (symbols, fields, window).
+
+    Every bar is written twice, `window` slots apart, in a buffer twice as
+    long, so the latest bars are always one contiguous slice and `window()`
+    is a zero-copy view, oldest bar first.
+    """
+    def __init__(self, symbols, fields, window):
+        self.symbols = list(symbols)
+        self.fields = list(fields)
+        self.window = window
+        self.bars = np.full((len(self.symbols), len(self.fields), 2 * window), np.nan)
+        self.dates = np.zeros(2 * window, dtype='datetime64[ns]')
+        self.head = 0
+        self.count = 0
+        self.last_date = None
+
+    def append(self, date, values):
+        """
+        Write one bar; `values` is a (symbols, fields) array.
+        """
+        head = self.head
+        self.bars[:, :, head] = values
+        self.bars[:, :, head + self.window] = values
+        self.dates[head] = date
+        self.dates[head + self.window] = date
+        self.head = (head + 1) % self.window
+        self.count = min(self.count + 1, self.window)
+        self.last_date = date
+
+    def extend(self, dates, values):
+        """
+        Write several bars; `values` is a (symbols, fields, dates) array.
+        """
+        for i in range(len(dates)):
+            self.append(dates[i], values[:, :, i])
+
+    def window_view(self):
+        end = self.head + self.window
+        return self.bars[:, :, end - self.count:end]
+
+    def date_view(self):
+        end = self.head + self.window
+        return self.dates[end - self.count:end]
+
+def fetch_daily_bars(context, data, bars):
+    """
+    Last `bars` daily high/low/close bars of every market, today's partial
+    bar included, as (dates, (symbol, field, date) array).
+    """
+    cfutures = [context.cfutures[sym] for sym in context.symbols]
+    frames = [
+        data.history(cfutures, field, bars, '1d')
+        for field in context.price_fields
+    ]
+    block = np.stack([frame.values.T for frame in frames], axis=1)
+    return frames[0].index.values, block
+
 def get_prices(context, data):
     """
     Get high, low, and close prices.
+    After warm-up only the bar completed since yesterday is fetched.
     """
-    if context.is_timed:
-        start_time = time()
-
-    cfutures = [v for k, v in context.cfutures.items()]
-    fields = ['high', 'low', 'close']
-    bars = context.strat_two_breakout + 1
-    frequency = '1d'
-
-    # Retrieves a pandas panel with axes labelled as:
-    # (Index: field, Major-axis: date, Minor-axis: symbol)
-    context.prices = data.history(
-        cfutures,
-        fields,
-        bars,
-        frequency
-    )
-    
+    window = max(channel_windows(context))
+    store = context.price_store
+    warm_up = store is None or store.window != window
+
+    if not warm_up:
+        # Three bars: the one the store already has, the one to add, today
+        dates, block = fetch_daily_bars(context, data, 3)
+        if len(dates) == 3 and dates[-3] == store.last_date:
+            store.append(dates[-2], block[:, :, -2])
+        elif len(dates) < 2 or dates[-2] != store.last_date:
+            # Missed a day; start over
+            warm_up = True
+
+    if warm_up:
+        dates, block = fetch_daily_bars(context, data, window + 1)
+        store = context.price_store = PriceStore(
+            context.symbols,
+            context.price_fields,
+            window
+        )
+        store.extend(dates[:-1], block[:, :, :-1])
+
+    # Indicator code reads completed bars through these views
+    context.price_symbols = store.symbols
+    context.price_block = store.window_view()
+    context.price_dates = store.date_view()
+    context.today_bar = block[:, :, -1]
+
     if context.is_test:
-        assert(context.prices.shape[0] == 3)
-
-    # Tranpose/Reindex panel in axes with:
-    # (Index: symbol, Major-axis: field, Minor-axis: date)
-    context.prices = context.prices.transpose(2, 0, 1)
-    context.prices = context.prices.reindex()
-    syms = {future: future.root_symbol for future in context.prices.axes[0]}
-    context.prices = context.prices.rename(items=syms)
-    
-    if context.is_timed:
-        time_taken = (time() - start_time) * 1000
-        log.debug('Executed in %f ms.' % time_taken)
-        assert(time_taken < 8192)
+        assert(context.price_block.shape[:2] == (len(context.symbols), 3))
+
+@iterates('symbols')
+def get_current_prices(context, data):
+    """
+    Snapshot every market's price in one call at the start of a slot.
+    Signal functions read context.current_prices (ordered like
+    context.symbols) so they all see the same prices.
+    """
+    cfutures = [context.cfutures[sym] for sym in context.symbols]
+    context.current_prices = data.current(cfutures, 'price').values
+
+def shadow_profit(state, entry, exit_level, n):
+    """
+    Profit, in price points, of closing shadow trades at `exit_level`.
+    A trade of k units added every 0.5 N has them priced 0.5 N apart below
+    (above) the last entry for a long (short), so its earlier units gain
+    0.5 N * k * (k - 1) / 2 on top of k times the last unit's gain.
+    """
+    units = np.abs(state)
+    ladder = 0.5 * n * units * (units - 1) / 2
+    return np.where(
+        state > 0,
+        units * (exit_level - entry) + ladder,
+        units * (entry - exit_level) + ladder
+    )
+
+def shadow_step(state, entry, stop, exit_level, won, price, n,
+                breakout_high, breakout_low, exit_high, exit_low):
+    """
+    Move the shadow trades on to `price`: enter on a breakout, add a unit
+    every 0.5 N, stop out 2 N from the last unit or leave on the exit
+    channel, noting whether a finished trade won. Trade state is
+    (markets, systems); `price` and `n` are (markets, 1).
 
+    Returns the new state, entry, stop, exit and won arrays.
+    """
+    with np.errstate(invalid='ignore'):
+        up = price > breakout_high
+        down = price < breakout_low
+
+        flat = state == 0
+        enter = flat & (up | down)
+        add_long = ~flat & (state > 0) & (state < 4) & (price > entry + 0.5 * n)
+        add_short = ~flat & (state < 0) & (state > -4) & (price < entry - 0.5 * n)
+        moved = enter | add_long | add_short
+        stopped = ~moved & (
+            (state > 0) & (price < stop) | (state < 0) & (price > stop)
+        )
+        exit_long = ~moved & ~stopped & (state > 0) & (price < exit_level)
+        exit_short = ~moved & ~stopped & (state < 0) & (price > exit_level)
+
+        profit = shadow_profit(state, entry, exit_level, n)
+        closed = exit_long | exit_short
+        won = np.where(closed & (profit > 0), True, won)
+        won = np.where(closed & (profit < 0) | stopped, False, won)
+
+        longs = enter & up | add_long
+        shorts = enter & ~up | add_short
+        done = stopped | closed
+        state = np.where(enter, np.where(up, 1, -1), state)
+        state = np.where(add_long, state + 1, state)
+        state = np.where(add_short, state - 1, state)
+        state = np.where(done, 0, state)
+        entry = np.where(moved, price, np.where(done, 0.0, entry))
+        stop = np.where(longs, price - 2 * n, np.where(shorts, price + 2 * n, stop))
+        stop = np.where(done, 0.0, stop)
+        exit_level = np.where(longs, exit_low, np.where(shorts, exit_high, exit_level))
+        exit_level = np.where(done, 0.0, exit_level)
+
+    return state, entry, stop, exit_level, won
+
+def shadow_trades(highs, lows, closes, breakouts, exits, period):
+    """
+    Replay the shadow trades of systems with the given `breakouts` and
+    `exits` windows over daily (markets, dates) arrays, stepping through
+    dates with every market and system at once; each day's close stands in
+    for the intraday prices. Channels and N are those of the bars before
+    each day, and each distinct window is computed once.
+
+    Returns the final (markets, systems) state, entry, stop and exit arrays
+    and whether each system's last finished shadow trade won.
+    """
+    channels = {}
+    def rolling(values, window, highest):
+        key = (highest, window)
+        if key not in channels:
+            channels[key] = getattr(
+                pd.DataFrame(values.T).rolling(window, min_periods=window),
+                'max' if highest else 'min'
+            )().shift(1).values
+        return channels[key]
+    stacked = lambda values, windows, highest: np.stack(
+        [rolling(values, window, highest) for window in windows],
+        axis=2
+    )
+    breakout_high = stacked(highs, breakouts, True)
+    breakout_low = stacked(lows, breakouts, False)
+    exit_high = stacked(highs, exits, True)
+    exit_low = stacked(lows, exits, False)
+
+    markets = len(closes)
+    shape = (markets, len(breakouts))
+    state = np.zeros(shape, dtype=np.int64)
+    entry = np.zeros(shape)
+    stop = np.zeros(shape)
+    exit_level = np.zeros(shape)
+    won = np.zeros(shape, dtype=bool)
+
+    # N of the bars before each day
+    n = np.empty(closes.shape)
+    n[:, 0] = np.nan
+    n[:, 1:] = AverageTrueRange.series(highs, lows, closes, period)[:, :-1]
+
+    with np.errstate(invalid='ignore'):
+        for t in range(closes.shape[1]):
+            state, entry, stop, exit_level, won = shadow_step(
+                state, entry, stop, exit_level, won,
+                closes[:, t, None],
+                n[:, t, None],
+                breakout_high[t],
+                breakout_low[t],
+                exit_high[t],
+                exit_low[t]
+            )
+
+    return state, entry, stop, exit_level, won
+
+@iterates('symbols')
+def warm_start(context, data):
+    """
+    Seed position_analytics and previous_trade_won by replaying the shadow
+    trades over the last warm_start_bars daily bars, once, before the
+    first day.
+    """
+    if context.warm_started or not context.warm_start_bars:
+        return
+    context.warm_started = True
+
+    dates, block = fetch_daily_bars(context, data, context.warm_start_bars + 1)
+    # Completed bars only; today's partial bar is the live code's business
+    state, entry, stop, exit_level, won = shadow_trades(
+        block[:, HIGH, :-1],
+        block[:, LOW, :-1],
+        block[:, CLOSE, :-1],
+        [system.breakout for system in context.systems],
+        [system.exit for system in context.systems],
+        context.atr_period
+    )
+
+    m = context.markets.rows
+    m['analytics_state'] = state
+    m['analytics_entry'] = entry
+    m['analytics_stop'] = stop
+    m['analytics_exit'] = exit_level
+    m['previous_trade_won'] = won
+    context.triggers.touch_all()
+
+@iterates('symbols')
 def validate_prices(context, data):
 # data is not used
     """
     Drop markets with null prices.
     """
-    if context.is_timed:
-        start_time = time()
-
-    context.prices.dropna(axis=0, inplace=True)
+    valid = ~np.isnan(context.price_block).any(axis=(1, 2))\
+        & ~np.isnan(context.today_bar).any(axis=1)
+    context.tradable_rows = np.flatnonzero(valid)
 
-    validated_markets = context.prices.axes[0]
+    validated_markets = [context.price_symbols[i] for i in context.tradable_rows]
 
     dropped_markets = list(
         set(context.symbols) - set(validated_markets)
@@ -389,174 +2054,467 @@ def validate_prices(context, data):
             % ', '.join(dropped_markets)
         )
 
-    if context.is_timed:
-        time_taken = (time() - start_time) * 1000
-        log.debug('Executed in %f ms.' % time_taken)
-        assert(time_taken < 1024)
+def unseen_bars(dates, last_date):
+    """
+    Index of the first bar in `dates` after `last_date`.
+    """
+    if last_date is None:
+        return 0
+    return dates.searchsorted(last_date, side='right')
+
+class MonotonicQueue(object):
+    """
+    A monotonic deque per market of the bars that can still be the maximum
+    of a window: each greater than every bar after it, oldest first, so the
+    front is the maximum.
+
+    Whether a bar is greater than every later one does not depend on the
+    window, so a shorter window's deque is the tail of the longest one's
+    and all windows share one: each only has its own length. The deques
+    are ring buffers of the longest window's slots, a row per market. Each
+    bar is appended and removed at most once, so keeping the maxima costs
+    amortized O(1) per bar.
+    """
+    def __init__(self, markets, windows):
+        self.windows = sorted(set(windows))
+        self.capacity = self.windows[-1]
+        # Flat (markets, capacity) rings, so a slot is one index
+        self.values = np.full(markets * self.capacity, np.nan)
+        self.dates = np.full(markets * self.capacity, np.datetime64('NaT', 'ns'))
+        # Slot the next bar goes in
+        self.tail = np.zeros(markets, dtype=np.int64)
+        self.length = {n: np.zeros(markets, dtype=np.int64) for n in self.windows}
+
+    def front(self, window, rows):
+        """
+        Maximum over `window` of markets `rows`, NaN for empty deques.
+        """
+        length = self.length[window][rows]
+        first = rows * self.capacity + (self.tail[rows] - length) % self.capacity
+        return np.where(length > 0, self.values[first], np.nan)
+
+    def push(self, dates, value, rows):
+        """
+        Append the bar `value`, dated the last of `dates`, to markets
+        `rows`, which hold every bar up to the one before.
+        """
+        capacity = self.capacity
+        base = rows * capacity
+        tail = self.tail[rows]
+
+        # Each push moves the windows on by one bar, so at most one leaves
+        for window in self.windows:
+            if len(dates) < window:
+                continue
+            length = self.length[window]
+            n = length[rows]
+            first = base + (tail - n) % capacity
+            length[rows[(n > 0) & (self.dates[first] < dates[-window])]] -= 1
+
+        # Bars no greater than the new one can never be the maximum again;
+        # NaN bars still age the windows but are never kept
+        live = ~np.isnan(value)
+        rows, value, base, tail = rows[live], value[live], base[live], tail[live]
+        longest = self.length[capacity][rows]
+        popped = np.zeros(len(rows), dtype=np.int64)
+        i = np.arange(len(rows))
+        while len(i):
+            back = base[i] + (tail[i] - popped[i] - 1) % capacity
+            i = i[(popped[i] < longest[i]) & (self.values[back] <= value[i])]
+            popped[i] += 1
+
+        slot = (tail - popped) % capacity
+        self.values[base + slot] = value
+        self.dates[base + slot] = dates[-1]
+        self.tail[rows] = slot + 1
+        for window in self.windows:
+            length = self.length[window]
+            length[rows] = np.maximum(length[rows] - popped, 0) + 1
+
+    def fill(self, dates, bars, rows):
+        """
+        Rebuild the deques of markets `rows` from `bars`, their
+        (rows, dates) bars.
+        """
+        if not len(rows):
+            return
+
+        bars = bars[:, -self.capacity:]
+        filled = np.where(np.isnan(bars), -np.inf, bars)
+        # A bar stays if it is greater than every bar after it
+        later = np.full(bars.shape, -np.inf)
+        later[:, :-1] = np.maximum.accumulate(filled[:, :0:-1], axis=1)[:, ::-1]
+        kept = filled > later
+
+        length = kept.sum(axis=1)
+        row, column = np.nonzero(kept)
+        slot = np.arange(len(row)) - np.repeat(np.cumsum(length) - length, length)
+        self.values[rows[row] * self.capacity + slot] = bars[row, column]
+        self.dates[rows[row] * self.capacity + slot] = dates[-bars.shape[1]:][column]
+        self.tail[rows] = length
+        for window in self.windows:
+            self.length[window][rows] = kept[:, -window:].sum(axis=1)
+
+class RollingChannels(object):
+    """
+    Rolling max (or min) of every market's highs (or lows) over several
+    windows, as arrays in symbol order.
+
+    The windows share a MonotonicQueue per market, so a new bar costs
+    amortized O(1) whatever the trend. Lows are kept as the maxima of the
+    negated bars. Markets seen for the first time, or that missed bars, are
+    refilled from the price store, which holds the longest window.
+    """
+    def __init__(self, markets, windows, highest=True):
+        self.windows = sorted(set(windows))
+        self.highest = highest
+        self.sign = 1.0 if highest else -1.0
+        self.queue = MonotonicQueue(markets, self.windows)
+        self.values = {n: np.full(markets, np.nan) for n in self.windows}
+        # Last bar each market was brought up to, NaT for none
+        self.last_date = np.full(markets, np.datetime64('NaT', 'ns'))
+
+    def update(self, dates, values, rows):
+        """
+        Bring markets `rows` up to the last of `dates`, the completed bars;
+        `values` is a (markets, dates) array of every market.
+        """
+        if not len(dates):
+            return
+
+        # Markets that have every bar but the last only need that one
+        last = self.last_date[rows]
+        pushed = np.zeros(len(rows), dtype=bool)
+        if len(dates) > 1:
+            pushed = last == dates[-2]
+        scanned = rows[~pushed & (last != dates[-1])]
+        pushed = rows[pushed]
+
+        self.queue.push(dates, self.sign * values[pushed, -1], pushed)
+        self.queue.fill(dates, self.sign * values[scanned], scanned)
+        for window in self.windows:
+            self.values[window][rows] = self.sign * self.queue.front(window, rows)
+        self.last_date[rows] = dates[-1]
+
+def channel_windows(context):
+    """
+    Breakout, exit and trend lookbacks of every system.
+    """
+    return [
+        window
+        for system in context.systems
+        for window in (system.breakout, system.exit, system.trend)
+        if window
+    ]
+
+def channel_targets(context, side):
+    """
+    (column, system, window) for every channel the systems use on `side`,
+    'high' or 'low'. Systems share channels of the same window, which are
+    only computed once.
+    """
+    m = context.markets.rows
+    targets = []
+    for j, system in enumerate(context.systems):
+        for name, window in [
+            ('breakout', system.breakout),
+            ('exit', system.exit),
+            ('trend', system.trend),
+        ]:
+            if window:
+                targets.append((m['%s_%s' % (name, side)], j, window))
+    return targets
+
+def update_rolling_channels(context, name, field, highest):
+    """
+    Bring the tradable markets' rolling channels, context.<name>, up to
+    the last completed bar. Markets seen for the first time, or all of
+    them when the windows changed, are seeded from the price store.
+    """
+    windows = sorted(set(channel_windows(context)))
+    channels = getattr(context, name)
+    if channels is None or channels.windows != windows:
+        channels = RollingChannels(len(context.symbols), windows, highest)
+        setattr(context, name, channels)
+
+    # The store only holds completed bars, so today's is already excluded
+    channels.update(
+        context.price_dates,
+        context.price_block[:, field],
+        context.tradable_rows
+    )
+    return channels
+
+def read_rolling_channels(context, channels, targets):
+    """
+    Fill the tradable rows of each (column, system, window) target from
+    the rolling channels.
+    """
+    rows = context.tradable_rows
+    for column, j, window in targets:
+        column[rows, j] = channels.values[window][rows]
 
+def read_cached_channels(context, field, highest, targets):
+    """
+    Fill the tradable rows of each (column, system, window) target with the
+    channel context.indicators has for the last completed bar.
+    """
+    if not len(context.price_dates):
+        return
+
+    rows = context.tradable_rows
+    for column, j, window in targets:
+        values = context.indicators.channel(
+            context.symbols,
+            context.price_fields[field],
+            window,
+            highest,
+            context.price_dates[-1]
+        )
+        column[rows, j] = values[rows]
+
+@iterates('tradable_symbols')
 def compute_highs(context, data):
 # data is not used
     """
-    Compute high for breakout and exits
+    Compute high for breakout, exits and trend filters of every system
     """
-    if context.is_timed:
-        start_time = time()
-
-    for sym in context.tradable_symbols:
-        context.strat_one_breakout_high[sym] = context.prices\
-            .loc[sym, 'high']\
-            [-context.strat_one_breakout-1:-1]\
-            .max()
-        context.strat_two_breakout_high[sym] = context.prices\
-            .loc[sym, 'high']\
-            [-context.strat_two_breakout-1:-1]\
-            .max()
-        context.strat_one_exit_high[sym] = context.prices\
-            .loc[sym, 'high']\
-            [-context.strat_one_exit-1:-1]\
-            .max()
-        context.strat_two_exit_high[sym] = context.prices\
-            .loc[sym, 'high']\
-            [-context.strat_two_exit-1:-1]\
-            .max()
+    targets = channel_targets(context, 'high')
+    if context.indicators is not None:
+        read_cached_channels(context, HIGH, True, targets)
+    else:
+        channels = update_rolling_channels(context, 'rolling_highs', HIGH, True)
+        read_rolling_channels(context, channels, targets)
 
     if context.is_test:
-        assert(len(context.strat_one_breakout_high) > 0)
-        assert(len(context.strat_two_breakout_high) > 0)
-        assert(len(context.strat_one_exit_high) > 0)
-        assert(len(context.strat_two_exit_high) > 0)
-
-    if context.is_timed:
-        time_taken = (time() - start_time) * 1000
-        log.debug('Executed in %f ms.' % time_taken)
-        assert(time_taken < 1024)
+        assert(len(context.breakout_high) > 0)
+        assert(len(context.exit_high) > 0)
 
+@iterates('tradable_symbols')
 def compute_lows(context, data):
 # data is not used
     """
-    Compute 20 and 55 day low.
+    Compute breakout, exit and trend lows of every system.
     """
-    if context.is_timed:
-        start_time = time()
-
-    for sym in context.tradable_symbols:
-        context.strat_one_breakout_low[sym] = context.prices\
-            .loc[sym, 'low']\
-            [-context.strat_one_breakout-1:-1]\
-            .min()
-        context.strat_two_breakout_low[sym] = context.prices\
-            .loc[sym, 'low']\
-            [-context.strat_two_breakout-1:-1]\
-            .min()
-        context.strat_one_exit_low[sym] = context.prices\
-            .loc[sym, 'low']\
-            [-context.strat_one_exit-1:-1]\
-            .min()
-        context.strat_two_exit_low[sym] = context.prices\
-            .loc[sym, 'low']\
-            [-context.strat_two_exit-1:-1]\
-            .min()
+    targets = channel_targets(context, 'low')
+    if context.indicators is not None:
+        read_cached_channels(context, LOW, False, targets)
+    else:
+        channels = update_rolling_channels(context, 'rolling_lows', LOW, False)
+        read_rolling_channels(context, channels, targets)
 
     if context.is_test:
-        assert(len(context.strat_one_breakout_low) > 0)
-        assert(len(context.strat_two_breakout_low) > 0)
-        assert(len(context.strat_one_exit_low) > 0)
-        assert(len(context.strat_two_exit_low) > 0)
+        assert(len(context.breakout_low) > 0)
+        assert(len(context.exit_low) > 0)
 
-    if context.is_timed:
-        time_taken = (time() - start_time) * 1000
-        log.debug('Executed in %f ms.' % time_taken)
-        assert(time_taken < 1024)
-
-def get_contracts(context, data):
+@iterates('symbols')
+def update_correlations(context, data):
+# data is not used
     """
-    Get futures contracts using the dict of continuous futures objects
-    The returned pd.panel from data.current() is reindex to use symbol string as key
+    Push completed daily closes into the rolling correlation, and regroup
+    the risk ledger's correlated markets from it once it has enough bars.
     """
-    if context.is_timed:
-        start_time = time()
+    if len(context.symbols) > context.max_correlated_markets:
+        return
+
+    engine = context.correlations
+    if engine is None or engine.window != context.correlation_window:
+        engine = context.correlations = RollingCorrelation(
+            len(context.symbols),
+            context.correlation_window
+        )
+    engine.update(context.price_dates, context.price_block[:, CLOSE])
+
+    if engine.bars < context.correlation_min_periods:
+        return
 
-    cfutures = [v for k, v in context.cfutures.items()]
-    fields = 'contract'
+    correlation = engine.matrix(context.correlation_min_periods)
+    context.risk_ledger.regroup([
+        correlated_groups(correlation, context.close_correlation),
+        correlated_groups(correlation, context.loose_correlation),
+    ])
 
-    # Dataframe indexed with date, and columned with security as according to API spec
-    context.contracts = data.current(
-        cfutures,
-        fields
-    )
-    
-    context.contracts = context.contracts.transpose()
-    context.contracts.dropna(axis=0, inplace=True)
-    context.contracts = context.contracts.rename_axis(lambda k: k.root_symbol, axis=0)
+def get_contracts(context, data):
+    """
+    Get futures contracts from the contract calendar, keyed by root symbol.
+    Only markets whose contract auto-closed since yesterday are looked up.
+    """
+    today = pd.Timestamp(get_datetime()).normalize().value
+    rolled = context.contracts.refresh(data, context.cfutures, today)
+    if len(rolled):
+        context.contracts_version += 1
 
-        
     if context.is_test:
-        assert(context.contracts.shape[0] > 0)
+        assert(len(context.contracts) > 0)
+
+class AverageTrueRange(object):
+    """
+    Wilder-smoothed average true range (N) of every market, one bar at a
+    time, all markets at once:
+        N = ((period - 1) * previous N + TR) / period
+    seeded with the mean of the first `period` true ranges, as talib does.
+    State is kept as arrays in symbol order.
+    """
+    def __init__(self, period, markets):
+        self.period = period
+        self.value = np.full(markets, np.nan)
+        self.previous_close = np.full(markets, np.nan)
+        self.count = np.zeros(markets, dtype=np.int64)
+        self.total = np.zeros(markets)
+        # Date of the last bar each market was updated with, NaT for none
+        self.last_date = np.full(markets, np.datetime64('NaT', 'ns'))
+
+    def push(self, high, low, close, rows=slice(None)):
+        """
+        Push a bar of each market in `rows`. Bars with a missing price are
+        skipped.
+        """
+        previous_close = self.previous_close[rows]
+        count = self.count[rows]
+        total = self.total[rows]
+        value = self.value[rows]
+
+        with np.errstate(invalid='ignore'):
+            valid = ~(np.isnan(high) | np.isnan(low) | np.isnan(close))
+            ready = valid & ~np.isnan(previous_close)
+            true_range = np.maximum(
+                high - low,
+                np.maximum(
+                    np.abs(high - previous_close),
+                    np.abs(low - previous_close)
+                )
+            )
 
-    if context.is_timed:
-        time_taken = (time() - start_time) * 1000
-        log.debug('Executed in %f ms.' % time_taken)
-        assert(time_taken < 1024)
+        seeding = ready & (count < self.period)
+        count[seeding] += 1
+        total[seeding] += true_range[seeding]
+        seeded = seeding & (count == self.period)
+        value[seeded] = total[seeded] / self.period
+        smoothing = ready & ~seeding
+        value[smoothing] = (value[smoothing] * (self.period - 1)
+                            + true_range[smoothing]) / self.period
+        previous_close[valid] = close[valid]
+
+        self.previous_close[rows] = previous_close
+        self.count[rows] = count
+        self.total[rows] = total
+        self.value[rows] = value
+
+    def update(self, dates, highs, lows, closes, rows):
+        """
+        Push the bars of markets `rows` dated after each one's last update;
+        `highs`, `lows` and `closes` are (rows, dates) arrays. Markets seen
+        before need only the newest bars, so a day is usually one push.
+        """
+        last = self.last_date[rows]
+        fresh = np.isnat(last)
+        start = 0 if fresh.any() else unseen_bars(dates, last.min())
+        for t in range(start, len(dates)):
+            unseen = fresh | (last < dates[t])
+            if unseen.all():
+                self.push(highs[:, t], lows[:, t], closes[:, t], rows)
+            else:
+                self.push(
+                    highs[unseen, t],
+                    lows[unseen, t],
+                    closes[unseen, t],
+                    rows[unseen]
+                )
 
+        if len(dates):
+            self.last_date[rows] = dates[-1]
+
+    @staticmethod
+    def series(highs, lows, closes, period):
+        """
+        N after each bar of (markets, dates) arrays.
+        """
+        state = AverageTrueRange(period, len(closes))
+        result = np.full(closes.shape, np.nan)
+        for t in range(closes.shape[1]):
+            state.push(highs[:, t], lows[:, t], closes[:, t])
+            result[:, t] = state.value
+        return result
+
+@iterates('tradable_symbols')
 def compute_average_true_ranges(context, data):
 # data is not used
     """
     Compute average true ranges, or N.
+    Only does work once per new daily bar; later calls that day are cache hits.
     """
-    if context.is_timed:
-        start_time = time()
+    # N uses completed bars only, so it is fixed for the whole session
+    dates = context.price_dates
+    if context.atr_date is not None and len(dates) and context.atr_date == dates[-1]:
+        return
 
-    rolling_window = 21
-    moving_average = 20
+    block = context.price_block
+    since = context.markets.rows['atr_since']
+
+    if context.indicators is not None and len(dates):
+        # The cached N of each market is seeded from the bar the
+        # algorithm's own N would have been, so both give the same values
+        rows = context.tradable_rows
+        since[rows[since[rows] == 0]] = dates[0].astype(np.int64)
+        for start in np.unique(since[rows]):
+            values = context.indicators.average_true_range(
+                context.symbols,
+                context.atr_period,
+                dates[-1],
+                start
+            )
+            group = rows[since[rows] == start]
+            group = group[~np.isnan(values[group])]
+            context.average_true_range.values[group] = values[group]
+    elif len(dates):
+        state = context.atr_state
+        if state is None or state.period != context.atr_period:
+            state = context.atr_state = AverageTrueRange(
+                context.atr_period,
+                len(context.symbols)
+            )
+            since[:] = 0
+
+        rows = context.tradable_rows
+        since[rows[np.isnat(state.last_date[rows])]] = dates[0].astype(np.int64)
+        state.update(
+            dates,
+            block[rows, HIGH],
+            block[rows, LOW],
+            block[rows, CLOSE],
+            rows
+        )
 
-    for sym in context.tradable_symbols:
-        context.average_true_range[sym] = ATR(
-            context.prices.loc[sym, 'high'][-rolling_window:],
-            context.prices.loc[sym, 'low'][-rolling_window:],
-            context.prices.loc[sym, 'close'][-rolling_window:],
-            timeperiod=moving_average
-        )[-1]
+        values = state.value[rows]
+        seeded = ~np.isnan(values)
+        context.average_true_range.values[rows[seeded]] = values[seeded]
+
+    context.atr_date = dates[-1] if len(dates) else None
 
     if context.is_test:
         assert(len(context.average_true_range) > 0)
 
-    if context.is_timed:
-        time_taken = (time() - start_time) * 1000
-        log.debug('Executed in %f ms.' % time_taken)
-        assert(time_taken < 1024)
-
+@iterates('tradable_symbols')
 def compute_dollar_volatilities(context, data):
 # data is not used
     """
     Compute dollar volatilities, or dollars per point.
     """
-    if context.is_timed:
-        start_time = time()
-
-    try:
-        for sym in context.tradable_symbols:
-            context.dollar_volatility[sym] = context.contracts[sym].multiplier\
-                * context.average_true_range[sym]
-    except KeyError:
-        pass
+    # NaN for markets without a contract
+    rows = context.tradable_rows
+    context.dollar_volatility.values[rows] = context.contracts.multipliers[rows]\
+        * context.average_true_range.values[rows]
 
     if context.is_test:
         #assert(len(context.dollar_volatility) > 0)
         pass
 
-    if context.is_timed:
-        time_taken = (time() - start_time) * 1000
-        log.debug('Executed in %f ms.' % time_taken)
-        assert(time_taken < 1024)
-
+@iterates('tradable_symbols')
 def compute_trade_sizes(context, data):
 # data is not used
     """contract
     Compute trade sizes, or amount per trade.
     """
-    if context.is_timed:
-        start_time = time()
-
     context.profit = context.portfolio.portfolio_value\
         - context.portfolio.starting_cash
 
@@ -571,9 +2529,13 @@ def compute_trade_sizes(context, data):
                 context.trade_size[sym] = 0
         else:
             for sym in context.tradable_symbols:
+                dollar_volatility = float(context.dollar_volatility[sym])
+                # NaN until the market has both an N and a contract
+                if dollar_volatility != dollar_volatility:
+                    continue
                 context.trade_size[sym] = int(context.capital\
                     * context.capital_risk_per_trade\
-                    / context.dollar_volatility[sym])
+                    / dollar_volatility)
     except KeyError:
         pass
     except ZeroDivisionError:
@@ -585,38 +2547,15 @@ def compute_trade_sizes(context, data):
         #assert(len(context.trade_size) > 0)
         pass
 
-    if context.is_timed:
-        time_taken = (time() - start_time) * 1000
-        log.debug('Executed in %f ms.' % time_taken)
-        assert(time_taken < 1024)
-
 def update_risks(context, data):
 # data is not used
     """
-    Update long, short, and market risks.
+    Update long and short risks from the risk ledger.
     """
-    context.long_risk = 0
-    context.short_risk = 0
-
-    for contract in context.contracts:
-        sym = contract.root_symbol
-        
-        try:
-            position = context.portfolio.positions[contract]
-
-            if context.market_risk[sym] > 0:
-                context.long_risk += abs(context.market_risk[sym])
-            elif context.market_risk[sym] < 0:
-                context.short_risk += abs(context.market_risk[sym])
-        except KeyError:
-            continue
-        except ZeroDivisionError:
-            log.info(sym)
-            log.info(position.amount)
-            log.info(context.trade_size[sym])
-            log.info(context.dollar_volatility[sym])
-            raise
+    context.long_risk = context.risk_ledger.long
+    context.short_risk = context.risk_ledger.short
 
+@iterates('contracts')
 def place_stop_orders(context, data):
 # data is not used
     """
@@ -626,9 +2565,8 @@ def place_stop_orders(context, data):
         sym = contract.root_symbol 
         position = context.portfolio.positions[contract]
 
-        try:
-            order_info = get_order(context.orders[sym][-1])
-        except IndexError:
+        order_info = context.order_index.last(sym)
+        if order_info is None:
             continue
 
         #If the previous order is a limit order that starts to be filled
@@ -660,16 +2598,15 @@ def place_stop_orders(context, data):
                 order_identifier = None
 
             if order_identifier is not None:
-                context.orders[sym].append(order_identifier)
-
-            if context.is_info:
-                log.info(
-                    'Stop  %s  %.2f (due to new limit order)'
-                    % (
-                        sym,
-                        context.stop[sym]
-                    )
-                )
+                context.order_index.add(sym, order_identifier)
+
+            context.event_log.record(
+                EventLog.STOP,
+                sym,
+                amount=position.amount,
+                price=context.stop[sym],
+                detail=EventLog.NEW_LIMIT
+            )
 
         elif (order_info.stop_reached == False and\
             order_info.stop is not None and order_info.status == 2):
@@ -696,268 +2633,346 @@ def place_stop_orders(context, data):
 
 
             if order_identifier is not None:
-                context.orders[sym].append(order_identifier)
-
-                if context.is_info:
-                    log.info(
-                        'Stop  %s  %.2f (due to previous stop order canceled)'
-                        % (
-                            sym,
-                            context.stop[sym]
-                        )
-                    )
+                context.order_index.add(sym, order_identifier)
+
+                context.event_log.record(
+                    EventLog.STOP,
+                    sym,
+                    amount=position.amount,
+                    price=context.stop[sym],
+                    detail=EventLog.CANCELED_STOP
+                )
 
 
-def detect_entry_signals(context, data):
+def signal_levels(context, rows):
+    """
+    Every price at which a signal of the markets at `rows` can change, as
+    a (rows, levels) array: breakout and exit channels and trend midpoints
+    of every system, the latest stop and its 2.5 N scale-in levels, and
+    each system's shadow trade add, stop and exit levels.
+    """
+    m = context.markets.rows
+    n = m['average_true_range'][rows]
+    stop = context.order_index.stops[rows]
+    shadow = m['analytics_state'][rows] != 0
+    entry = m['analytics_entry'][rows]
+    half_n = 0.5 * n[:, None]
+
+    return np.column_stack([
+        m['breakout_high'][rows],
+        m['breakout_low'][rows],
+        m['exit_high'][rows],
+        m['exit_low'][rows],
+        (m['trend_high'][rows] + m['trend_low'][rows]) / 2,
+        stop,
+        stop + 2.5 * n,
+        stop - 2.5 * n,
+        np.where(shadow, entry + half_n, np.nan),
+        np.where(shadow, entry - half_n, np.nan),
+        np.where(shadow, m['analytics_stop'][rows], np.nan),
+        np.where(shadow, m['analytics_exit'][rows], np.nan),
+    ])
+
+@iterates('symbols')
+def find_triggers(context, data):
 # data is not used
     """
-      Place limit orders on 20 or 55 day breakout.
+    Pick the tradable markets whose price crossed a signal level since
+    they were last evaluated, or whose state changed, as
+    context.signal_rows. New daily levels make every market a candidate.
     """
-    long_quota = context.direction_risk_limit - math.ceil(context.long_risk)
-    short_quota = context.direction_risk_limit - math.ceil(context.short_risk)
+    triggers = context.triggers
+    if triggers.date != context.price_store.last_date:
+        triggers.date = context.price_store.last_date
+        triggers.touch_all()
+
+    if context.risk_ledger.touched.any():
+        triggers.release()
+    for source in (context.order_index, context.risk_ledger):
+        triggers.dirty |= source.touched
+        source.touched[:] = False
+
+    rows = triggers.crossed(context.current_prices)
+    context.signal_rows = rows[np.isin(rows, context.tradable_rows)]
+    context.signal_symbols = [context.symbols[i] for i in context.signal_rows]
+    context.signal_won = context.markets.rows['previous_trade_won'][context.signal_rows]
+
+    # Untradable markets are checked again once they trade
+    triggers.dirty[rows[~np.isin(rows, context.tradable_rows)]] = True
+
+@iterates('signal_symbols')
+def rearm_triggers(context, data):
+# data is not used
+    """
+    Store fresh bands for the markets evaluated this slot. Markets where a
+    system's last-breakout-won flag flipped are evaluated again, since that
+    can change which system enters without the price crossing anything.
+    """
+    rows = context.signal_rows
+    context.triggers.rearm(
+        rows,
+        context.current_prices,
+        signal_levels(context, rows)
+    )
+    won = context.markets.rows['previous_trade_won'][rows]
+    context.triggers.touch(rows[(won != context.signal_won).any(axis=1)])
 
-    # Exit if we don't have any cash
-    if context.portfolio.cash <= 0:
-        return
+def unit_limits(context):
+    """
+    Direction, closely correlated and loosely correlated unit limits, in
+    the order RiskLedger.admit takes them.
+    """
+    return [
+        context.direction_risk_limit,
+        context.closely_correlated_limit,
+        context.loosely_correlated_limit,
+    ]
 
-    for sym in context.tradable_symbols:
-        price = data.current(context.cfutures[sym], 'price')
-        # Get limit price of previous order; if there is no previous order, set limit to None
-        try:
-            prev_order = get_order(context.orders[sym][-1])
-            limit = prev_order.limit
-        except IndexError:
-            limit = None
-
-        enter_signal = False
-
-        if context.market_risk[sym] == 0 and limit is None:
-            if context.previous_trade_won[sym] == False:
-                if price > context.strat_one_breakout_high[sym] and long_quota > 0:
-
-                    long_quota -= 1
-                    enter_signal = True
-                    long_or_short = 1
-                    context.is_strat_one[sym] = True
-                    context.is_strat_two[sym] = False
-                    
-
-                elif price < context.strat_one_breakout_low[sym] and short_quota > 0:
-
-                    short_quota -= 1
-                    enter_signal = True
-                    long_or_short = -1
-                    context.is_strat_one[sym] = True
-                    context.is_strat_two[sym] = False
+def admit_units(context, rows, longs, shorts):
+    """
+    The candidates that fit the unit limits. Those that do not wait for
+    the next change of units, since that may free up room without their
+    price crossing anything.
+    """
+    limits = unit_limits(context)
+    admitted_longs = context.risk_ledger.admit(rows, longs, True, limits)
+    admitted_shorts = context.risk_ledger.admit(rows, shorts, False, limits)
+    context.triggers.wait(rows[(longs & ~admitted_longs) | (shorts & ~admitted_shorts)])
+    return admitted_longs, admitted_shorts
 
-            else:
-                if price > context.strat_two_breakout_high[sym] and long_quota > 0 :
+def system_risks(context):
+    """
+    Each system's unit size relative to the base trade size, in
+    context.systems order.
+    """
+    return np.array([system.risk for system in context.systems])
 
-                    long_quota -= 1
-                    enter_signal = True
-                    long_or_short = 1
-                    context.is_strat_one[sym] = True
-                    context.is_strat_two[sym] = False
+def entry_masks(context, rows):
+    """
+    Long and short breakout entries for the markets at `rows`, and the
+    system entering each: the first in context.systems whose breakout
+    fired and whose filters let it trade. Every system is tested at once
+    against its column of the channel arrays.
+    Unit limits go to the first candidates in symbol order.
+    """
+    m = context.markets.rows
+    price = context.current_prices[rows][:, None]
+    systems = context.systems
 
-                elif price < context.strat_two_breakout_low[sym] and short_quota > 0:
+    skip = np.array([system.skip_after_win for system in systems])
+    filtered = np.array([bool(system.trend) for system in systems])
+    middle = (m['trend_high'][rows] + m['trend_low'][rows]) / 2
 
-                    short_quota -= 1
-                    enter_signal = True
-                    long_or_short = -1
-                    context.is_strat_one[sym] = True
-                    context.is_strat_two[sym] = False
+    with np.errstate(invalid='ignore'):
+        able = ~(skip & m['previous_trade_won'][rows])
+        up = able & (price > m['breakout_high'][rows])\
+            & (~filtered | (price > middle))
+        down = able & (price < m['breakout_low'][rows])\
+            & (~filtered | (price < middle))
 
-        if enter_signal == True:
-            order_identifier = order(
-                context.contracts[sym],
-                long_or_short * context.trade_size[sym],
-                style=LimitOrder(price)
-            )
+    fired = up | down
+    entering = fired.any(axis=1)
+    system = np.where(entering, fired.argmax(axis=1), -1)
+    first = np.arange(len(rows)), np.maximum(system, 0)
 
-            context.market_risk[sym] = long_or_short
+    # Flat, and not waiting on an entry limit order
+    idle = (m['market_risk'][rows] == 0)\
+        & (context.order_index.kind_codes[rows] != OrderIndex.LIMIT)
 
-            if order_identifier is not None:
-                context.orders[sym].append(order_identifier)
-
-            if context.is_info:
-
-                if context.is_strat_one[sym] == True:
-                    strat = "strat 1"
-                else:
-                    strat = "strat 2"
-                
-                if long_or_short == 1:
-                    log.info(
-                        'Long(breakout %s)  %s  %i@%.2f'
-                        % (
-                            strat,
-                            sym,
-                            context.trade_size[sym],
-                            price
-                        )
-                    )
-                else:
-                    log.info(
-                        'Short(breakout %s)  %s  %i@%.2f'
-                        % (
-                            strat,
-                            sym,
-                            context.trade_size[sym],
-                            price
-                        )
-                    )
+    longs = idle & entering & up[first]
+    shorts = idle & entering & ~longs & down[first]
 
-#Exit Strategy
-def detect_exit_signals(context, data):
-    for pos_sid, position in context.portfolio.positions.items():
-        market = position.asset.root_symbol
+    longs, shorts = admit_units(context, rows, longs, shorts)
+    return longs, shorts, system
 
-        price = data.current(market, 'price')
+def scale_masks(context, rows):
+    """
+    Long and short unit additions for the markets at `rows`: the price has
+    moved 2.5 N past the latest stop of a position below its unit limit.
+    """
+    m = context.markets.rows
+    price = context.current_prices[rows]
+    risk = m['market_risk'][rows]
+    stop = context.order_index.stops[rows]
+    reach = 2.5 * m['average_true_range'][rows]
 
-        if context.is_strat_one[market]:
-            if position.amount > 0:
-                if price <= context.strat_one_exit_low[market]:
-                    order_identifier = order_target_percent(context.contracts[market], 0)
-                    context.market_risk[sym] = 0
-                    if order_identifier is not None:
-                        context.orders[market].append(order_identifier)
-                    context.is_strat_one[market] = False
-                    log.info(
-                        'Exit  %s  @%.2f'
-                        % (
-                            market,
-                            price
-                        )
-                    )
+    # A limit order as latest order means the market has only just entered;
+    # a market order means the limit was converted at the close. Neither
+    # has a stop to scale from.
+    able = (risk != 0)\
+        & (np.abs(np.round(risk)) < context.market_risk_limit)\
+        & (context.order_index.kind_codes[rows] == OrderIndex.STOP)
 
-            elif position.amount< 0:
-                if price >= context.strat_one_exit_high[market]:
-                    order_identifier = order_target_percent(context.contracts[market], 0)
-                    context.market_risk[sym] = 0
-                    if order_identifier is not None:
-                        context.orders[market].append(order_identifier)
-                    context.is_strat_one[market] = False
-                    log.info(
-                        'Exit  %s  @%.2f'
-                        % (
-                            market,
-                            price
-                        )
-                    )
+    longs = able & (risk > 0) & (price > stop + reach)
+    shorts = able & (risk < 0) & (price < stop - reach)
 
+    return admit_units(context, rows, longs, shorts)
 
-        elif context.is_strat_two[market]:
-            if position.amount > 0:
-                if price <= context.strat_two_exit_low[market]:
-                    order_identifier = order_target_percent(context.contracts[market], 0)
-                    context.market_risk[sym] = 0
-                    if order_identifier is not None:
-                        context.orders[market].append(order_identifier)
-                    context.is_strat_one[market] = False
-                    log.info(
-                        'Exit  %s  @%.2f'
-                        % (
-                            market,
-                            price
-                        )
-                    )
+def exit_masks(context, amounts):
+    """
+    Long and short exits for every market, given position sizes in symbol
+    order, against the exit channel of the system that entered.
+    """
+    m = context.markets.rows
+    price = context.current_prices
 
-            elif position.amount < 0:
-                if price >= context.strat_two_exit_high[market]:
-                    order_identifier = order_target_percent(context.contracts[market], 0)
-                    context.market_risk[sym] = 0
-                    if order_identifier is not None:
-                        context.orders[market].append(order_identifier)
-                    context.is_strat_one[market] = False
-                    log.info(
-                        'Exit  %s  @%.2f'
-                        % (
-                            market,
-                            price
-                        )
-                    )
+    system = m['system']
+    held = system >= 0
+    holder = np.arange(len(system)), np.maximum(system, 0)
+    exit_low = m['exit_low'][holder]
+    exit_high = m['exit_high'][holder]
+
+    with np.errstate(invalid='ignore'):
+        longs = held & (amounts > 0) & (price <= exit_low)
+        shorts = held & (amounts < 0) & (price >= exit_high)
+
+    return longs, shorts
+
+def detect_entry_signals(context, data):
+# data is not used
+    """
+      Place limit orders on the breakout of any system.
+    """
+    rows = context.signal_rows
+
+    # Exit if we don't have any cash
+    if context.portfolio.cash <= 0:
+        context.triggers.touch(rows)
+        return
+
+    longs, shorts, systems = entry_masks(context, rows)
+    risks = system_risks(context)
+
+    for k in np.flatnonzero(longs | shorts):
+        sym = context.symbols[rows[k]]
+        price = context.current_prices[rows[k]]
+        long_or_short = 1 if longs[k] else -1
+        size = int(context.trade_size[sym] * risks[systems[k]])
+
+        context.system[sym] = systems[k]
+
+        order_identifier = order(
+            context.contracts[sym],
+            long_or_short * size,
+            style=LimitOrder(price)
+        )
+
+        context.risk_ledger.set(sym, long_or_short)
+
+        if order_identifier is not None:
+            context.order_index.add(sym, order_identifier)
+
+        context.event_log.record(
+            EventLog.ENTRY,
+            sym,
+            amount=long_or_short * size,
+            size=size,
+            price=price,
+            risk=long_or_short,
+            detail=systems[k] + 1
+        )
+
+#Exit Strategy
+def detect_exit_signals(context, data):
+    amounts = np.zeros(len(context.symbols))
+    for pos_sid, position in context.portfolio.positions.items():
+        amounts[context.symbol_index[position.asset.root_symbol]] = position.amount
+
+    longs, shorts = exit_masks(context, amounts)
+    candidates = np.zeros(len(context.symbols), dtype=bool)
+    candidates[context.signal_rows] = True
+
+    for i in np.flatnonzero((longs | shorts) & candidates):
+        market = context.symbols[i]
+        price = context.current_prices[i]
+
+        order_identifier = order_target_percent(context.contracts[market], 0)
+        context.risk_ledger.set(market, 0)
+        if order_identifier is not None:
+            context.order_index.add(market, order_identifier)
+        context.system[market] = -1
+        context.event_log.record(
+            EventLog.EXIT,
+            market,
+            amount=-amounts[i],
+            price=price,
+            risk=0
+        )
 
 def scaling_signals(context,data):
 
-    for market in context.tradable_symbols:
-        if context.market_risk[market] != 0 and \
-            abs(round(context.market_risk[market])) < context.market_risk_limit:
-            if  get_order(context.orders[market][-1]).limit is None:
-                """
-                'the condition in second if' is to make sure this market did not enter breakout just now because the only reason that the lastest
-                order is a limit order is that the position is entered via breakout just now
+    rows = context.signal_rows
+    longs, shorts = scale_masks(context, rows)
+    risks = system_risks(context)
 
-                Also, we have to make use of the latest order_id's stop price to determine the scaling signal so we can
-                """
+    for k in np.flatnonzero(longs | shorts):
+        market = context.symbols[rows[k]]
+        price = context.current_prices[rows[k]]
+        # Units of the system holding the market
+        size = int(context.trade_size[market] * risks[max(context.system[market], 0)])
 
-                price = data.current(context.cfutures[market], 'price')
-                # test if it is stop order. If it is not stop order as well, it is a market order from converting limit to market order by the end of the day
+        if longs[k]:
+            order_identifier = order(
+            context.contracts[market],
+            size,
+            style=LimitOrder(price)
+            )
+            context.risk_ledger.add(market, 1)
 
-                if get_order(context.orders[market][-1]).stop is None:
-                    continue
+            if order_identifier is not None:
+                context.order_index.add(market, order_identifier)
+
+                context.event_log.record(
+                    EventLog.SCALE,
+                    market,
+                    amount=size,
+                    size=size,
+                    price=price,
+                    risk=context.market_risk[market]
+                )
 
+        else:
+            order_identifier = order(
+            context.contracts[market],
+            -size,
+            style=LimitOrder(price)
+            )
+            context.risk_ledger.add(market, -1)
 
-                if context.market_risk[market] > 0:
-                    if price > get_order(context.orders[market][-1]).stop + (2.5)*(context.average_true_range[market]):
-
-                        order_identifier = order(
-                        context.contracts[market],
-                        context.trade_size[market],
-                        style=LimitOrder(price)
-                        )
-                        context.market_risk[sym] += 1
-
-                        if order_identifier is not None:
-                            context.orders[market].append(order_identifier)
-                            
-                            log.info('long(scaling)  %s  %i@%.2f'
-                                     %(
-                                        market,
-                                        context.trade_size[market],
-                                        price
-                                    )
-                            )
-
-
-                elif context.market_risk[market] < 0:
-                    if price < get_order(context.orders[market][-1]).stop - (2.5) * (context.average_true_range[market]):
-
-                        order_identifier = order(
-                        context.contracts[market],
-                        -context.trade_size[market],
-                        style=LimitOrder(price)
-                        )
-                        context.market_risk[sym] -= 1
-
-                        if order_identifier is not None:
-                            context.orders[market].append(order_identifier)
-                            
-                            log.info('short(scaling)  %s  %i@%.2f'
-                                     %(
-                                        market,
-                                        context.trade_size[market],
-                                        price
-                                    )
-                            )
+            if order_identifier is not None:
+                context.order_index.add(market, order_identifier)
+
+                context.event_log.record(
+                    EventLog.SCALE,
+                    market,
+                    amount=-size,
+                    size=size,
+                    price=price,
+                    risk=context.market_risk[market]
+                )
 
+@iterates('tradable_symbols')
 def stop_trigger_cleanup(context,data):
 
     for market in context.tradable_symbols:
-        try:
-            order_info = get_order(context.orders[market][-1])
-            stop_reached = order_info.stop_reached
-        except IndexError:
-            stop_reached = None
+        # Already cleaned up after its stop
+        if context.market_risk[market] == 0:
+            continue
+
+        order_info = context.order_index.last(market)
+        stop_reached = order_info.stop_reached if order_info is not None else None
 
         if stop_reached == True:
             current_open_orders = get_open_orders(order_info.sid)
 
             for open_order in current_open_orders:
                 cancel_order(open_order)
+            context.order_index.reload(market)
             
-            context.market_risk[sym] = 0
+            context.risk_ledger.set(market, 0)
 
 
+@profiled
 def turn_limit_to_market_orders(context,data):
     unfilled_orders = get_open_orders()
 
@@ -969,89 +2984,43 @@ def turn_limit_to_market_orders(context,data):
                 order_identifier = order(context.contracts[asset], (unfilled_order.amount - unfilled_order.filled))
 
                 if order_identifier is not None:
-                    context.orders[asset].append(order_identifier)
-                    
-                    log.info('%s limit order is turned to market order so to fill better before market close' %(asset))
+                    context.order_index.add(asset, order_identifier)
+
+                    context.event_log.record(
+                        EventLog.LIMIT_TO_MARKET,
+                        asset,
+                        amount=unfilled_order.amount - unfilled_order.filled,
+                        price=unfilled_order.limit
+                    )
 
                 cancel_order(unfilled_order)
 
 
+@iterates('signal_symbols')
 def analyzing_trade_for_next_signal(context,data):
+    """
+    Move every system's shadow trade on to the current price, for the
+    markets evaluated this slot, all systems in one step.
+    """
+    rows = context.signal_rows
+    m = context.markets.rows
+
+    state, entry, stop, exit_level, won = shadow_step(
+        m['analytics_state'][rows],
+        m['analytics_entry'][rows],
+        m['analytics_stop'][rows],
+        m['analytics_exit'][rows],
+        m['previous_trade_won'][rows],
+        context.current_prices[rows][:, None],
+        m['average_true_range'][rows][:, None],
+        m['breakout_high'][rows],
+        m['breakout_low'][rows],
+        m['exit_high'][rows],
+        m['exit_low'][rows]
+    )
 
-    for market in context.tradable_symbols:
-
-        price = data.current(market, 'price')
-
-        if context.position_analytics[market]['state'] == 0:
-            if price > context.strat_one_breakout_high[market] or price < context.strat_one_breakout_low[market]:
-
-                context.position_analytics[market]['state'] = 1
-                context.position_analytics[market]['entry'] = price
-
-                if price > context.strat_one_breakout_high[market]:
-
-                    context.position_analytics[market]['stop']  = price - 2 * context.average_true_range[market]
-                    context.position_analytics[market]['exit']  = context.strat_one_exit_low[market]
-
-                else:
-                    context.position_analytics[market]['stop']  = price + 2 * context.average_true_range[market]
-                    context.position_analytics[market]['exit']  = context.strat_one_exit_high[market]
-
-        elif 0 < context.position_analytics[market]['state'] and context.position_analytics[market]['state'] < 4 and\
-            price > context.position_analytics[market]['entry'] + 0.5 * context.average_true_range[market]:
-
-                context.position_analytics[market]['state'] += 1
-                context.position_analytics[market]['entry'] = price
-                context.position_analytics[market]['stop']  = price - 2 * context.average_true_range[market]
-                context.position_analytics[market]['exit']  = context.strat_one_exit_low[market]
-
-        elif -4 < context.position_analytics[market]['state'] and context.position_analytics[market]['state'] < 0 and\
-            price < context.position_analytics[market]['entry'] - 0.5 * context.average_true_range[market]:
-
-                context.position_analytics[market]['state'] -= 1
-                context.position_analytics[market]['entry'] = price
-                context.position_analytics[market]['stop']  = price + 2 * context.average_true_range[market]
-                context.position_analytics[market]['exit']  = context.strat_one_exit_high[market]
-
-        elif context.position_analytics[market]['state'] > 0 and price < context.position_analytics[market]['stop'] or\
-            context.position_analytics[market]['state'] < 0 and price > context.position_analytics[market]['stop']:
-
-                context.position_analytics[market] = {'state' :0, 'entry':0, 'stop' : 0, 'exit' : 0}
-                context.previous_trade_won[market] = False
-
-        elif context.position_analytics[market]['state'] > 0 and price < context.position_analytics[market]['exit']:
-
-            profit = 0
-
-            x = 1
-            while x <= context.position_analytics[market]['state']:
-                context.profit += context.position_analytics[market]['exit'] - \
-                          (context.position_analytics[market]['entry'] + (0.5) * (x-1) * context.average_true_range[market])
-                x += 1
-
-            if profit > 0:
-                context.previous_trade_won[market] = True
-            elif profit < 0:
-                context.previous_trade_won[market] = False
-
-            context.position_analytics[market] = {'state' :0, 'entry':0, 'stop' : 0, 'exit' : 0}
-
-
-        elif context.position_analytics[market]['state'] < 0 and price > context.position_analytics[market]['exit']:
-
-            profit = 0
-
-            x = 1
-            while x <= context.position_analytics[market]['state']:
-                profit += (context.position_analytics[market]['entry'] - (0.5) * (x-1) * context.average_true_range[market]) - \
-                               context.position_analytics[market]['exit']
-
-                x += 1
-
-            if profit > 0:
-                context.previous_trade_won[market] = True
-            elif profit < 0:
-                context.previous_trade_won[market] = False
-
-            context.position_analytics[market] = {'state' :0, 'entry':0, 'stop' : 0, 'exit' : 0}
-
+    m['analytics_state'][rows] = state
+    m['analytics_entry'][rows] = entry
+    m['analytics_stop'][rows] = stop
+    m['analytics_exit'][rows] = exit_level
+    m['previous_trade_won'][rows] = won
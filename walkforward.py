@@ -0,0 +1,237 @@
+"""
+Walk-forward optimization of turtle.py.
+
+History is split into rolling windows. Each window picks the grid point
+with the best in-sample score, then replays that point over the sessions
+that follow, and the out-of-sample equity curves are chained into one.
+
+Every replay, in-sample or out, is a task for one process pool, so windows
+run side by side. Each worker keeps a single IndicatorCache over the whole
+history (see indicators.py): the channels that overlapping windows share,
+and the N of runs that start on the same session, are computed once per
+worker, not once per run. Given a cube (see
+replay.write_cube), workers memory-map the bars instead of being sent them.
+
+    python walkforward.py path/to/cube --in-sample 756 --out-of-sample 252 \
+        --grid systems.one.breakout=20,40 --grid stop_multiplier=1.5,2,2.5
+"""
+import argparse
+import logging
+import multiprocessing
+from time import time
+
+import numpy as np
+import pandas as pd
+
+from indicators import IndicatorCache, IndicatorStore
+from replay import ReplayEngine, SYMBOLS, is_cube, open_bars, open_cube,\
+    synthetic_bars
+from sweep import ALGORITHM, grid_points, parse_grid, performance
+
+OBJECTIVES = ['sharpe', 'total_return', 'max_drawdown']
+
+_worker = {}
+
+
+def walk_forward_windows(sessions, in_sample, out_of_sample):
+    """
+    (first, split, last) session positions of each window: in-sample is
+    [first, split), out-of-sample [split, last). Windows step forward by
+    `out_of_sample`, so the out-of-sample spans tile the history.
+    """
+    windows = []
+    first = 0
+    while first + in_sample < sessions:
+        split = first + in_sample
+        windows.append((first, split, min(split + out_of_sample, sessions)))
+        first += out_of_sample
+    return windows
+
+
+def _init_worker(bars, algorithm, capital_base, cache=None, start=None,
+                 end=None):
+    logging.getLogger('turtle').setLevel(logging.WARNING)
+    if isinstance(bars, str):
+        bars = open_cube(bars, start, end)
+    _worker['bars'] = bars
+    _worker['indicators'] = IndicatorCache(
+        bars,
+        IndicatorStore(cache) if cache else None
+    )
+    _worker['engines'] = {}
+    _worker['algorithm'] = algorithm
+    _worker['capital_base'] = capital_base
+
+
+def _run_task(task):
+    key, first, last, params = task
+    engines = _worker['engines']
+    engine = engines.get((first, last))
+    if engine is None:
+        engine = engines[(first, last)] = ReplayEngine(
+            _worker['bars'].window(first, last),
+            capital_base=_worker['capital_base']
+        )
+
+    run_params = dict(params, indicators=_worker['indicators'])
+    result = engine.run(engine.load(_worker['algorithm']), run_params)
+    stats = performance(result.equity, engine.capital_base)
+    stats['transactions'] = len(result.transactions)
+    return key, stats, result.equity
+
+
+def _score(stats, objective):
+    score = stats[objective]
+    return -np.inf if score != score else score
+
+
+def walk_forward(bars, grid, in_sample, out_of_sample, processes=None,
+                 objective='sharpe', algorithm=ALGORITHM, capital_base=1e6,
+                 cache=None, start=None, end=None):
+    """
+    Walk `grid` forward over `bars` (a Bars object, or a cube path whose
+    sessions from `start` to `end` are used). With `cache`, a directory,
+    indicators persist there between runs (see indicators.IndicatorStore).
+
+    Returns a table with a row per window (its dates, the chosen point, its
+    in-sample score and out-of-sample performance) and the chained
+    out-of-sample equity curve.
+    """
+    if objective not in OBJECTIVES:
+        raise ValueError(
+            'Unknown objective %s (expected one of %s)'
+            % (objective, ', '.join(OBJECTIVES))
+        )
+    sessions = open_cube(bars, start, end).sessions if isinstance(bars, str)\
+        else bars.sessions
+    windows = walk_forward_windows(len(sessions), in_sample, out_of_sample)
+    if not windows:
+        raise ValueError(
+            'History of %i sessions is shorter than one in-sample window'
+            % len(sessions)
+        )
+    points = grid_points(grid)
+
+    initargs = (bars, algorithm, capital_base, cache, start, end)
+    if processes == 1:
+        _init_worker(*initargs)
+        run = lambda tasks: [_run_task(task) for task in tasks]
+        pool = None
+    else:
+        pool = multiprocessing.Pool(processes, _init_worker, initargs)
+        run = lambda tasks: list(pool.imap_unordered(_run_task, tasks))
+
+    try:
+        # Every window's in-sample points at once, then every chosen point
+        # out of sample at once
+        scores = {}
+        for (w, i), stats, equity in run([
+            ((w, i), first, split, params)
+            for w, (first, split, last) in enumerate(windows)
+            for i, params in enumerate(points)
+        ]):
+            scores[(w, i)] = stats
+
+        chosen = [
+            max(
+                range(len(points)),
+                key=lambda i: _score(scores[(w, i)], objective)
+            )
+            for w in range(len(windows))
+        ]
+
+        out_of_sample_runs = {}
+        for w, stats, equity in run([
+            (w, split, last, points[chosen[w]])
+            for w, (first, split, last) in enumerate(windows)
+        ]):
+            out_of_sample_runs[w] = (stats, equity)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    rows = []
+    curves = []
+    value = capital_base
+    for w, (first, split, last) in enumerate(windows):
+        stats, equity = out_of_sample_runs[w]
+        # Each window starts from capital_base; rescale it to carry on from
+        # where the previous window ended
+        curve = equity * (value / capital_base)
+        value = curve.iloc[-1]
+        curves.append(curve)
+
+        row = {
+            'in_sample_start': sessions[first],
+            'out_of_sample_start': sessions[split],
+            'out_of_sample_end': sessions[last - 1],
+        }
+        row.update(points[chosen[w]])
+        row['in_sample_' + objective] = scores[(w, chosen[w])][objective]
+        row.update(stats)
+        rows.append(row)
+
+    return pd.DataFrame(rows), pd.concat(curves).rename('portfolio_value')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('data', nargs='?',
+                        help='data directory or cube; omit to use synthetic bars')
+    parser.add_argument('--grid', action='append', default=[],
+                        metavar='NAME=V1,V2,...')
+    parser.add_argument('--in-sample', type=int, default=756,
+                        help='sessions per in-sample window')
+    parser.add_argument('--out-of-sample', type=int, default=252,
+                        help='sessions per out-of-sample window, and the step')
+    parser.add_argument('--objective', choices=OBJECTIVES, default='sharpe')
+    parser.add_argument('--processes', type=int, default=None)
+    parser.add_argument('--algorithm', default=ALGORITHM)
+    parser.add_argument('--start')
+    parser.add_argument('--end')
+    parser.add_argument('--capital', type=float, default=1e6)
+    parser.add_argument('--sessions', type=int, default=1260,
+                        help='synthetic sessions')
+    parser.add_argument('--indicator-cache', metavar='DIR',
+                        help='keep computed indicators on disk between runs')
+    parser.add_argument('--output', help='write the window table as CSV')
+    parser.add_argument('--equity', help='write the chained equity as CSV')
+    args = parser.parse_args(argv)
+
+    if args.data and is_cube(args.data):
+        bars = args.data
+    elif args.data:
+        bars = open_bars(args.data, start=args.start, end=args.end)
+    else:
+        bars = synthetic_bars(SYMBOLS, sessions=args.sessions)\
+            .between(args.start, args.end)
+
+    start_time = time()
+    windows, equity = walk_forward(
+        bars,
+        parse_grid(args.grid),
+        args.in_sample,
+        args.out_of_sample,
+        args.processes,
+        args.objective,
+        args.algorithm,
+        args.capital,
+        args.indicator_cache,
+        args.start,
+        args.end
+    )
+    elapsed = time() - start_time
+
+    pd.set_option('display.width', 200)
+    print(windows.to_string(index=False))
+    print('Chained out-of-sample value: %.2f' % equity.iloc[-1])
+    print('%i windows in %.1fs' % (len(windows), elapsed))
+    if args.output:
+        windows.to_csv(args.output, index=False)
+    if args.equity:
+        equity.to_csv(args.equity)
+
+
+if __name__ == '__main__':
+    main()